@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Функции чтения bot/database/queries.py: ORM-объекты против легких записей
+
+    python -m benchmarks.bench_queries --calls 2000
+    python -m benchmarks.bench_queries --database-url postgresql://.../sylvia_bench --calls 2000
+
+Для каждой функции сравниваются два варианта:
+
+    orm      - прежняя реализация: session.query(Model) и отсоединенные объекты
+    records  - текущая: выборка только нужных колонок в записи с __slots__
+
+и измеряются время вызова (мкс) и память (tracemalloc): сколько байт
+занимает удерживаемый результат одного вызова и пик выделений за вызов.
+
+Без --database-url стенд создается во временном файле SQLite. Заданная БД
+должна быть пустой (или созданной этим же скриптом): в нее добавляются
+пользователи с telegram_id от 9000000.
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+CASES = ('user', 'cards', 'templates', 'favorites')
+
+# Типичный объем настроек пользователя (JSON settings, который ORM загружает всегда)
+SETTINGS = {f"option_{i}": {'enabled': i % 2 == 0, 'value': 'x' * 16} for i in range(20)}
+
+TELEGRAM_ID_BASE = 9000000
+
+def seed(db, users, cards_per_user, favorites_per_user):
+    """Пользователи с визитками и избранным (если их еще нет)"""
+    from datetime import datetime
+    from bot.database.models import User, BusinessCard, FavoriteArticle
+    
+    db.init_db()
+    db.init_test_data()
+    
+    with db.session_scope() as session:
+        if session.query(User).filter_by(telegram_id=TELEGRAM_ID_BASE).first():
+            return
+        
+        now = datetime.utcnow()
+        for i in range(users):
+            user = User(
+                telegram_id=TELEGRAM_ID_BASE + i,
+                username=f"bench_user_{i}",
+                first_name='Bench',
+                shop_name=f"Магазин {i}",
+                referral_code=f"bq{i}",
+                registered_at=now,
+                settings=SETTINGS
+            )
+            session.add(user)
+            session.flush()
+            session.add_all(
+                BusinessCard(user_id=user.id, template_id=1, qr_type='shop', token=f"bq-{i}-{c}", created_at=now)
+                for c in range(cards_per_user)
+            )
+            session.add_all(
+                FavoriteArticle(user_id=user.id, article=str(10000000 + c), product_name=f"Товар {c}", added_at=now)
+                for c in range(favorites_per_user)
+            )
+
+def orm_variants(db):
+    """Прежние реализации функций чтения (возвращали ORM-объекты)"""
+    from bot.database.models import User, BusinessCard, Template, FavoriteArticle
+    
+    def get_user_by_telegram_id(telegram_id):
+        with db.session_scope() as session:
+            return session.query(User).filter_by(telegram_id=telegram_id).first()
+    
+    def get_user_cards(telegram_id, limit=10):
+        with db.session_scope() as session:
+            user = session.query(User).filter_by(telegram_id=telegram_id).first()
+            if not user:
+                return []
+            return session.query(BusinessCard).filter_by(user_id=user.id)\
+                .order_by(BusinessCard.created_at.desc()).limit(limit).all()
+    
+    def get_all_templates(active_only=True):
+        with db.session_scope() as session:
+            query = session.query(Template)
+            if active_only:
+                query = query.filter_by(is_active=True)
+            return query.order_by(Template.sort_order).all()
+    
+    def get_favorite_articles(telegram_id, limit=20):
+        with db.session_scope() as session:
+            user = session.query(User).filter_by(telegram_id=telegram_id).first()
+            if not user:
+                return []
+            return session.query(FavoriteArticle).filter_by(user_id=user.id)\
+                .order_by(FavoriteArticle.added_at.desc()).limit(limit).all()
+    
+    return {
+        'user': get_user_by_telegram_id,
+        'cards': get_user_cards,
+        'templates': get_all_templates,
+        'favorites': get_favorite_articles,
+    }
+
+def record_variants():
+    from bot.database import queries
+    
+    return {
+        'user': queries.get_user_by_telegram_id,
+        'cards': queries.get_user_cards,
+        'templates': queries.get_all_templates,
+        'favorites': queries.get_favorite_articles,
+    }
+
+def call_args(case, i, users):
+    if case == 'templates':
+        return ()
+    return (TELEGRAM_ID_BASE + i % users,)
+
+def measure_time(func, case, calls, users):
+    """Время вызова, мкс: среднее, p50, p95"""
+    durations = []
+    for i in range(calls):
+        args = call_args(case, i, users)
+        started = time.perf_counter()
+        func(*args)
+        durations.append((time.perf_counter() - started) * 1e6)
+    
+    durations.sort()
+    return {
+        'mean_us': round(sum(durations) / len(durations), 1),
+        'p50_us': round(durations[len(durations) // 2], 1),
+        'p95_us': round(durations[int(len(durations) * 0.95) - 1], 1),
+    }
+
+def measure_memory(func, case, calls, users):
+    """Удерживаемые байты на результат и пик выделений за вызов"""
+    tracemalloc.start()
+    try:
+        peaks = []
+        for i in range(min(calls, 200)):
+            args = call_args(case, i, users)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        
+        results = []
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(min(calls, 500)):
+            results.append(func(*call_args(case, i, users)))
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    
+    return {
+        'retained_bytes': round(retained / len(results)),
+        'peak_bytes': round(sum(peaks) / len(peaks)),
+    }
+
+def run(args):
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('BOT_TOKEN', 'bench')
+    
+    import logging
+    logging.disable(logging.CRITICAL)
+    
+    from bot.database import db
+    
+    seed(db, args.users, args.cards_per_user, args.favorites_per_user)
+    variants = {'orm': orm_variants(db), 'records': record_variants()}
+    
+    print(f"БД: {db.engine.url.render_as_string(hide_password=True)}, вызовов: {args.calls}")
+    print(f"{'функция':<11}{'вариант':<9}{'ср. мкс':>10}{'p50 мкс':>10}{'p95 мкс':>10}"
+          f"{'байт/результат':>16}{'пик байт':>10}")
+    
+    for case in args.cases:
+        rows = {}
+        for name, functions in variants.items():
+            func = functions[case]
+            for i in range(args.warmup):
+                func(*call_args(case, i, args.users))
+            rows[name] = dict(measure_time(func, case, args.calls, args.users),
+                              **measure_memory(func, case, args.calls, args.users))
+        
+        for name, row in rows.items():
+            print(f"{case:<11}{name:<9}{row['mean_us']:>10}{row['p50_us']:>10}{row['p95_us']:>10}"
+                  f"{row['retained_bytes']:>16}{row['peak_bytes']:>10}")
+        
+        orm, records = rows['orm'], rows['records']
+        print(f"{'':<11}{'выигрыш':<9}{orm['mean_us'] / records['mean_us']:>9.2f}x{'':>20}"
+              f"{orm['retained_bytes'] / max(records['retained_bytes'], 1):>15.2f}x"
+              f"{orm['peak_bytes'] / max(records['peak_bytes'], 1):>9.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="ORM-объекты против легких записей в функциях чтения")
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help="БД стенда (по умолчанию временный файл SQLite)")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--cards-per-user', type=int, default=10)
+    parser.add_argument('--favorites-per-user', type=int, default=20)
+    
+    args = parser.parse_args()
+    if args.database_url:
+        run(args)
+        return
+    
+    with tempfile.TemporaryDirectory(prefix='sylvia_bench_') as workdir:
+        args.database_url = f"sqlite:///{os.path.join(workdir, 'bench_queries.db')}"
+        run(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+
+"""
+Нагрузочный тест редирект-сервиса (web/app.py)
+
+Два шага:
+
+    # 1. Наполнить отдельную БД реалистичными данными
+    python -m benchmarks.bench_redirect seed --database-url postgresql://.../sylvia_bench \
+        --users 2000 --cards-per-user 25 --scans 500000
+    
+    # 2. Прогнать смесь запросов и получить пропускную способность и p50/p95/p99
+    python -m benchmarks.bench_redirect run --database-url postgresql://.../sylvia_bench \
+        --requests 20000 --concurrency 32 --mix hit=80,miss=5,stats=10,card=5 \
+        --pool-size 16 --label pool-16 --output bench_results.jsonl
+
+Виды запросов в --mix:
+    hit    - /go/<token> существующей визитки (пишет сканирование)
+    miss   - /go/<token> несуществующего токена
+    stats  - /api/stats/<user_id>
+    card   - /api/card/<token>
+    batch  - /api/cards/batch на --batch-size визиток
+
+Без --url приложение вызывается в процессе через WSGI test client (измеряется
+приложение и БД без HTTP-стека); с --url запросы идут по HTTP к уже запущенному
+сервису (gunicorn, web.async_app и т.п.). Параметры --pool-size и
+--stats-revalidate позволяют сравнить конфигурации: результаты каждого прогона
+дописываются строкой JSON в --output.
+
+Сервис работает только с PostgreSQL (SQL в web/app.py использует ON CONFLICT,
+ANY, LATERAL и серверные курсоры), поэтому и стенд поднимается на PostgreSQL.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from bot.database.models import Base
+
+REQUEST_KINDS = ('hit', 'miss', 'stats', 'card', 'batch')
+
+# ========== НАПОЛНЕНИЕ БД ==========
+
+def seed(args):
+    """Наполнение БД пользователями, визитками и сканированиями"""
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(bind=engine)
+    
+    with engine.begin() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM users")).scalar()
+        if existing and not args.reset:
+            sys.exit(f"В БД уже есть {existing} пользователей. "
+                     f"Используйте отдельную БД или --reset (очистит все таблицы).")
+        
+        if args.reset:
+            tables = ', '.join(t.name for t in Base.metadata.sorted_tables)
+            conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        
+        started = time.perf_counter()
+        
+        conn.execute(text("""
+            INSERT INTO users (telegram_id, username, shop_name, shop_url_wb,
+                               registered_at, last_activity, is_active, is_admin,
+                               cards_created, scans_received, referral_code, referral_balance)
+            SELECT
+                1000000 + g,
+                'bench_user_' || g,
+                'Магазин ' || g,
+                CASE WHEN g % 3 = 0 THEN NULL
+                     ELSE 'https://www.wildberries.ru/seller/' || g END,
+                NOW() - (random() * INTERVAL '365 days'),
+                NOW() - (random() * INTERVAL '30 days'),
+                TRUE, FALSE, 0, 0,
+                'bench' || g,
+                0
+            FROM generate_series(1, :users) g
+        """), {'users': args.users})
+        
+        # Визитки распределены неравномерно: у части продавцов их намного больше
+        conn.execute(text("""
+            INSERT INTO business_cards (user_id, created_at, template_id, qr_type,
+                                        target_article, collection_id, token, scan_count)
+            SELECT
+                u.id,
+                NOW() - (random() * INTERVAL '180 days'),
+                1 + (c % 3),
+                (ARRAY['shop', 'product', 'product', 'collection'])[1 + (c % 4)],
+                (10000000 + c * 7 + u.id)::text,
+                CASE WHEN c % 4 = 3 THEN 'col' || u.id || '_' || c END,
+                'bench-' || u.id || '-' || c,
+                0
+            FROM users u
+            CROSS JOIN LATERAL generate_series(
+                1, GREATEST(1, (:cards * 2 * random() * random() * 2)::int)
+            ) c
+        """), {'cards': args.cards_per_user})
+        
+        # Сканирования: «горячие» визитки получают большую часть переходов
+        conn.execute(text("""
+            INSERT INTO scans (card_id, scanned_at, ip_address, user_agent, referer)
+            SELECT
+                1 + floor(power(random(), 3) * mx.max_id)::int,
+                (NOW() AT TIME ZONE 'utc') - (random() * INTERVAL '90 days'),
+                '10.' || (g % 250) || '.' || (g / 250 % 250) || '.' || (random() * 250)::int,
+                'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) bench/' || (g % 50),
+                ''
+            FROM generate_series(1, :scans) g
+            CROSS JOIN (SELECT MAX(id) AS max_id FROM business_cards) mx
+        """), {'scans': args.scans})
+        
+        # Счетчики, которые в рабочем режиме ведет сервис
+        conn.execute(text("""
+            UPDATE business_cards bc
+            SET scan_count = s.cnt, last_scan = s.last
+            FROM (
+                SELECT card_id, COUNT(*) AS cnt, MAX(scanned_at) AS last
+                FROM scans GROUP BY card_id
+            ) s
+            WHERE s.card_id = bc.id
+        """))
+        conn.execute(text("""
+            INSERT INTO card_daily_stats (card_id, day, scans)
+            SELECT card_id, scanned_at::date, COUNT(*)
+            FROM scans GROUP BY card_id, scanned_at::date
+        """))
+        conn.execute(text("""
+            UPDATE users u
+            SET cards_created = c.cnt
+            FROM (SELECT user_id, COUNT(*) AS cnt FROM business_cards GROUP BY user_id) c
+            WHERE c.user_id = u.id
+        """))
+        
+        counts = {
+            table: conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            for table in ('users', 'business_cards', 'scans', 'card_daily_stats')
+        }
+    
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text("ANALYZE"))
+    
+    elapsed = time.perf_counter() - started
+    print(f"БД наполнена за {elapsed:.1f} с: " + ', '.join(f"{k}={v}" for k, v in counts.items()))
+
+# ========== ПРОГОН ==========
+
+def parse_mix(raw):
+    """Разбор --mix вида hit=80,miss=10,stats=10"""
+    mix = {}
+    for part in raw.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise argparse.ArgumentTypeError(f"Неизвестный вид запроса: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+def load_targets(database_url, sample_size):
+    """Случайная выборка токенов и продавцов, к которым пойдут запросы"""
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        tokens = [r[0] for r in conn.execute(text(
+            "SELECT token FROM business_cards ORDER BY random() LIMIT :n"
+        ), {'n': sample_size})]
+        user_ids = [r[0] for r in conn.execute(text(
+            "SELECT DISTINCT user_id FROM business_cards ORDER BY 1 LIMIT :n"
+        ), {'n': sample_size})]
+    engine.dispose()
+    
+    if not tokens:
+        sys.exit("В БД нет визиток - сначала выполните seed")
+    return tokens, user_ids
+
+class InProcessClient:
+    """Запросы к web/app.py через WSGI test client в этом же процессе"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+    
+    def request(self, method, path, headers=None, json_body=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, headers=headers, json=json_body)
+        response.get_data()
+        return response.status_code, response.headers.get('ETag')
+
+class HttpClient:
+    """Запросы по HTTP к запущенному сервису"""
+    
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+    
+    def request(self, method, path, headers=None, json_body=None):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.base_url + path, headers=headers,
+                                   json=json_body, allow_redirects=False, timeout=30)
+        return response.status_code, response.headers.get('ETag')
+
+def make_request(client, kind, tokens, user_ids, args, etags):
+    """Выполнение одного запроса указанного вида"""
+    if kind == 'hit':
+        status, _ = client.request('GET', f"/go/{random.choice(tokens)}")
+        return status == 200
+    
+    if kind == 'miss':
+        status, _ = client.request('GET', f"/go/missing-{random.getrandbits(48):x}")
+        return status == 404
+    
+    if kind == 'stats':
+        user_id = random.choice(user_ids)
+        headers = {'Accept-Encoding': 'gzip'}
+        if args.stats_revalidate and user_id in etags:
+            headers['If-None-Match'] = etags[user_id]
+        status, etag = client.request('GET', f"/api/stats/{user_id}", headers=headers)
+        if etag:
+            etags[user_id] = etag
+        return status in (200, 304)
+    
+    if kind == 'card':
+        status, _ = client.request('GET', f"/api/card/{random.choice(tokens)}")
+        return status == 200
+    
+    if kind == 'batch':
+        batch = random.sample(tokens, min(args.batch_size, len(tokens)))
+        status, _ = client.request('POST', '/api/cards/batch', json_body={'tokens': batch})
+        return status == 200
+
+def percentile(sorted_values, pct):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+def run(args):
+    """Прогон смеси запросов и вывод результатов"""
+    tokens, user_ids = load_targets(args.database_url, args.sample)
+    
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        # Настройки web/app.py читаются из окружения при импорте
+        os.environ['DATABASE_URL'] = args.database_url
+        os.environ['WEB_DB_POOL_SIZE'] = str(args.pool_size)
+        import logging
+        logging.disable(logging.WARNING)
+        from web.app import app
+        client = InProcessClient(app)
+    
+    kinds = list(args.mix)
+    weights = [args.mix[k] for k in kinds]
+    plan = random.choices(kinds, weights=weights, k=args.warmup + args.requests)
+    
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    etags = {}
+    lock = threading.Lock()
+    
+    def worker(i):
+        kind = plan[i]
+        started = time.perf_counter()
+        try:
+            ok = make_request(client, kind, tokens, user_ids, args, etags)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        
+        if i < args.warmup:
+            return
+        with lock:
+            latencies[kind].append(elapsed)
+            if not ok:
+                errors[kind] += 1
+    
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.warmup)))
+        
+        started = time.perf_counter()
+        list(executor.map(worker, range(args.warmup, len(plan))))
+        wall = time.perf_counter() - started
+    
+    all_latencies = [v for values in latencies.values() for v in values]
+    result = {
+        'label': args.label,
+        'timestamp': datetime.utcnow().isoformat(),
+        'target': args.url or 'in-process',
+        'pool_size': None if args.url else args.pool_size,
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'requests': len(all_latencies),
+        'errors': sum(errors.values()),
+        'duration_s': round(wall, 3),
+        'throughput_rps': round(len(all_latencies) / wall, 1) if wall else 0.0,
+        'overall': summarize(all_latencies),
+        'by_kind': {
+            kind: dict(summarize(values), errors=errors[kind])
+            for kind, values in latencies.items()
+        },
+    }
+    
+    print_result(result)
+    
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+def print_result(result):
+    print(f"\n== {result['label'] or 'run'} ({result['target']}, "
+          f"concurrency={result['concurrency']}, pool={result['pool_size']}) ==")
+    print(f"Запросов: {result['requests']}, ошибок: {result['errors']}, "
+          f"время: {result['duration_s']} с, {result['throughput_rps']} req/s")
+    print(f"{'вид':<8}{'кол-во':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}{'ошибки':>8}")
+    rows = sorted(result['by_kind'].items(), key=lambda item: REQUEST_KINDS.index(item[0])) + [('ВСЕГО', dict(result['overall'], errors=result['errors']))]
+    for kind, s in rows:
+        print(f"{kind:<8}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}{s['errors']:>8}")
+
+# ========== CLI ==========
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест редирект-сервиса")
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL', os.getenv('DATABASE_URL')),
+                        help="БД стенда (по умолчанию BENCH_DATABASE_URL или DATABASE_URL)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    seed_parser = commands.add_parser('seed', help="наполнить БД")
+    seed_parser.add_argument('--users', type=int, default=2000)
+    seed_parser.add_argument('--cards-per-user', type=int, default=25)
+    seed_parser.add_argument('--scans', type=int, default=500000)
+    seed_parser.add_argument('--reset', action='store_true', help="очистить таблицы перед наполнением")
+    
+    run_parser = commands.add_parser('run', help="прогнать нагрузку")
+    run_parser.add_argument('--url', help="адрес запущенного сервиса; без него - в процессе")
+    run_parser.add_argument('--requests', type=int, default=5000)
+    run_parser.add_argument('--warmup', type=int, default=200)
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--mix', type=parse_mix, default=parse_mix('hit=80,miss=5,stats=10,card=5'))
+    run_parser.add_argument('--pool-size', type=int, default=0,
+                            help="WEB_DB_POOL_SIZE для режима в процессе (0 - без пула)")
+    run_parser.add_argument('--stats-revalidate', action='store_true',
+                            help="повторять /api/stats с If-None-Match (проверка 304)")
+    run_parser.add_argument('--batch-size', type=int, default=50)
+    run_parser.add_argument('--sample', type=int, default=5000, help="сколько токенов/продавцов взять из БД")
+    run_parser.add_argument('--label', default='')
+    run_parser.add_argument('--output', help="файл JSONL для накопления результатов")
+    
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("укажите --database-url или BENCH_DATABASE_URL")
+    
+    if args.command == 'seed':
+        seed(args)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение режимов SQLite бота (bot/database/db.py)
+
+    python -m benchmarks.bench_sqlite --threads 8 --ops 5000 --mix scan=40,stats=40,card=20 \
+        --synchronous NORMAL --output bench_results.jsonl
+
+Для каждого режима создается свежий файл БД, наполняется пользователями и
+визитками, после чего --threads потоков выполняют смесь операций через
+bot.database.queries (те же функции, что вызывают обработчики бота):
+
+    scan   - record_scan (запись)
+    stats  - get_user_stats (чтение)
+    card   - get_card_stats (чтение)
+
+Режимы:
+    default - как раньше: NullPool, журнал и synchronous по умолчанию
+    tuned   - SQLITE_TUNED=1: пул соединений, WAL, шлюз писателя
+
+Настройки движка читаются из окружения при импорте bot.database.db, поэтому
+каждый режим запускается в отдельном процессе.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+OPERATION_KINDS = ('scan', 'stats', 'card')
+MODES = ('default', 'tuned')
+
+def parse_mix(raw):
+    """Разбор --mix вида scan=40,stats=40,card=20"""
+    mix = {}
+    for part in raw.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in OPERATION_KINDS:
+            raise argparse.ArgumentTypeError(f"Неизвестная операция: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+# ========== ПРОГОН ОДНОГО РЕЖИМА (дочерний процесс) ==========
+
+def seed(queries, users, cards_per_user):
+    """Пользователи и визитки стенда; возвращает (telegram_id, id визиток)"""
+    telegram_ids = []
+    card_ids = []
+    for i in range(users):
+        telegram_id = 1000000 + i
+        queries.get_or_create_user(telegram_id, username=f"bench_user_{i}")
+        telegram_ids.append(telegram_id)
+        for c in range(cards_per_user):
+            card_ids.append(queries.create_business_card(telegram_id, 1, 'shop', f"bench-{i}-{c}"))
+    return telegram_ids, card_ids
+
+def run_mode(args):
+    """Прогон смеси операций в текущем процессе; результат - строка JSON в stdout"""
+    import logging
+    logging.disable(logging.CRITICAL)
+    
+    from bot.database import db
+    from bot.database import queries
+    from benchmarks.bench_redirect import summarize
+    
+    db.init_db()
+    db.init_test_data()
+    telegram_ids, card_ids = seed(queries, args.users, args.cards_per_user)
+    
+    kinds = list(args.mix)
+    weights = [args.mix[k] for k in kinds]
+    plan = random.choices(kinds, weights=weights, k=args.warmup + args.ops)
+    
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    
+    def worker(i):
+        kind = plan[i]
+        started = time.perf_counter()
+        try:
+            if kind == 'scan':
+                queries.record_scan(random.choice(card_ids), f"10.0.{i % 250}.{i % 200}", 'bench')
+            elif kind == 'stats':
+                queries.get_user_stats(random.choice(telegram_ids))
+            else:
+                queries.get_card_stats(random.choice(card_ids))
+            ok = True
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        
+        if i < args.warmup:
+            return
+        with lock:
+            latencies[kind].append(elapsed)
+            if not ok:
+                errors[kind] += 1
+    
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(worker, range(args.warmup)))
+        
+        started = time.perf_counter()
+        list(executor.map(worker, range(args.warmup, len(plan))))
+        wall = time.perf_counter() - started
+    
+    all_latencies = [v for values in latencies.values() for v in values]
+    result = {
+        'mode': args.worker,
+        'ops': len(all_latencies),
+        'errors': sum(errors.values()),
+        'duration_s': round(wall, 3),
+        'throughput_ops': round(len(all_latencies) / wall, 1) if wall else 0.0,
+        'overall': summarize(all_latencies),
+        'by_kind': {
+            kind: dict(summarize(values), errors=errors[kind])
+            for kind, values in latencies.items()
+        },
+    }
+    if db.writer_gate is not None:
+        result['writer'] = db.writer_gate.stats()
+    
+    print(json.dumps(result))
+
+# ========== СРАВНЕНИЕ РЕЖИМОВ ==========
+
+def spawn_mode(mode, args, workdir):
+    """Прогон режима в отдельном процессе со своим файлом БД"""
+    path = os.path.join(workdir, f"bench_{mode}.db")
+    env = dict(os.environ)
+    env.setdefault('BOT_TOKEN', 'bench')
+    env['DATABASE_URL'] = f"sqlite:///{path}"
+    env['SQLITE_TUNED'] = '1' if mode == 'tuned' else '0'
+    env['SQLITE_SYNCHRONOUS'] = args.synchronous
+    env['SQLITE_MMAP_SIZE'] = str(args.mmap_size)
+    env['SQLITE_POOL_SIZE'] = str(args.pool_size)
+    
+    command = [
+        sys.executable, '-m', 'benchmarks.bench_sqlite', '--worker', mode,
+        '--threads', str(args.threads), '--ops', str(args.ops), '--warmup', str(args.warmup),
+        '--users', str(args.users), '--cards-per-user', str(args.cards_per_user),
+        '--mix', ','.join(f"{k}={v:g}" for k, v in args.mix.items())
+    ]
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.exit(f"Режим {mode} завершился с ошибкой:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def compare(args):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='sylvia_bench_') as workdir:
+        for mode in args.modes:
+            result = spawn_mode(mode, args, workdir)
+            result.update({
+                'label': args.label,
+                'timestamp': datetime.utcnow().isoformat(),
+                'threads': args.threads,
+                'mix': args.mix,
+                'synchronous': args.synchronous if mode == 'tuned' else None,
+            })
+            print_result(result)
+            results.append(result)
+    
+    if len(results) == 2 and results[0]['throughput_ops']:
+        speedup = results[1]['throughput_ops'] / results[0]['throughput_ops']
+        print(f"\n{results[1]['mode']} / {results[0]['mode']}: x{speedup:.2f} по пропускной способности")
+    
+    if args.output:
+        with open(args.output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+def print_result(result):
+    print(f"\n== {result['mode']} (threads={result['threads']}, synchronous={result['synchronous']}) ==")
+    print(f"Операций: {result['ops']}, ошибок: {result['errors']}, "
+          f"время: {result['duration_s']} с, {result['throughput_ops']} оп/с")
+    if 'writer' in result:
+        writer = result['writer']
+        print(f"Шлюз писателя: {writer['writes']} записей, ожиданий {writer['contended']}, "
+              f"всего {writer['wait_ms']} мс")
+    print(f"{'вид':<8}{'кол-во':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}{'ошибки':>8}")
+    rows = sorted(result['by_kind'].items(), key=lambda item: OPERATION_KINDS.index(item[0])) + [('ВСЕГО', dict(result['overall'], errors=result['errors']))]
+    for kind, s in rows:
+        print(f"{kind:<8}{s['count']:>8}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['max_ms']:>10}{s['errors']:>8}")
+
+# ========== CLI ==========
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение режимов SQLite бота")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('scan=40,stats=40,card=20'))
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--cards-per-user', type=int, default=10)
+    parser.add_argument('--synchronous', default='NORMAL', help="SQLITE_SYNCHRONOUS для режима tuned")
+    parser.add_argument('--mmap-size', type=int, default=256 * 1024 * 1024)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help="файл JSONL для накопления результатов")
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    
+    args = parser.parse_args()
+    if args.worker:
+        run_mode(args)
+    else:
+        compare(args)
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,36 @@ if not BOT_TOKEN:
 # База данных
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///sylvia.db')
 
+# Реплика для аналитических чтений (статистика, админка); пусто - все запросы к основной БД
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL', '')
+# Допустимое отставание реплики, секунд (больше - чтение с основной БД)
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+# Как часто проверять отставание, секунд
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 1))
+
+# Производительный режим SQLite (пул соединений, WAL, один писатель)
+SQLITE_TUNED = os.getenv('SQLITE_TUNED', '0').lower() in ('1', 'true', 'yes')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 8))
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 5))
+
+# Секции таблицы scans (PostgreSQL): на сколько месяцев вперед создавать
+SCANS_PARTITION_MONTHS_AHEAD = int(os.getenv('SCANS_PARTITION_MONTHS_AHEAD', 3))
+# Сколько месяцев сканирований держать в БД (старые переносятся в архив; 0 - не переносить)
+SCANS_RETENTION_MONTHS = int(os.getenv('SCANS_RETENTION_MONTHS', 12))
+# Каталог архивных файлов сканирований (Parquet)
+SCANS_ARCHIVE_DIR = os.getenv('SCANS_ARCHIVE_DIR', 'archive/scans')
+
+# Запросы к БД дольше стольких миллисекунд пишутся в журнал медленных запросов (/metrics бота)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+
+# Сколько пользователей держать в кеше telegram_id -> id (0 - выключено)
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+
+# Кеш шаблонов: через сколько секунд перечитывать без изменений из админки (0 - только по версии)
+TEMPLATE_CACHE_TTL = float(os.getenv('TEMPLATE_CACHE_TTL', 300))
+
 # URL для редиректов
 REDIRECT_BASE_URL = os.getenv('REDIRECT_BASE_URL', 'http://localhost:5000')
 
@@ -1,3 +1,4 @@
 # Пакет базы данных
 from bot.database.db import SessionLocal, init_db, get_db
-from bot.database.models import Base, User, BusinessCard, Scan, Template, FavoriteArticle, Payment, Referral
+from bot.database.models import Base, User, BusinessCard, Scan, Template, FavoriteArticle, Payment, Referral, CardDailyStat, CardRegionStat, ScanSketch, GlobalCounter, ScanArchive, Collection
+from bot.database.records import UserRecord, UserBrief, CardRecord, TemplateRecord, FavoriteRecord, PaymentRecord
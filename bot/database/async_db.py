@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный доступ к базе данных для обработчиков (SQLAlchemy asyncio)
+
+Драйверы: asyncpg для PostgreSQL и aiosqlite для SQLite. Функции
+queries.py выполняются через AsyncSession.run_sync: код запросов общий с
+синхронным API, а ввод-вывод идет через асинхронный драйвер и не
+блокирует цикл событий, пока ждет ответа БД.
+
+Запросы подряд в обработчике можно объединить в async_unit_of_work():
+одна AsyncSession, одно соединение и один коммит - как синхронные запросы
+внутри unit_of_work(). Единица работы охватывает только обращения к БД:
+ответы Telegram и запросы к маркетплейсам выполняются после выхода из нее,
+когда транзакция закоммичена, а соединение вернулось в пул. Синхронной
+сессии у нее нет: синхронный запрос из обработчика остановил бы цикл
+событий, поэтому session_scope() внутри (вне run_sync) вызывает ошибку.
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
+
+from bot.config import (
+    DATABASE_URL, DATABASE_REPLICA_URL, SQLITE_TUNED, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_POOL_SIZE, SQLITE_BUSY_TIMEOUT
+)
+from bot.database.db import (
+    SessionLocal, UnitOfWork, current_unit, unit_of_work_stats, count_query, count_checkout
+)
+from bot.database.instrumentation import db_metrics, timed_pool, instrument_engine
+from bot.database.sqlite_tuning import apply_pragmas, is_memory_url
+
+logger = logging.getLogger(__name__)
+
+def async_database_url(url):
+    """URL с асинхронным драйвером (postgresql+asyncpg, sqlite+aiosqlite)"""
+    scheme, separator, rest = url.partition('://')
+    if not separator:
+        raise ValueError(f"Некорректный DATABASE_URL: {url}")
+    
+    dialect = scheme.split('+')[0]
+    if dialect in ('postgresql', 'postgres'):
+        return f"postgresql+asyncpg://{rest}"
+    if dialect == 'sqlite':
+        return f"sqlite+aiosqlite://{rest}"
+    
+    raise ValueError(f"Нет асинхронного драйвера для {dialect}")
+
+def create_engine_for(url, name):
+    """
+    Асинхронный движок с теми же настройками пула, что и синхронный
+    
+    name - имя замеров движка в db_metrics (/metrics бота).
+    """
+    metrics = db_metrics.engine(name)
+    if url.startswith('sqlite'):
+        if SQLITE_TUNED and not is_memory_url(url):
+            engine = create_async_engine(
+                async_database_url(url),
+                poolclass=timed_pool(AsyncAdaptedQueuePool, metrics),
+                pool_size=SQLITE_POOL_SIZE,
+                max_overflow=SQLITE_POOL_SIZE,
+                echo=False
+            )
+            # Шлюз писателя здесь не нужен: aiosqlite ждет блокировку в своем
+            # потоке (busy_timeout), не останавливая цикл событий
+            apply_pragmas(engine.sync_engine, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT)
+        else:
+            engine = create_async_engine(async_database_url(url), poolclass=timed_pool(NullPool, metrics), echo=False)
+    else:
+        engine = create_async_engine(
+            async_database_url(url),
+            poolclass=timed_pool(AsyncAdaptedQueuePool, metrics),
+            pool_size=5,
+            max_overflow=10,
+            pool_pre_ping=True,
+            echo=False
+        )
+    
+    instrument_engine(engine.sync_engine, metrics)
+    return engine
+
+async_engine = create_engine_for(DATABASE_URL, 'async')
+
+# Реплика: read_session_scope() внутри run_sync читает через нее, не блокируя цикл событий
+async_replica_engine = create_engine_for(DATABASE_REPLICA_URL, 'async_replica') if DATABASE_REPLICA_URL else None
+
+# Счетчики запросов и соединений единицы работы (как у синхронного движка)
+for counted_engine in filter(None, (async_engine, async_replica_engine)):
+    event.listen(counted_engine.sync_engine, 'before_cursor_execute', count_query)
+    event.listen(counted_engine.sync_engine, 'checkout', count_checkout)
+
+# expire_on_commit=False: ленивая загрузка атрибутов после коммита в async недоступна.
+# Класс синхронной сессии общий с SessionLocal, чтобы действовали ее события.
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    sync_session_class=SessionLocal.class_,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+@asynccontextmanager
+async def async_session_scope():
+    """
+    AsyncSession текущей единицы работы или отдельная сессия с коммитом
+    
+    Внутри async_unit_of_work() коммит выполняет единица работы, а ошибка
+    откатывает всю ее транзакцию, и та уже не коммитится.
+    """
+    unit = current_unit.get()
+    if unit is not None and unit.async_session is not None:
+        rollbacks = unit.rollbacks
+        try:
+            yield unit.async_session
+        except Exception as e:
+            # Ошибку в session_scope() внутри run_sync уже откатили и учли
+            if unit.rollbacks == rollbacks:
+                await unit.async_session.rollback()
+                unit.rollbacks += 1
+                logger.error(f"Ошибка в сессии БД: {e}")
+            raise
+        return
+    
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Ошибка в сессии БД: {e}")
+        raise
+    finally:
+        await session.close()
+
+def call_in_session(sync_session, parent, func, args, kwargs):
+    """
+    Вызов синхронной функции запросов внутри run_sync
+    
+    run_sync выполняет функцию в отдельном greenlet со своим контекстом,
+    поэтому единица работы с sync_session устанавливается здесь: session_scope()
+    в функции присоединяется к ней, а счетчики переносятся в parent.
+    """
+    unit = UnitOfWork(parent.label if parent else None, session=sync_session)
+    if async_replica_engine is not None:
+        unit.replica_bind = async_replica_engine.sync_engine
+    token = current_unit.set(unit)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        current_unit.reset(token)
+        if parent is not None:
+            parent.absorb(unit)
+
+async def run_query(func, *args, **kwargs):
+    """Выполнить функцию queries.py через асинхронный драйвер"""
+    parent = current_unit.get()
+    async with async_session_scope() as session:
+        return await session.run_sync(call_in_session, parent, func, args, kwargs)
+
+def async_query(func):
+    """Асинхронный вариант функции queries.py с той же сигнатурой"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_query(func, *args, **kwargs)
+    return wrapper
+
+@asynccontextmanager
+async def async_unit_of_work(label=None):
+    """
+    Одна AsyncSession и один коммит на группу запросов обработчика
+    
+    Все асинхронные запросы внутри используют сессию единицы работы.
+    Внутри не должно быть ожидания Telegram или HTTP: соединение и
+    транзакция (в SQLite - блокировка записи) держатся до выхода, а
+    результат, отправленный пользователю до коммита, может не сохраниться.
+    Вложенная единица работы присоединяется к внешней.
+    """
+    unit = current_unit.get()
+    if unit is not None:
+        yield unit
+        return
+    
+    unit = UnitOfWork(label, async_session=AsyncSessionLocal())
+    token = current_unit.set(unit)
+    failed = False
+    try:
+        yield unit
+        unit.check_commit()
+        await unit.async_session.commit()
+    except Exception:
+        failed = True
+        await unit.async_session.rollback()
+        raise
+    finally:
+        current_unit.reset(token)
+        await unit.async_session.close()
+        unit_of_work_stats.observe(unit, failed)
+        logger.debug(f"{unit.label or 'Единица работы'}: запросов {unit.queries}, "
+                     f"соединений {unit.checkouts}, {unit.elapsed_ms:.1f} мс")
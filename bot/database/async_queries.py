@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронные запросы к базе данных для обработчиков
+
+Те же функции и сигнатуры, что в queries.py, но вызываются через await и
+не блокируют цикл событий на время обращения к БД:
+
+    template = await get_template(template_id)
+"""
+
+from bot.database import queries
+from bot.database.async_db import async_query
+
+# ========== ПОЛЬЗОВАТЕЛИ ==========
+
+get_or_create_user = async_query(queries.get_or_create_user)
+get_user_by_telegram_id = async_query(queries.get_user_by_telegram_id)
+get_user_by_referral_code = async_query(queries.get_user_by_referral_code)
+update_user_shop_info = async_query(queries.update_user_shop_info)
+get_all_users = async_query(queries.get_all_users)
+get_users_page = async_query(queries.get_users_page)
+count_users = async_query(queries.count_users)
+get_user_stats = async_query(queries.get_user_stats)
+
+# ========== ВИЗИТКИ ==========
+
+create_business_card = async_query(queries.create_business_card)
+get_user_cards = async_query(queries.get_user_cards)
+get_card_by_token = async_query(queries.get_card_by_token)
+record_scan = async_query(queries.record_scan)
+get_card_stats = async_query(queries.get_card_stats)
+
+# ========== ШАБЛОНЫ ==========
+
+get_all_templates = async_query(queries.get_all_templates)
+get_template = async_query(queries.get_template)
+get_templates_by_category = async_query(queries.get_templates_by_category)
+toggle_template = async_query(queries.toggle_template)
+
+# ========== ИЗБРАННЫЕ АРТИКУЛЫ ==========
+
+add_favorite_article = async_query(queries.add_favorite_article)
+get_favorite_articles = async_query(queries.get_favorite_articles)
+remove_favorite_article = async_query(queries.remove_favorite_article)
+
+# ========== ПЛАТЕЖИ ==========
+
+create_payment = async_query(queries.create_payment)
+confirm_payment = async_query(queries.confirm_payment)
+get_user_payments = async_query(queries.get_user_payments)
+
+# ========== РЕФЕРАЛЬНАЯ СИСТЕМА ==========
+
+process_referral = async_query(queries.process_referral)
+get_referral_stats = async_query(queries.get_referral_stats)
+use_referral_balance = async_query(queries.use_referral_balance)
+
+# ========== АДМИНКА ==========
+
+get_admin_stats = async_query(queries.get_admin_stats)
@@ -4,34 +4,62 @@
 Подключение к базе данных и управление сессиями
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text, select, delete, func
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
 import logging
+import threading
+import time
 from contextlib import contextmanager
+from contextvars import ContextVar
 
-from bot.config import DATABASE_URL
-from bot.database.models import Base
+from bot.config import (
+    DATABASE_URL, SQLITE_TUNED, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_POOL_SIZE, SQLITE_BUSY_TIMEOUT,
+    DATABASE_REPLICA_URL, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL, SCANS_PARTITION_MONTHS_AHEAD
+)
+from bot.database.models import Base, FavoriteArticle
+from bot.database.instrumentation import db_metrics, timed_pool, instrument_engine
+from bot.database.partitions import init_partitions
+from bot.database.sqlite_tuning import create_tuned_engine, is_memory_url
+from bot.utils.replica import REPLICATION_LAG_SQL, LagGuard
 
 logger = logging.getLogger(__name__)
 
+# Шлюз писателя (только в производительном режиме SQLite)
+writer_gate = None
+
 # Создание движка базы данных
-if DATABASE_URL.startswith('sqlite'):
+engine_metrics = db_metrics.engine('primary')
+if DATABASE_URL.startswith('sqlite') and SQLITE_TUNED and not is_memory_url(DATABASE_URL):
+    engine, writer_gate = create_tuned_engine(
+        DATABASE_URL,
+        pool_size=SQLITE_POOL_SIZE,
+        synchronous=SQLITE_SYNCHRONOUS,
+        mmap_size=SQLITE_MMAP_SIZE,
+        busy_timeout=SQLITE_BUSY_TIMEOUT,
+        poolclass=timed_pool(QueuePool, engine_metrics)
+    )
+elif DATABASE_URL.startswith('sqlite'):
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False},
-        poolclass=NullPool,
+        poolclass=timed_pool(NullPool, engine_metrics),
         echo=False
     )
 else:
     engine = create_engine(
         DATABASE_URL,
+        poolclass=timed_pool(QueuePool, engine_metrics),
         pool_size=5,
         max_overflow=10,
         pool_pre_ping=True,
         echo=False
     )
 
+# Время запросов, медленные запросы и пул - в db_metrics (/metrics бота)
+instrument_engine(engine, engine_metrics)
+
 # Фабрика сессий
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -42,10 +70,225 @@ SessionLocal = sessionmaker(
 # Scoped session для потокобезопасности
 db_session = scoped_session(SessionLocal)
 
+# Реплика для аналитических чтений (read_session_scope)
+replica_engine = None
+replica_metrics = db_metrics.engine('replica')
+if DATABASE_REPLICA_URL.startswith('sqlite'):
+    replica_engine = create_engine(
+        DATABASE_REPLICA_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=timed_pool(NullPool, replica_metrics),
+        echo=False
+    )
+elif DATABASE_REPLICA_URL:
+    replica_engine = create_engine(
+        DATABASE_REPLICA_URL,
+        poolclass=timed_pool(QueuePool, replica_metrics),
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=True,
+        echo=False
+    )
+
+if replica_engine is not None:
+    instrument_engine(replica_engine, replica_metrics)
+
+ReplicaSession = sessionmaker(autocommit=False, autoflush=False)
+replica_guard = LagGuard(REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL)
+
+# ========== ЕДИНИЦА РАБОТЫ ==========
+
+class UnitOfWork:
+    """Сессия группы запросов (обработчика, задачи) и счетчики обращений к БД"""
+    
+    def __init__(self, label=None, session=None, async_session=None):
+        self.label = label
+        # Синхронная сессия (None у асинхронной единицы работы, см. async_db)
+        self.session = session
+        # AsyncSession асинхронной единицы работы
+        self.async_session = async_session
+        # Движок реплики для read_session_scope (в run_sync - асинхронный, см. async_db)
+        self.replica_bind = None
+        self.queries = 0
+        self.checkouts = 0
+        # Откаты из-за ошибок запросов (session_scope): после отката коммит запрещен
+        self.rollbacks = 0
+        self.started = time.perf_counter()
+    
+    def absorb(self, other):
+        """Добавить счетчики вложенной единицы работы"""
+        self.queries += other.queries
+        self.checkouts += other.checkouts
+        self.rollbacks += other.rollbacks
+    
+    @property
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+    
+    def check_commit(self):
+        """
+        Перед коммитом: транзакция не должна была откатываться
+        
+        Ошибка запроса откатывает всю транзакцию, в том числе более ранние
+        изменения. Если обработчик перехватил ошибку и продолжил, коммит
+        сохранил бы только изменения после отката - поэтому единица работы
+        завершается ошибкой и откатывает их тоже.
+        """
+        if self.rollbacks:
+            raise RuntimeError(f"{self.label or 'Единица работы'}: транзакция откачена ошибкой запроса, "
+                               f"изменения не сохранены")
+
+class UnitOfWorkStats:
+    """Накопленные счетчики единиц работы процесса"""
+    
+    def __init__(self):
+        self.units = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.checkouts = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, unit, failed):
+        with self._lock:
+            self.units += 1
+            self.queries += unit.queries
+            self.max_queries = max(self.max_queries, unit.queries)
+            self.checkouts += unit.checkouts
+            self.failed += int(failed)
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                'units': self.units,
+                'queries': self.queries,
+                'avg_queries': round(self.queries / self.units, 2) if self.units else None,
+                'max_queries': self.max_queries,
+                'checkouts': self.checkouts,
+                'failed': self.failed
+            }
+
+unit_of_work_stats = UnitOfWorkStats()
+
+# Текущая единица работы (переходит в корутины и asyncio.to_thread вместе с контекстом)
+current_unit = ContextVar('current_unit', default=None)
+
+@event.listens_for(engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    unit = current_unit.get()
+    if unit is not None:
+        unit.queries += 1
+
+@event.listens_for(engine, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    unit = current_unit.get()
+    if unit is not None:
+        unit.checkouts += 1
+
+if replica_engine is not None:
+    event.listen(replica_engine, 'before_cursor_execute', count_query)
+    event.listen(replica_engine, 'checkout', count_checkout)
+
+@contextmanager
+def unit_of_work(label=None):
+    """
+    Одна сессия и одна транзакция на группу запросов
+    
+    Все session_scope() внутри (в том числе в функциях queries.py) используют
+    сессию единицы работы: соединение берется из пула один раз, а коммит
+    выполняется один раз в конце. Вложенный unit_of_work присоединяется к
+    внешнему. После ошибки запроса внутри единица работы не коммитится
+    (см. UnitOfWork.check_commit).
+    """
+    unit = current_unit.get()
+    if unit is not None:
+        yield unit
+        return
+    
+    unit = UnitOfWork(label, session=SessionLocal())
+    token = current_unit.set(unit)
+    failed = False
+    try:
+        yield unit
+        unit.check_commit()
+        unit.session.commit()
+    except Exception:
+        failed = True
+        unit.session.rollback()
+        raise
+    finally:
+        current_unit.reset(token)
+        unit.session.close()
+        unit_of_work_stats.observe(unit, failed)
+        logger.debug(f"{unit.label or 'Единица работы'}: запросов {unit.queries}, "
+                     f"соединений {unit.checkouts}, {unit.elapsed_ms:.1f} мс")
+
+def add_missing_columns():
+    """
+    Добавление в существующие таблицы новых nullable-колонок моделей
+    
+    create_all создает только отсутствующие таблицы, а колонки, появившиеся
+    в моделях позже, в уже созданных таблицах не добавляет. Значение
+    server_default колонки заполняет существующие строки.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = ''
+                if column.server_default is not None:
+                    default = f" DEFAULT '{column.server_default.arg}'"
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+                logger.info(f"Добавлена колонка {table.name}.{column.name}")
+
+def dedupe_favorite_articles():
+    """
+    Одноразовая миграция перед уникальным индексом (user_id, article) избранного
+    
+    Раньше артикул мог попасть в избранное пользователя несколько раз, а
+    индекс на таблице с повторами не создастся. Выполняется, только пока
+    индекса нет: из каждой группы повторов остается строка с наименьшим id,
+    строки с NULL в ключе не трогаются.
+    """
+    inspector = inspect(engine)
+    if 'favorite_articles' not in inspector.get_table_names():
+        return
+    if 'ux_favorite_articles_user_id_article' in {index['name'] for index in inspector.get_indexes('favorite_articles')}:
+        return
+    
+    table = FavoriteArticle.__table__
+    has_key = (table.c.user_id.is_not(None), table.c.article.is_not(None))
+    keep = select(func.min(table.c.id)).where(*has_key).group_by(table.c.user_id, table.c.article)
+    with engine.begin() as conn:
+        removed = conn.execute(delete(table).where(*has_key, table.c.id.not_in(keep))).rowcount
+    logger.info(f"Миграция favorite_articles: удалено повторов (user_id, article): {removed}")
+
+def add_missing_indexes():
+    """Создание индексов моделей, добавленных после создания таблиц"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 def init_db():
     """Инициализация базы данных (создание таблиц)"""
     try:
         Base.metadata.create_all(bind=engine)
+        add_missing_columns()
+        if engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                init_partitions(conn, SCANS_PARTITION_MONTHS_AHEAD)
+        dedupe_favorite_articles()
+        add_missing_indexes()
         logger.info("Таблицы БД созданы/проверены")
     except Exception as e:
         logger.error(f"Ошибка при создании таблиц: {e}")
@@ -61,7 +304,30 @@ def get_db():
 
 @contextmanager
 def session_scope():
-    """Контекстный менеджер для работы с сессией"""
+    """
+    Контекстный менеджер для работы с сессией
+    
+    Внутри unit_of_work() отдает сессию единицы работы: изменения
+    сбрасываются в БД (flush) на выходе, а коммит выполняет единица работы.
+    Ошибка откатывает всю транзакцию единицы работы, и та уже не коммитится.
+    """
+    unit = current_unit.get()
+    if unit is not None:
+        if unit.session is None:
+            # Синхронный драйвер остановил бы цикл событий, а вторая сессия - разделила бы транзакцию
+            raise RuntimeError("Синхронный запрос внутри асинхронной единицы работы: "
+                               "используйте bot.database.async_queries")
+        session = unit.session
+        try:
+            yield session
+            session.flush()
+        except Exception as e:
+            session.rollback()
+            unit.rollbacks += 1
+            logger.error(f"Ошибка в сессии БД: {e}")
+            raise
+        return
+    
     session = SessionLocal()
     try:
         yield session
@@ -73,6 +339,43 @@ def session_scope():
     finally:
         session.close()
 
+def replica_lag(bind):
+    """Отставание реплики, секунд (для SQLite - 0: копия файла не отстает сама по себе)"""
+    with bind.connect() as conn:
+        if conn.dialect.name != 'postgresql':
+            return 0.0
+        return float(conn.execute(text(REPLICATION_LAG_SQL)).scalar())
+
+@contextmanager
+def read_session_scope():
+    """
+    Сессия для аналитических чтений (статистика, админка)
+    
+    Открывается на реплике (DATABASE_REPLICA_URL), если она не отстает
+    больше REPLICA_MAX_LAG, иначе работает как session_scope() на основной
+    БД. Писать в этой сессии нельзя. Данные реплики могут не содержать
+    изменений, сделанных только что, в том числе в текущей единице работы.
+    """
+    unit = current_unit.get()
+    bind = replica_engine
+    if unit is not None and unit.replica_bind is not None:
+        bind = unit.replica_bind
+    
+    if bind is None or not replica_guard.check(lambda: replica_lag(bind)):
+        with session_scope() as session:
+            yield session
+        return
+    
+    session = ReplicaSession(bind=bind)
+    try:
+        yield session
+    except DBAPIError as e:
+        if e.connection_invalidated:
+            replica_guard.fail(e)
+        raise
+    finally:
+        session.close()
+
 def init_test_data():
     """Инициализация тестовых данных (для разработки)"""
     from bot.database.models import Template, User
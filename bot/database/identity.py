@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Кеш соответствия telegram_id -> пользователь
+
+Почти каждый запрос бота начинается с поиска пользователя по telegram_id,
+хотя дальше нужен только его id. Кеш процесса хранит id и неизменяемые
+поля пользователя (UserKey), поэтому запросы идут сразу к нужным таблицам
+по user_id. Пользователи не удаляются, а id и telegram_id не меняются,
+так что записи кеша не устаревают; размер ограничен (LRU).
+
+Новый пользователь попадает в кеш только после коммита транзакции, в
+которой он создан.
+"""
+
+import threading
+from collections import OrderedDict
+
+from bot.config import IDENTITY_CACHE_SIZE
+from bot.database.models import User
+from bot.database.records import Record
+
+class UserKey(Record):
+    """Неизменяемые поля пользователя"""
+    
+    __slots__ = ('id', 'telegram_id', 'registered_at')
+    model = User
+
+class IdentityCache:
+    """LRU-кеш UserKey по telegram_id"""
+    
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, telegram_id):
+        with self._lock:
+            key = self._keys.get(telegram_id)
+            if key is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._keys.move_to_end(telegram_id)
+            return key
+    
+    def put(self, key):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._keys[key.telegram_id] = key
+            self._keys.move_to_end(key.telegram_id)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+    
+    def forget(self, telegram_id):
+        with self._lock:
+            self._keys.pop(telegram_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+    
+    def stats(self):
+        return {'size': len(self._keys), 'max': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+identity_cache = IdentityCache(IDENTITY_CACHE_SIZE)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+Замеры работы с БД для /metrics бота
+
+instrument_engine() вешает на движок события SQLAlchemy:
+
+- время каждого запроса (гистограмма по движку);
+- журнал медленных запросов (дольше SLOW_QUERY_MS): отпечаток SQL, в
+  котором значения и списки параметров заменены на ?, и функция бота,
+  из которой выполнен запрос; по отпечаткам копится сводка;
+- пиковое число выданных соединений пула.
+
+Времени ожидания соединения в событиях SQLAlchemy нет, его измеряет
+класс пула из timed_pool(). Размер пула, выданные соединения и
+переполнение (сверх pool_size, до max_overflow) читаются из пула при
+снимке: если checked_out упирается в size + max_overflow и растет
+checkout_wait_ms, обработчикам не хватает соединений.
+"""
+
+import re
+import sys
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from bot.config import SLOW_QUERY_MS
+from bot.utils.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько отпечатков медленных запросов держать в сводке на движок
+SLOW_QUERY_FINGERPRINTS = 200
+# Длина отпечатка в журнале и сводке
+FINGERPRINT_LENGTH = 500
+
+# Нормализация SQL: порядок важен (строки - до чисел, списки - после параметров)
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                       # строковые литералы
+    (re.compile(r'%\(\w+\)s|%s|\$\d+'), '?'),                  # параметры psycopg2 / asyncpg
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),                    # числа
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),         # IN (?, ?, ...) и строка VALUES
+    (re.compile(r'\(\?\+?\)(?:\s*,\s*\(\?\+?\))+'), '(?+)+'),   # VALUES (...), (...), ...
+    (re.compile(r'\s+'), ' '),
+)
+
+# Модули, через которые проходит запрос по пути к драйверу (вызывающей функцией не считаются)
+PLUMBING_MODULES = {__name__, 'bot.database.db', 'bot.database.async_db'}
+
+def fingerprint(statement):
+    """Отпечаток запроса: одинаковый для запросов, различающихся только значениями"""
+    for pattern, replacement in FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()[:FINGERPRINT_LENGTH]
+
+def calling_function():
+    """
+    Ближайшая по стеку функция бота (queries.py, сервисы, обработчики)
+    
+    Внутри run_sync стек greenlet содержит функцию queries.py, поэтому
+    асинхронные запросы тоже получают вызывающую функцию.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('bot.') and module not in PLUMBING_MODULES:
+            code = frame.f_code
+            return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+        frame = frame.f_back
+    return None
+
+class EngineMetrics:
+    """Замеры одного движка (основная БД, реплика, их асинхронные движки)"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.engine = None
+        self.queries = Histogram()
+        self.checkout_wait = Histogram()
+        self.errors = 0
+        self.slow = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self.slow_queries = {}
+        self._lock = threading.Lock()
+    
+    def observe_query(self, statement, duration_ms):
+        self.queries.observe(duration_ms)
+        if duration_ms >= SLOW_QUERY_MS:
+            self.observe_slow(statement, duration_ms)
+    
+    def observe_slow(self, statement, duration_ms):
+        """Запись медленного запроса в журнал и сводку по отпечатку"""
+        sql = fingerprint(statement)
+        caller = calling_function()
+        logger.warning(f"Медленный запрос ({self.name}) {duration_ms:.0f} мс в {caller or '?'}: {sql}")
+        
+        with self._lock:
+            self.slow += 1
+            entry = self.slow_queries.get(sql)
+            if entry is None:
+                if len(self.slow_queries) >= SLOW_QUERY_FINGERPRINTS:
+                    return
+                entry = self.slow_queries[sql] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'callers': {}}
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['callers'][caller] = entry['callers'].get(caller, 0) + 1
+    
+    def observe_error(self):
+        with self._lock:
+            self.errors += 1
+    
+    def observe_checkout(self, pool):
+        if isinstance(pool, QueuePool):
+            checked_out = pool.checkedout()
+            if checked_out > self.peak_checked_out:
+                self.peak_checked_out = checked_out
+    
+    def observe_wait(self, duration_ms, timed_out=False):
+        self.checkout_wait.observe(duration_ms)
+        if timed_out:
+            with self._lock:
+                self.timeouts += 1
+    
+    def pool_stats(self):
+        """Размер пула, выданные соединения и переполнение (для QueuePool)"""
+        pool = self.engine.pool if self.engine is not None else None
+        stats = {
+            'class': type(pool).__name__ if pool is not None else None,
+            'peak_checked_out': self.peak_checked_out,
+            'timeouts': self.timeouts,
+            'checkout_wait_ms': self.checkout_wait.snapshot()
+        }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                # overflow() отрицателен, пока не открыты все pool_size соединений
+                'overflow': max(pool.overflow(), 0)
+            })
+        return stats
+    
+    def snapshot(self):
+        with self._lock:
+            slow_queries = sorted(
+                (
+                    {
+                        'fingerprint': sql,
+                        'count': entry['count'],
+                        'avg_ms': round(entry['total_ms'] / entry['count'], 3),
+                        'max_ms': round(entry['max_ms'], 3),
+                        'callers': dict(entry['callers'])
+                    }
+                    for sql, entry in self.slow_queries.items()
+                ),
+                key=lambda item: item['count'] * item['avg_ms'],
+                reverse=True
+            )
+            errors, slow = self.errors, self.slow
+        
+        return {
+            'queries_ms': self.queries.snapshot(),
+            'errors': errors,
+            'slow': slow,
+            'slow_threshold_ms': SLOW_QUERY_MS,
+            'slow_queries': slow_queries,
+            'pool': self.pool_stats()
+        }
+
+class DatabaseMetrics:
+    """Замеры всех движков процесса по именам"""
+    
+    def __init__(self):
+        self._engines = {}
+        self._lock = threading.Lock()
+    
+    def engine(self, name):
+        with self._lock:
+            metrics = self._engines.get(name)
+            if metrics is None:
+                metrics = self._engines[name] = EngineMetrics(name)
+            return metrics
+    
+    def snapshot(self):
+        with self._lock:
+            items = sorted(self._engines.items())
+        return {name: metrics.snapshot() for name, metrics in items if metrics.engine is not None}
+
+db_metrics = DatabaseMetrics()
+
+def timed_pool(base, metrics):
+    """
+    Класс пула base с замером ожидания соединения
+    
+    Класс (а не экземпляр) несет metrics, поэтому замеры продолжаются и
+    после engine.dispose(), который пересоздает пул. Для NullPool в
+    ожидание входит открытие нового соединения.
+    """
+    class TimedPool(base):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                metrics.observe_wait((time.perf_counter() - started) * 1000, timed_out=True)
+                raise
+            metrics.observe_wait((time.perf_counter() - started) * 1000)
+            return connection
+    
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{base.__name__}"
+    return TimedPool
+
+def instrument_engine(engine, metrics):
+    """
+    События замеров запросов и выдачи соединений
+    
+    engine - синхронный движок (для асинхронного - async_engine.sync_engine),
+    созданный с poolclass=timed_pool(..., metrics).
+    """
+    metrics.engine = engine
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_started = time.perf_counter()
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'query_started', None)
+        if started is not None:
+            metrics.observe_query(statement, (time.perf_counter() - started) * 1000)
+    
+    @event.listens_for(engine, 'handle_error')
+    def count_query_error(exception_context):
+        metrics.observe_error()
+    
+    @event.listens_for(engine, 'checkout')
+    def track_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.observe_checkout(engine.pool)
+    
+    return engine
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Float, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Date, ForeignKey, Boolean, Text, Float, JSON, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -29,9 +29,12 @@ class User(Base):
     shop_url_wb = Column(String(255))
     shop_url_ozon = Column(String(255))
     
-    # Статистика
-    cards_created = Column(Integer, default=0)
-    scans_received = Column(Integer, default=0)
+    # Статистика (снимок для /profile: счетчики обновляются в тех же транзакциях,
+    # что и исходные записи, расхождения исправляет StatsService.repair_user_stats)
+    cards_created = Column(Integer, default=0, index=True)  # индекс - для топа в админке
+    scans_received = Column(Integer, default=0)  # не обновляется: сумма scan_count визиток
+    referrals_count = Column(Integer, default=0, server_default='0')
+    spent_stars = Column(Integer, default=0, server_default='0')
     
     # Реферальная система
     referral_code = Column(String(50), unique=True)
@@ -89,15 +92,21 @@ class BusinessCard(Base):
 
 class Scan(Base):
     __tablename__ = 'scans'
+    __table_args__ = (
+        # Последние сканирования визитки (ORDER BY scanned_at DESC LIMIT N)
+        Index('ix_scans_card_id_scanned_at', 'card_id', 'scanned_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     card_id = Column(Integer, ForeignKey('business_cards.id'), nullable=False, index=True)
     
-    # Данные сканирования
-    scanned_at = Column(DateTime, default=datetime.utcnow)
+    # Данные сканирования. В PostgreSQL - ключ секционирования таблицы по месяцам
+    # (bot.database.partitions), первичный ключ там (id, scanned_at)
+    scanned_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     ip_address = Column(String(45))
     user_agent = Column(Text)
     referer = Column(String(255))
+    region = Column(String(10), nullable=True)  # Код региона ISO 3166-2 по GeoIP (RU-MOW)
     
     # Связи
     card = relationship("BusinessCard", back_populates="scans")
@@ -105,6 +114,98 @@ class Scan(Base):
     def __repr__(self):
         return f"<Scan(id={self.id}, card={self.card_id}, time={self.scanned_at})>"
 
+class CardDailyStat(Base):
+    """Предрасчитанные счетчики сканирований визитки по дням (UTC)"""
+    __tablename__ = 'card_daily_stats'
+    
+    card_id = Column(Integer, ForeignKey('business_cards.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    scans = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<CardDailyStat(card={self.card_id}, day={self.day}, scans={self.scans})>"
+
+class CardRegionStat(Base):
+    """Предрасчитанные счетчики сканирований визитки по регионам и дням (UTC)"""
+    __tablename__ = 'card_region_stats'
+    
+    card_id = Column(Integer, ForeignKey('business_cards.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    region = Column(String(10), primary_key=True)
+    scans = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<CardRegionStat(card={self.card_id}, day={self.day}, region={self.region}, scans={self.scans})>"
+
+class ScanSketch(Base):
+    """
+    HyperLogLog-скетч уникальных посетителей (bot.utils.hyperloglog)
+    
+    scope='card' - по визитке; day=ALL_TIME_DAY - за все время. Скетч
+    продавца - объединение (merge) скетчей его визиток при чтении.
+    """
+    __tablename__ = 'scan_sketches'
+    
+    scope = Column(String(10), primary_key=True)
+    owner_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        return f"<ScanSketch(scope={self.scope}, owner={self.owner_id}, day={self.day})>"
+
+class GlobalCounter(Base):
+    """
+    Глобальные счетчики админки по дням (UTC), разложенные на шарды
+    
+    Значение счетчика name за день - сумма value по shard; day=ALL_TIME_DAY -
+    за все время (bot.utils.counters).
+    """
+    __tablename__ = 'global_counters'
+    
+    day = Column(Date, primary_key=True)
+    name = Column(String(30), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<GlobalCounter(name={self.name}, day={self.day}, shard={self.shard}, value={self.value})>"
+
+class ScanArchive(Base):
+    """
+    Месяц сканирований, перенесенный из scans в архивный файл (bot.services.archive)
+    
+    Месяцы архивируются по порядку, поэтому все сканирования раньше
+    последнего месяца + 1 лежат в архиве, а в scans их нет.
+    """
+    __tablename__ = 'scan_archives'
+    
+    month = Column(Date, primary_key=True)  # первое число месяца (UTC)
+    path = Column(String(255))  # None - сканирований за месяц не было
+    rows = Column(Integer, nullable=False, default=0)
+    size_bytes = Column(BigInteger, nullable=False, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<ScanArchive(month={self.month}, rows={self.rows}, path={self.path})>"
+
+class Collection(Base):
+    """Подборка товаров для QR типа 'collection' со снимком карточек на момент создания"""
+    __tablename__ = 'collections'
+    
+    id = Column(String(50), primary_key=True)  # collection_id визитки
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    
+    # Артикулы в порядке ввода
+    articles = Column(JSON, nullable=False)
+    # Снимки товаров: [{article, name, price, image, url}], без обращений к маркетплейсу при показе
+    products = Column(JSON, nullable=False)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<Collection(id={self.id}, user={self.user_id}, items={len(self.articles or [])})>"
+
 class Template(Base):
     __tablename__ = 'templates'
     
@@ -127,6 +228,10 @@ class Template(Base):
 
 class FavoriteArticle(Base):
     __tablename__ = 'favorite_articles'
+    __table_args__ = (
+        # Артикул в избранном пользователя один раз (ON CONFLICT в add_favorite_article)
+        Index('ux_favorite_articles_user_id_article', 'user_id', 'article', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Секционирование таблицы scans по месяцам (PostgreSQL)
+
+scans секционирована по диапазону scanned_at: секция scans_ГГГГ_ММ на
+каждый месяц (UTC) и scans_default для строк вне созданных секций.
+Сканирования пишутся в небольшую секцию текущего месяца, запросы с
+фильтром по времени читают только нужные секции, а старые месяцы
+удаляются целиком - DROP секции вместо DELETE (bot.services.archive).
+
+init_db() один раз переводит обычную таблицу scans в секционированную
+(данные копируются в одной транзакции - веб-сервис на это время лучше
+остановить) и создает секции на SCANS_PARTITION_MONTHS_AHEAD месяцев
+вперед; дальше их досоздает ежедневная задача архива. Первичный ключ
+секционированной таблицы - (id, scanned_at): PostgreSQL требует ключ
+секционирования в уникальных индексах. В SQLite таблица остается обычной.
+"""
+
+import re
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PARENT = 'scans'
+DEFAULT_PARTITION = 'scans_default'
+PARTITION_NAME = re.compile(r'^scans_(\d{4})_(\d{2})$')
+
+def month_start(value):
+    """Первое число месяца даты (или даты и времени) value"""
+    return date(value.year, value.month, 1)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f"{PARENT}_{month:%Y_%m}"
+
+def is_partitioned(conn):
+    """conn - соединение или сессия PostgreSQL"""
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {'name': PARENT}
+    ).scalar() == 'p'
+
+def list_partitions(conn):
+    """Месяцы существующих секций, по возрастанию (без scans_default)"""
+    names = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:name)
+    """), {'name': PARENT}).scalars()
+    
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+def create_partition(conn, month):
+    """
+    Секция месяца month
+    
+    Если сканирования этого месяца уже попали в scans_default (секция не была
+    создана вовремя), CREATE ... PARTITION OF завершился бы ошибкой. Тогда
+    секция создается отдельной таблицей, строки переносятся в нее из
+    scans_default, и она присоединяется к scans - все в транзакции conn.
+    """
+    name = partition_name(month)
+    bounds = f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    
+    if not default_partition_has_rows(conn, month):
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} FOR VALUES {bounds}"))
+        return
+    
+    # Запись в scans_default ждет конца транзакции: новые строки месяца не
+    # появятся в ней между переносом и присоединением секции
+    conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE"))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)"))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE scanned_at >= :start AND scanned_at < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), {'start': month, 'end': add_months(month, 1)}).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    logger.warning(f"Секция {name} создана после записи в {DEFAULT_PARTITION}: перенесено строк {moved}")
+
+def default_partition_has_rows(conn, month):
+    """Есть ли в scans_default сканирования месяца month"""
+    if conn.execute(text("SELECT to_regclass(:name)"), {'name': DEFAULT_PARTITION}).scalar() is None:
+        return False
+    return conn.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {DEFAULT_PARTITION}
+            WHERE scanned_at >= :start AND scanned_at < :end
+        )
+    """), {'start': month, 'end': add_months(month, 1)}).scalar()
+
+def ensure_partitions(conn, months_ahead, since=None):
+    """
+    Секции с месяца since (по умолчанию - текущего) по текущий + months_ahead
+    
+    Returns:
+        Имена созданных секций
+    """
+    current = month_start(datetime.utcnow())
+    month = month_start(since) if since is not None else current
+    last = add_months(current, months_ahead)
+    existing = set(list_partitions(conn))
+    
+    created = []
+    while month <= last:
+        if month not in existing:
+            create_partition(conn, month)
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+def default_partition_oldest(conn):
+    """Самое раннее сканирование вне месячных секций (scans_default)"""
+    return conn.execute(text(f"SELECT min(scanned_at) FROM {DEFAULT_PARTITION}")).scalar()
+
+def drop_partition(conn, month):
+    """Отсоединение и удаление секции месяца (данные должны быть уже в архиве)"""
+    name = partition_name(month)
+    conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+
+def partition_scans(conn, months_ahead):
+    """
+    Перевод обычной таблицы scans в секционированную
+    
+    Индексы моделей на новой таблице создает add_missing_indexes().
+    
+    Returns:
+        True, если таблица переведена (False - уже секционирована)
+    """
+    if is_partitioned(conn):
+        return False
+    
+    # Время сканирований без него (до NOT NULL) - время создания визитки
+    conn.execute(text(f"""
+        UPDATE {PARENT} SET scanned_at = COALESCE(
+            (SELECT created_at FROM business_cards WHERE business_cards.id = {PARENT}.card_id), now()
+        )
+        WHERE scanned_at IS NULL
+    """))
+    oldest = conn.execute(text(f"SELECT min(scanned_at) FROM {PARENT}")).scalar()
+    sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{PARENT}', 'id')")).scalar()
+    
+    conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {PARENT}_unpartitioned"))
+    conn.execute(text(
+        f"CREATE TABLE {PARENT} (LIKE {PARENT}_unpartitioned INCLUDING DEFAULTS) "
+        f"PARTITION BY RANGE (scanned_at)"
+    ))
+    conn.execute(text(f"ALTER TABLE {PARENT} ALTER COLUMN scanned_at SET NOT NULL"))
+    created = ensure_partitions(conn, months_ahead, since=oldest)
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT"))
+    
+    copied = conn.execute(text(f"INSERT INTO {PARENT} SELECT * FROM {PARENT}_unpartitioned")).rowcount
+    
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {PARENT}.id"))
+    conn.execute(text(f"DROP TABLE {PARENT}_unpartitioned"))
+    conn.execute(text(f"ALTER TABLE {PARENT} ADD PRIMARY KEY (id, scanned_at)"))
+    conn.execute(text(f"ALTER TABLE {PARENT} ADD FOREIGN KEY (card_id) REFERENCES business_cards (id)"))
+    
+    logger.info(f"Таблица {PARENT} секционирована по месяцам: {len(created)} секций, {copied} строк")
+    return True
+
+def init_partitions(conn, months_ahead):
+    """Секционирование scans при первом запуске и секции на months_ahead месяцев вперед"""
+    if not partition_scans(conn, months_ahead):
+        created = ensure_partitions(conn, months_ahead)
+        if created:
+            logger.info(f"Созданы секции {PARENT}: {', '.join(created)}")
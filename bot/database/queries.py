@@ -5,121 +5,378 @@
 """
 
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc, and_
+import threading
+import time
+import uuid
+from sqlalchemy import func, desc, event, insert, update, select, case, literal, literal_column
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects import postgresql, sqlite
 import logging
 
-from bot.database.db import session_scope
-from bot.database.models import User, BusinessCard, Scan, Template, Payment, Referral, FavoriteArticle
+from bot.config import TEMPLATE_CACHE_TTL
+from bot.database.db import SessionLocal, session_scope, read_session_scope
+from bot.database.models import (
+    User, BusinessCard, Scan, Template, Payment, Referral, FavoriteArticle, Collection, CardRegionStat,
+    ScanSketch, GlobalCounter
+)
+from bot.database.records import (
+    UserRecord, UserBrief, CardRecord, TemplateRecord, FavoriteRecord, PaymentRecord
+)
+from bot.database.identity import UserKey, identity_cache
+from bot.utils.hyperloglog import ALL_TIME_DAY, merge, estimate
+from bot.utils.counters import (
+    USERS, ACTIVE_USERS, CARDS, SCANS, REVENUE, counter_shard, counter_days
+)
 
 logger = logging.getLogger(__name__)
 
+# Ключ session.info с пользователями, уже найденными в сессии по telegram_id
+SESSION_USERS = 'users_by_telegram_id'
+# Ключ session.info с пользователями, созданными в текущей транзакции
+SESSION_NEW_USERS = 'new_user_keys'
+# Ключ session.info: в транзакции менялись шаблоны
+SESSION_TEMPLATES_CHANGED = 'templates_changed'
+
+# Сколько секунд админка показывает закешированное число пользователей
+USER_COUNT_TTL = 60
+# Кеш count_users: active_only -> (число, момент устаревания по time.monotonic)
+user_counts = {}
+
+# INSERT ... ON CONFLICT DO UPDATE для поддерживаемых диалектов
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def forget_users(session):
+    """После отката найденные объекты могут быть уже недействительны"""
+    session.info.pop(SESSION_USERS, None)
+    session.info.pop(SESSION_NEW_USERS, None)
+    session.info.pop(SESSION_TEMPLATES_CHANGED, None)
+
+@event.listens_for(SessionLocal, 'after_commit')
+def publish_new_users(session):
+    """После коммита: созданные пользователи - в identity_cache, изменения шаблонов - в template_cache"""
+    for key in session.info.pop(SESSION_NEW_USERS, ()):
+        identity_cache.put(key)
+    if session.info.pop(SESSION_TEMPLATES_CHANGED, False):
+        template_cache.invalidate()
+
+def find_user(session, telegram_id):
+    """
+    Пользователь по telegram_id
+    
+    Найденный объект запоминается в сессии, поэтому внутри единицы работы
+    (группы запросов обработчика) пользователь ищется в БД один раз.
+    """
+    users = session.info.setdefault(SESSION_USERS, {})
+    user = users.get(telegram_id)
+    if user is None:
+        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        if user is not None:
+            users[telegram_id] = user
+            identity_cache.put(UserKey.from_instance(user))
+    return user
+
+def find_user_id(session, telegram_id):
+    """
+    id пользователя по telegram_id (None, если пользователя нет)
+    
+    Берется из кеша процесса или сессии; запрос к БД - только при первом
+    обращении к пользователю.
+    """
+    key = identity_cache.get(telegram_id)
+    if key is not None:
+        return key.id
+    
+    user = session.info.get(SESSION_USERS, {}).get(telegram_id)
+    if user is not None:
+        return user.id
+    
+    key = UserKey.from_row(session.query(*UserKey.columns()).filter_by(telegram_id=telegram_id).first())
+    if key is None:
+        return None
+    
+    identity_cache.put(key)
+    return key.id
+
+def bump_counter(session, name, amount=1, all_time=True):
+    """
+    Увеличить глобальный счетчик name за сегодня (и за все время)
+    
+    Выполняется в транзакции session - вместе с записью, которую считает.
+    """
+    if not amount:
+        return
+    
+    shard = counter_shard()
+    insert = UPSERT_INSERTS[session.get_bind().dialect.name]
+    statement = insert(GlobalCounter).values([
+        {'day': day, 'name': name, 'shard': shard, 'value': amount}
+        for day in counter_days(datetime.utcnow().date(), all_time)
+    ])
+    session.execute(statement.on_conflict_do_update(
+        index_elements=['day', 'name', 'shard'],
+        set_={'value': GlobalCounter.value + statement.excluded.value}
+    ))
+
+def read_counters(session, day):
+    """Глобальные счетчики за день day и за все время: {(name, day): value}"""
+    rows = session.query(GlobalCounter.name, GlobalCounter.day, func.sum(GlobalCounter.value))\
+        .filter(GlobalCounter.day.in_(counter_days(day)))\
+        .group_by(GlobalCounter.name, GlobalCounter.day)
+    return {(name, counter_day): int(value) for name, counter_day, value in rows}
+
 # ========== ПОЛЬЗОВАТЕЛИ ==========
 
 def get_or_create_user(telegram_id, username=None, first_name=None, last_name=None):
-    """Получить или создать пользователя"""
+    """
+    Получить или создать пользователя
+    
+    В PostgreSQL - один INSERT ... ON CONFLICT (telegram_id) DO UPDATE ...
+    RETURNING: у вставленной строки xmax = 0, а подзапрос RETURNING видит
+    прежнее last_activity (для счетчика активных за день). В SQLite
+    подзапрос видит уже новую строку, поэтому там INSERT ... ON CONFLICT DO
+    NOTHING (rowcount - создана ли строка) занимает запись в БД, и строка
+    читается и обновляется после него - в процессе, без обращения по сети.
+    Параллельные вызовы для одного пользователя не падают на уникальном
+    telegram_id и создают его один раз.
+    
+    Returns:
+        (UserRecord, created) - created=True, если пользователь создан этим вызовом
+    """
+    now = datetime.utcnow()
+    names = {'username': username, 'first_name': first_name, 'last_name': last_name}
+    
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        dialect = session.get_bind().dialect.name
+        statement = UPSERT_INSERTS[dialect](User).values(
+            telegram_id=telegram_id,
+            referral_code=str(uuid.uuid4())[:8],
+            registered_at=now,
+            last_activity=now,
+            **names
+        )
         
-        if not user:
-            # Генерируем уникальный реферальный код
-            import uuid
-            referral_code = str(uuid.uuid4())[:8]
-            
-            user = User(
-                telegram_id=telegram_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                referral_code=referral_code,
-                registered_at=datetime.utcnow()
+        if dialect == 'postgresql':
+            previous = aliased(User)
+            statement = statement.on_conflict_do_update(
+                index_elements=['telegram_id'],
+                set_={
+                    # Пустое имя не затирает сохраненное
+                    **{
+                        name: func.coalesce(func.nullif(statement.excluded[name], ''), getattr(User, name))
+                        for name in names
+                    },
+                    'last_activity': statement.excluded.last_activity
+                }
             )
-            session.add(user)
-            session.flush()
+            *values, created, previous_activity = session.execute(statement.returning(
+                *UserRecord.columns(),
+                literal_column('xmax = 0').label('created'),
+                select(previous.last_activity).where(previous.telegram_id == telegram_id).scalar_subquery()
+            )).one()
+            user = UserRecord(*values)
+        else:
+            created = session.execute(
+                statement.on_conflict_do_nothing(index_elements=['telegram_id'])
+            ).rowcount == 1
+            user = UserRecord.from_row(
+                session.query(*UserRecord.columns()).filter_by(telegram_id=telegram_id).one()
+            )
+            previous_activity = user.last_activity
+            if not created:
+                updates = {name: value for name, value in names.items() if value}
+                updates['last_activity'] = now
+                session.execute(update(User).where(User.id == user.id).values(**updates))
+                for name, value in updates.items():
+                    setattr(user, name, value)
+        
+        # ORM-объект, найденный в сессии раньше, устарел
+        session.info.get(SESSION_USERS, {}).pop(telegram_id, None)
+        
+        if created:
+            session.info.setdefault(SESSION_NEW_USERS, []).append(UserKey.from_instance(user))
+            bump_counter(session, USERS)
+            bump_counter(session, ACTIVE_USERS, all_time=False)
             logger.info(f"Создан новый пользователь: {telegram_id}")
         else:
-            # Обновляем данные
-            user.username = username or user.username
-            user.first_name = first_name or user.first_name
-            user.last_name = last_name or user.last_name
-            user.last_activity = datetime.utcnow()
+            identity_cache.put(UserKey.from_instance(user))
             
-        return user
+            # Первое обращение за день - пользователь становится активным сегодня
+            if previous_activity is None or previous_activity.date() < now.date():
+                bump_counter(session, ACTIVE_USERS, all_time=False)
+        
+        return user, created
 
 def get_user_by_telegram_id(telegram_id):
-    """Получить пользователя по telegram_id"""
+    """Получить пользователя по telegram_id (UserRecord или None)"""
     with session_scope() as session:
-        return session.query(User).filter_by(telegram_id=telegram_id).first()
+        user = session.info.get(SESSION_USERS, {}).get(telegram_id)
+        if user is not None:
+            return UserRecord.from_instance(user)
+        
+        return UserRecord.from_row(
+            session.query(*UserRecord.columns()).filter_by(telegram_id=telegram_id).first()
+        )
 
 def get_user_by_referral_code(code):
-    """Получить пользователя по реферальному коду"""
+    """Получить пользователя по реферальному коду (UserRecord или None)"""
     with session_scope() as session:
-        return session.query(User).filter_by(referral_code=code).first()
+        return UserRecord.from_row(
+            session.query(*UserRecord.columns()).filter_by(referral_code=code).first()
+        )
 
 def update_user_shop_info(telegram_id, shop_name=None, shop_url_wb=None, shop_url_ozon=None):
     """Обновить информацию о магазине пользователя"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if user:
-            if shop_name:
-                user.shop_name = shop_name
-            if shop_url_wb:
-                user.shop_url_wb = shop_url_wb
-            if shop_url_ozon:
-                user.shop_url_ozon = shop_url_ozon
-            return True
-        return False
+        user_id = find_user_id(session, telegram_id)
+        if not user_id:
+            return False
+        
+        values = {}
+        if shop_name:
+            values[User.shop_name] = shop_name
+        if shop_url_wb:
+            values[User.shop_url_wb] = shop_url_wb
+        if shop_url_ozon:
+            values[User.shop_url_ozon] = shop_url_ozon
+        
+        if values:
+            session.query(User).filter_by(id=user_id).update(values)
+        return True
 
 def get_all_users(active_only=True):
-    """Получить всех пользователей"""
+    """Получить всех пользователей (UserBrief)"""
     with session_scope() as session:
-        query = session.query(User)
+        query = session.query(*UserBrief.columns())
         if active_only:
             query = query.filter_by(is_active=True)
-        return query.all()
+        return [UserBrief(*row) for row in query]
+
+def get_users_page(after_id=None, before_id=None, limit=10, active_only=True):
+    """
+    Страница списка пользователей по курсору (UserBrief в порядке id)
+    
+    Курсор - id пользователя на границе соседней страницы: after_id - для
+    перехода вперед, before_id - назад, без курсоров - первая страница.
+    Читается limit + 1 строка по первичному ключу, без OFFSET и COUNT.
+    
+    Returns:
+        {'users': [...], 'has_prev': bool, 'has_next': bool}
+    """
+    with read_session_scope() as session:
+        query = session.query(*UserBrief.columns())
+        if active_only:
+            query = query.filter(User.is_active == True)
+        
+        if before_id is not None:
+            rows = query.filter(User.id < before_id).order_by(User.id.desc()).limit(limit + 1).all()
+            has_more = len(rows) > limit
+            users = [UserBrief(*row) for row in reversed(rows[:limit])]
+            return {'users': users, 'has_prev': has_more, 'has_next': True}
+        
+        if after_id is not None:
+            query = query.filter(User.id > after_id)
+        rows = query.order_by(User.id).limit(limit + 1).all()
+        return {
+            'users': [UserBrief(*row) for row in rows[:limit]],
+            'has_prev': after_id is not None,
+            'has_next': len(rows) > limit
+        }
+
+def count_users(active_only=True):
+    """Число пользователей для админки (кешируется на USER_COUNT_TTL секунд)"""
+    cached = user_counts.get(active_only)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    
+    with read_session_scope() as session:
+        query = session.query(func.count(User.id))
+        if active_only:
+            query = query.filter(User.is_active == True)
+        total = query.scalar()
+    
+    user_counts[active_only] = (total, time.monotonic() + USER_COUNT_TTL)
+    return total
 
 def get_user_stats(telegram_id):
-    """Получить статистику пользователя"""
+    """
+    Получить статистику пользователя
+    
+    Счетчики-снимок из users (поддерживаются при создании визитки, реферале и
+    подтверждении платежа) и два запроса по визиткам продавца: сканирования -
+    сумма scan_count, уникальные посетители - объединение скетчей визиток.
+    Отдельные счетчик и скетч продавца были бы горячими строками, которые
+    обновляет каждое сканирование любой его визитки.
+    """
+    scans_received = select(func.coalesce(func.sum(BusinessCard.scan_count), 0))\
+        .where(BusinessCard.user_id == User.id)\
+        .correlate(User)\
+        .scalar_subquery()
+    
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return None
-        
-        # Количество визиток
-        cards_count = session.query(BusinessCard).filter_by(user_id=user.id).count()
-        
-        # Количество сканирований
-        scans_count = session.query(Scan)\
-            .join(BusinessCard, BusinessCard.id == Scan.card_id)\
-            .filter(BusinessCard.user_id == user.id)\
-            .count()
-        
-        # Количество рефералов
-        referrals_count = session.query(Referral).filter_by(referrer_id=user.id).count()
+        row = session.query(
+            User.id,
+            User.cards_created,
+            scans_received,
+            User.referrals_count,
+            User.spent_stars,
+            User.referral_balance
+        ).filter(
+            User.telegram_id == telegram_id
+        ).first()
         
-        # Потрачено звезд
-        spent_stars = session.query(func.sum(Payment.amount))\
-            .filter_by(user_id=user.id, status='success')\
-            .scalar() or 0
+        if not row:
+            return None
         
+        user_id, cards_created, scans_received, referrals_count, spent_stars, balance = row
+        sketches = session.query(ScanSketch.registers)\
+            .join(BusinessCard, BusinessCard.id == ScanSketch.owner_id)\
+            .filter(
+                ScanSketch.scope == 'card',
+                ScanSketch.day == ALL_TIME_DAY,
+                BusinessCard.user_id == user_id
+            )
         return {
-            'cards_created': cards_count,
-            'scans_received': scans_count,
-            'referrals_count': referrals_count,
-            'spent_stars': spent_stars,
-            'balance': user.referral_balance
+            'cards_created': cards_created or 0,
+            'scans_received': scans_received or 0,
+            'unique_visitors': estimate(merge(registers for (registers,) in sketches)),
+            'referrals_count': referrals_count or 0,
+            'spent_stars': spent_stars or 0,
+            'balance': balance
         }
 
 # ========== ВИЗИТКИ ==========
 
-def create_business_card(telegram_id, template_id, qr_type, token, article=None, collection_id=None):
-    """Создать новую визитку"""
+def create_business_card(telegram_id, template_id, qr_type, token, article=None, collection_id=None,
+                         collection_products=None):
+    """
+    Создать новую визитку
+    
+    Для подборки вместе с визиткой сохраняются снимки товаров
+    (collection_products), по которым веб-сервис строит страницу подборки.
+    """
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
+        # Счетчик созданных визиток увеличивается тем же запросом, что находит пользователя
+        user_id = session.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id)
+            .values(cards_created=User.cards_created + 1)
+            .returning(User.id)
+        ).scalar()
+        if not user_id:
             return None
         
+        if collection_id and collection_products:
+            session.add(Collection(
+                id=collection_id,
+                user_id=user_id,
+                articles=[p['article'] for p in collection_products],
+                products=collection_products,
+                created_at=datetime.utcnow()
+            ))
+        
         card = BusinessCard(
-            user_id=user.id,
+            user_id=user_id,
             template_id=template_id,
             qr_type=qr_type,
             target_article=article,
@@ -128,59 +385,64 @@ def create_business_card(telegram_id, template_id, qr_type, token, article=None,
             created_at=datetime.utcnow()
         )
         session.add(card)
-        
-        # Увеличиваем счетчик созданных визиток
-        user.cards_created += 1
+        bump_counter(session, CARDS)
         
         session.flush()
         return card.id
 
 def get_user_cards(telegram_id, limit=10):
-    """Получить последние визитки пользователя"""
+    """Получить последние визитки пользователя (CardRecord)"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return []
-        
-        return session.query(BusinessCard)\
-            .filter_by(user_id=user.id)\
+        rows = session.query(*CardRecord.columns())\
+            .join(User, User.id == BusinessCard.user_id)\
+            .filter(User.telegram_id == telegram_id)\
             .order_by(BusinessCard.created_at.desc())\
-            .limit(limit)\
-            .all()
+            .limit(limit)
+        return [CardRecord(*row) for row in rows]
 
 def get_card_by_token(token):
-    """Получить визитку по токену"""
+    """Получить визитку по токену (CardRecord или None)"""
     with session_scope() as session:
-        return session.query(BusinessCard).filter_by(token=token).first()
+        return CardRecord.from_row(
+            session.query(*CardRecord.columns()).filter_by(token=token).first()
+        )
 
 def record_scan(card_id, ip_address, user_agent, referer=None):
-    """Записать сканирование визитки"""
+    """
+    Записать сканирование визитки
+    
+    Счетчики увеличиваются в SQL (scan_count = scan_count + 1), а не
+    чтением и записью объекта, поэтому параллельные сканирования одной
+    визитки не теряют обновлений.
+    
+    Returns:
+        False, если визитки нет
+    """
     with session_scope() as session:
-        scan = Scan(
+        now = datetime.utcnow()
+        
+        updated = session.execute(
+            update(BusinessCard)
+            .where(BusinessCard.id == card_id)
+            .values(scan_count=BusinessCard.scan_count + 1, last_scan=now)
+            .returning(BusinessCard.id)
+        ).scalar()
+        if updated is None:
+            return False
+        
+        session.execute(insert(Scan).values(
             card_id=card_id,
             ip_address=ip_address,
             user_agent=user_agent,
             referer=referer,
-            scanned_at=datetime.utcnow()
-        )
-        session.add(scan)
-        
-        # Обновляем счетчик в визитке
-        card = session.query(BusinessCard).filter_by(id=card_id).first()
-        if card:
-            card.scan_count += 1
-            card.last_scan = datetime.utcnow()
-            
-            # Обновляем счетчик у пользователя
-            user = session.query(User).filter_by(id=card.user_id).first()
-            if user:
-                user.scans_received += 1
-        
+            scanned_at=now
+        ))
+        bump_counter(session, SCANS)
         return True
 
 def get_card_stats(card_id):
     """Получить статистику по конкретной визитке"""
-    with session_scope() as session:
+    with read_session_scope() as session:
         card = session.query(BusinessCard).filter_by(id=card_id).first()
         if not card:
             return None
@@ -198,85 +460,165 @@ def get_card_stats(card_id):
             func.date(Scan.scanned_at)
         ).all()
         
+        # Регионы за тот же период (из счетчиков, заполняемых веб-сервисом)
+        regions = session.query(
+            CardRegionStat.region,
+            func.sum(CardRegionStat.scans).label('count')
+        ).filter(
+            CardRegionStat.card_id == card_id,
+            CardRegionStat.day >= thirty_days_ago.date()
+        ).group_by(
+            CardRegionStat.region
+        ).order_by(
+            desc('count')
+        ).limit(5).all()
+        
+        visitors_sketch = session.query(ScanSketch.registers)\
+            .filter_by(scope='card', owner_id=card_id, day=ALL_TIME_DAY)\
+            .scalar()
+        
         return {
             'total': card.scan_count,
+            'unique': estimate(visitors_sketch),
             'last_scan': card.last_scan,
-            'daily': [{'date': str(d.date), 'count': d.count} for d in daily_scans]
+            'daily': [{'date': str(d.date), 'count': d.count} for d in daily_scans],
+            'regions': [{'region': r.region, 'count': int(r.count)} for r in regions]
         }
 
 # ========== ШАБЛОНЫ ==========
 
+class TemplateCache:
+    """
+    Кеш шаблонов процесса с версией
+    
+    Шаблоны меняются только из админки: изменение (после коммита)
+    увеличивает version, и следующее чтение загружает все шаблоны заново
+    одним запросом. Пока версия не менялась, чтения обходятся без БД.
+    ttl - подстраховка для правок в БД в обход бота (0 - без нее).
+    Записи общие для всех вызовов, изменять их нельзя.
+    """
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.loads = 0
+        self._loaded = None  # (версия, момент устаревания, шаблоны, шаблоны по id)
+        self._lock = threading.Lock()
+    
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+    
+    def get(self):
+        """(шаблоны в порядке sort_order, {id: шаблон})"""
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == self.version and (not self.ttl or loaded[1] > time.monotonic()):
+            self.hits += 1
+            return loaded[2], loaded[3]
+        
+        version = self.version
+        with session_scope() as session:
+            rows = session.query(*TemplateRecord.columns()).order_by(Template.sort_order)
+            templates = tuple(TemplateRecord(*row) for row in rows)
+        by_id = {template.id: template for template in templates}
+        
+        with self._lock:
+            self.loads += 1
+            # Если шаблоны изменились во время загрузки, результат не кешируется
+            if version == self.version:
+                self._loaded = (version, time.monotonic() + self.ttl, templates, by_id)
+        return templates, by_id
+    
+    def stats(self):
+        return {'version': self.version, 'hits': self.hits, 'loads': self.loads}
+
+template_cache = TemplateCache(TEMPLATE_CACHE_TTL)
+
+def templates_changed(session):
+    """Отметить изменение шаблонов: кеш сбросится после коммита session"""
+    session.info[SESSION_TEMPLATES_CHANGED] = True
+
 def get_all_templates(active_only=True):
-    """Получить все шаблоны"""
-    with session_scope() as session:
-        query = session.query(Template)
-        if active_only:
-            query = query.filter_by(is_active=True)
-        return query.order_by(Template.sort_order).all()
+    """Получить все шаблоны (TemplateRecord, из кеша)"""
+    templates, _ = template_cache.get()
+    return [t for t in templates if t.is_active or not active_only]
 
 def get_template(template_id):
-    """Получить шаблон по ID"""
-    with session_scope() as session:
-        return session.query(Template).filter_by(id=template_id).first()
+    """Получить шаблон по ID (TemplateRecord или None, из кеша)"""
+    _, by_id = template_cache.get()
+    return by_id.get(template_id)
 
 def get_templates_by_category(category, active_only=True):
-    """Получить шаблоны по категории"""
+    """Получить шаблоны по категории (TemplateRecord, из кеша)"""
+    templates, _ = template_cache.get()
+    return [t for t in templates if t.category == category and (t.is_active or not active_only)]
+
+def toggle_template(template_id):
+    """
+    Включить/выключить шаблон
+    
+    Returns:
+        Новое значение is_active или None, если шаблона нет
+    """
     with session_scope() as session:
-        query = session.query(Template).filter_by(category=category)
-        if active_only:
-            query = query.filter_by(is_active=True)
-        return query.order_by(Template.sort_order).all()
+        is_active = session.execute(
+            update(Template)
+            .where(Template.id == template_id)
+            .values(is_active=~Template.is_active)
+            .returning(Template.is_active)
+        ).scalar()
+        if is_active is not None:
+            templates_changed(session)
+        return is_active
 
 # ========== ИЗБРАННЫЕ АРТИКУЛЫ ==========
 
 def add_favorite_article(telegram_id, article, product_name, marketplace='wb'):
-    """Добавить артикул в избранное"""
+    """
+    Добавить артикул в избранное
+    
+    INSERT ... ON CONFLICT (user_id, article) DO NOTHING: уже добавленный
+    артикул не дублируется и при параллельных нажатиях.
+    """
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
+        user_id = find_user_id(session, telegram_id)
+        if not user_id:
             return False
         
-        # Проверяем, нет ли уже такого
-        existing = session.query(FavoriteArticle).filter_by(
-            user_id=user.id,
-            article=article
-        ).first()
-        
-        if existing:
-            return True  # Уже есть
-        
-        fav = FavoriteArticle(
-            user_id=user.id,
-            article=article,
-            product_name=product_name,
-            marketplace=marketplace,
-            added_at=datetime.utcnow()
+        insert = UPSERT_INSERTS[session.get_bind().dialect.name]
+        session.execute(
+            insert(FavoriteArticle)
+            .values(
+                user_id=user_id,
+                article=article,
+                product_name=product_name,
+                marketplace=marketplace,
+                added_at=datetime.utcnow()
+            )
+            .on_conflict_do_nothing(index_elements=['user_id', 'article'])
         )
-        session.add(fav)
         return True
 
 def get_favorite_articles(telegram_id, limit=20):
-    """Получить избранные артикулы пользователя"""
+    """Получить избранные артикулы пользователя (FavoriteRecord)"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return []
-        
-        return session.query(FavoriteArticle)\
-            .filter_by(user_id=user.id)\
+        rows = session.query(*FavoriteRecord.columns())\
+            .join(User, User.id == FavoriteArticle.user_id)\
+            .filter(User.telegram_id == telegram_id)\
             .order_by(FavoriteArticle.added_at.desc())\
-            .limit(limit)\
-            .all()
+            .limit(limit)
+        return [FavoriteRecord(*row) for row in rows]
 
 def remove_favorite_article(telegram_id, article):
     """Удалить артикул из избранного"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
+        user_id = find_user_id(session, telegram_id)
+        if not user_id:
             return False
         
         session.query(FavoriteArticle)\
-            .filter_by(user_id=user.id, article=article)\
+            .filter_by(user_id=user_id, article=article)\
             .delete()
         return True
 
@@ -285,12 +627,12 @@ def remove_favorite_article(telegram_id, article):
 def create_payment(telegram_id, payment_id, amount, template_id=None):
     """Создать запись о платеже"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
+        user_id = find_user_id(session, telegram_id)
+        if not user_id:
             return None
         
         payment = Payment(
-            user_id=user.id,
+            user_id=user_id,
             payment_id=payment_id,
             amount=amount,
             status='pending',
@@ -304,66 +646,82 @@ def create_payment(telegram_id, payment_id, amount, template_id=None):
 def confirm_payment(payment_id):
     """Подтвердить платеж"""
     with session_scope() as session:
-        payment = session.query(Payment).filter_by(payment_id=payment_id).first()
-        if payment:
-            payment.status = 'success'
-            payment.completed_at = datetime.utcnow()
-            return True
-        return False
+        payment = session.query(Payment.id, Payment.user_id, Payment.amount)\
+            .filter_by(payment_id=payment_id).first()
+        if not payment:
+            return False
+        
+        # Условный UPDATE: повторное подтверждение не учитывается в spent_stars дважды
+        confirmed = session.query(Payment)\
+            .filter(Payment.id == payment.id, Payment.status != 'success')\
+            .update({Payment.status: 'success', Payment.completed_at: datetime.utcnow()},
+                    synchronize_session=False)
+        if confirmed:
+            session.query(User).filter_by(id=payment.user_id)\
+                .update({User.spent_stars: User.spent_stars + (payment.amount or 0)},
+                        synchronize_session=False)
+            bump_counter(session, REVENUE, payment.amount or 0)
+        return True
 
 def get_user_payments(telegram_id, limit=10):
-    """Получить историю платежей пользователя"""
+    """Получить историю платежей пользователя (PaymentRecord)"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            return []
-        
-        return session.query(Payment)\
-            .filter_by(user_id=user.id)\
+        rows = session.query(*PaymentRecord.columns())\
+            .join(User, User.id == Payment.user_id)\
+            .filter(User.telegram_id == telegram_id)\
             .order_by(Payment.created_at.desc())\
-            .limit(limit)\
-            .all()
+            .limit(limit)
+        return [PaymentRecord(*row) for row in rows]
 
 # ========== РЕФЕРАЛЬНАЯ СИСТЕМА ==========
 
 def process_referral(referral_code, new_user_telegram_id):
-    """Обработать переход по реферальной ссылке"""
+    """
+    Обработать переход по реферальной ссылке
+    
+    Пригласивший ищется по коду в том же INSERT ... SELECT ... ON CONFLICT
+    (referee_id) DO NOTHING, который создает запись о реферале: повторный
+    или параллельный переход того же пользователя ничего не вставляет, и
+    бонус начисляется один раз.
+    """
     with session_scope() as session:
-        # Находим пригласившего
-        referrer = session.query(User).filter_by(referral_code=referral_code).first()
-        if not referrer:
-            return False
-        
         # Находим нового пользователя
-        new_user = session.query(User).filter_by(telegram_id=new_user_telegram_id).first()
-        if not new_user:
+        new_user_id = find_user_id(session, new_user_telegram_id)
+        if not new_user_id:
             return False
         
-        # Проверяем, не был ли уже этот пользователь приглашен
-        existing = session.query(Referral).filter_by(referee_id=new_user.id).first()
-        if existing:
+        # Создаем запись о реферале, если код верный и пользователь еще не приглашен
+        insert = UPSERT_INSERTS[session.get_bind().dialect.name]
+        referrer_id = session.execute(
+            insert(Referral)
+            .from_select(
+                ['referrer_id', 'referee_id', 'created_at'],
+                select(User.id, literal(new_user_id), literal(datetime.utcnow()))
+                .where(User.referral_code == referral_code)
+            )
+            .on_conflict_do_nothing(index_elements=['referee_id'])
+            .returning(Referral.referrer_id)
+        ).scalar()
+        if not referrer_id:
             return False
         
-        # Создаем запись о реферале
-        referral = Referral(
-            referrer_id=referrer.id,
-            referee_id=new_user.id,
-            created_at=datetime.utcnow()
+        # Бонус пригласившему и ссылка на него у нового пользователя - одним UPDATE
+        session.execute(
+            update(User)
+            .where(User.id.in_([referrer_id, new_user_id]))
+            .values(
+                referral_balance=User.referral_balance + case((User.id == referrer_id, 1), else_=0),
+                referrals_count=User.referrals_count + case((User.id == referrer_id, 1), else_=0),
+                referred_by_id=case((User.id == new_user_id, referrer_id), else_=User.referred_by_id)
+            )
         )
-        session.add(referral)
-        
-        # Начисляем бонус пригласившему
-        referrer.referral_balance += 1
-        
-        # Сохраняем, кто пригласил нового пользователя
-        new_user.referred_by_id = referrer.id
         
         return True
 
 def get_referral_stats(telegram_id):
     """Получить статистику по рефералам"""
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        user = find_user(session, telegram_id)
         if not user:
             return None
         
@@ -384,44 +742,46 @@ def get_referral_stats(telegram_id):
         }
 
 def use_referral_balance(telegram_id, amount=1):
-    """Использовать бонусные визитки"""
+    """
+    Использовать бонусные визитки
+    
+    Проверка и списание - один условный UPDATE: баланс не уходит в минус
+    при параллельных заказах.
+    """
     with session_scope() as session:
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user or user.referral_balance < amount:
-            return False
-        
-        user.referral_balance -= amount
-        return True
+        balance = session.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id, User.referral_balance >= amount)
+            .values(referral_balance=User.referral_balance - amount)
+            .returning(User.referral_balance)
+        ).scalar()
+        return balance is not None
 
 # ========== АДМИНКА ==========
 
 def get_admin_stats():
-    """Получить общую статистику для админки"""
-    with session_scope() as session:
-        # Общее количество пользователей
-        total_users = session.query(User).count()
-        
-        # Активные сегодня
+    """
+    Получить общую статистику для админки
+    
+    Итоги и значения за сегодня - из глобальных счетчиков (global_counters),
+    топ - по индексу users.cards_created: время не зависит от объема данных.
+    """
+    with read_session_scope() as session:
         today = datetime.utcnow().date()
-        active_today = session.query(User).filter(
-            func.date(User.last_activity) >= today
-        ).count()
-        
-        # Создано визиток
-        total_cards = session.query(BusinessCard).count()
+        counters = read_counters(session, today)
         
-        # Сканирований всего
-        total_scans = session.query(Scan).count()
+        def total(name):
+            return counters.get((name, ALL_TIME_DAY), 0)
         
-        # Сканирований сегодня
-        scans_today = session.query(Scan).filter(
-            func.date(Scan.scanned_at) >= today
-        ).count()
+        def for_today(name):
+            return counters.get((name, today), 0)
         
-        # Платежи
-        total_revenue = session.query(func.sum(Payment.amount))\
-            .filter_by(status='success')\
-            .scalar() or 0
+        total_users = total(USERS)
+        active_today = for_today(ACTIVE_USERS)
+        total_cards = total(CARDS)
+        total_scans = total(SCANS)
+        scans_today = for_today(SCANS)
+        total_revenue = total(REVENUE)
         
         # Топ пользователей по визиткам
         top_users = session.query(
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Легкие записи для чтения (вместо отсоединенных ORM-объектов)
+
+Функции чтения в queries.py выбирают только колонки записи и возвращают
+объекты с __slots__: без состояния ORM, identity map и ленивых связей.
+Атрибуты называются так же, как у моделей, поэтому обработчики читают
+их без изменений (user.referral_balance, template.price и т.п.).
+"""
+
+from bot.database.models import User, BusinessCard, Template, FavoriteArticle, Payment
+
+class Record:
+    """Базовый класс записей: поля - __slots__, колонки - одноименные атрибуты model"""
+    
+    __slots__ = ()
+    model = None
+    
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+    
+    @classmethod
+    def columns(cls):
+        """Колонки модели для select (в порядке __slots__)"""
+        return [getattr(cls.model, name) for name in cls.__slots__]
+    
+    @classmethod
+    def from_row(cls, row):
+        return None if row is None else cls(*row)
+    
+    @classmethod
+    def from_instance(cls, instance):
+        """Запись из уже загруженного ORM-объекта (без запроса к БД)"""
+        return cls(*(getattr(instance, name) for name in cls.__slots__))
+    
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+    
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:3])
+        return f"<{type(self).__name__}({fields})>"
+
+class UserRecord(Record):
+    """Профиль пользователя (без settings и связей)"""
+    
+    __slots__ = (
+        'id', 'telegram_id', 'username', 'first_name', 'last_name',
+        'registered_at', 'last_activity', 'is_active', 'is_admin',
+        'shop_name', 'shop_url_wb', 'shop_url_ozon',
+        'cards_created', 'referral_code', 'referral_balance'
+    )
+    model = User
+
+class UserBrief(Record):
+    """Строка списка пользователей"""
+    
+    __slots__ = ('id', 'telegram_id', 'username', 'cards_created')
+    model = User
+
+class CardRecord(Record):
+    __slots__ = (
+        'id', 'user_id', 'created_at', 'template_id', 'qr_type',
+        'target_article', 'collection_id', 'token', 'scan_count', 'last_scan'
+    )
+    model = BusinessCard
+
+class TemplateRecord(Record):
+    __slots__ = ('id', 'name', 'description', 'preview_path', 'is_active', 'price', 'category')
+    model = Template
+
+class FavoriteRecord(Record):
+    __slots__ = ('id', 'article', 'product_name', 'marketplace', 'added_at')
+    model = FavoriteArticle
+
+class PaymentRecord(Record):
+    """Платеж (без payload)"""
+    
+    __slots__ = (
+        'id', 'payment_id', 'amount', 'currency', 'status',
+        'template_id', 'quantity', 'created_at', 'completed_at'
+    )
+    model = Payment
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+Производительный режим SQLite для установки на одном сервере
+
+Включается SQLITE_TUNED=1 (только для файловой БД):
+
+- соединения не закрываются после каждой сессии, а переиспользуются из пула;
+- журнал WAL: читатели не блокируют писателя и друг друга;
+- уровень synchronous и mmap_size настраиваются (SQLITE_SYNCHRONOUS,
+  SQLITE_MMAP_SIZE);
+- пишущие транзакции процесса проходят через единственный "шлюз писателя":
+  одновременно пишет одно соединение, остальные ждут своей очереди в
+  процессе, а не крутятся в busy_timeout SQLite и не получают
+  "database is locked".
+
+pysqlite открывает транзакцию только перед первым INSERT/UPDATE/DELETE,
+поэтому читающие сессии не держат снимок БД и шлюз не занимают.
+"""
+
+import re
+import sqlite3
+import logging
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+# Операторы, которые открывают пишущую транзакцию
+WRITE_STATEMENT = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP)\b', re.IGNORECASE)
+
+class WriterGate:
+    """
+    Шлюз единственного писателя
+    
+    Соединение занимает шлюз перед первым пишущим оператором и освобождает,
+    когда возвращается в пул (после коммита или отката). Блокировка не
+    привязана к потоку: сессию может завершить другой поток.
+    """
+    
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.acquired = 0
+        self.contended = 0
+        self.wait_ms = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self, info):
+        """info - словарь соединения пула (общий для ConnectionFairy и записи пула)"""
+        if info.get('writer'):
+            return
+        
+        if not self._lock.acquire(blocking=False):
+            started = time.perf_counter()
+            if not self._lock.acquire(timeout=self.timeout):
+                raise sqlite3.OperationalError("database is locked (ожидание писателя)")
+            self.contended += 1
+            self.wait_ms += (time.perf_counter() - started) * 1000
+        
+        self.acquired += 1
+        info['writer'] = True
+    
+    def release(self, info):
+        if info.pop('writer', False):
+            self._lock.release()
+    
+    def stats(self):
+        return {
+            'writes': self.acquired,
+            'contended': self.contended,
+            'wait_ms': round(self.wait_ms, 3),
+            'busy': self._lock.locked()
+        }
+
+def is_memory_url(url):
+    """БД в памяти: у каждого соединения своя, пул и WAL неприменимы"""
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
+def check_synchronous(synchronous):
+    synchronous = synchronous.upper()
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"SQLITE_SYNCHRONOUS должен быть одним из {', '.join(SYNCHRONOUS_LEVELS)}")
+    return synchronous
+
+def apply_pragmas(engine, synchronous, mmap_size, busy_timeout):
+    """
+    PRAGMA производительного режима для каждого нового соединения
+    
+    engine - синхронный движок (для асинхронного - async_engine.sync_engine).
+    """
+    synchronous = check_synchronous(synchronous)
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+
+def create_tuned_engine(url, pool_size=8, synchronous='NORMAL', mmap_size=256 * 1024 * 1024,
+                        busy_timeout=5.0, echo=False, poolclass=QueuePool):
+    """
+    Движок SQLite в производительном режиме
+    
+    Args:
+        url: sqlite:///путь_к_файлу
+        pool_size: число постоянных соединений (параллельных читателей)
+        synchronous: OFF / NORMAL / FULL / EXTRA (с WAL достаточно NORMAL)
+        mmap_size: размер отображения файла БД в память, байт (0 - выключено)
+        busy_timeout: ожидание блокировки (SQLite и шлюза писателя), секунд
+        poolclass: QueuePool или его подкласс
+    
+    Returns:
+        (engine, WriterGate)
+    """
+    synchronous = check_synchronous(synchronous)
+    
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": busy_timeout},
+        poolclass=poolclass,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        echo=echo
+    )
+    gate = WriterGate(busy_timeout)
+    apply_pragmas(engine, synchronous, mmap_size, busy_timeout)
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def acquire_writer(conn, cursor, statement, parameters, context, executemany):
+        if WRITE_STATEMENT.match(statement):
+            gate.acquire(conn.connection.info)
+    
+    @event.listens_for(engine, 'checkin')
+    def release_writer(dbapi_connection, connection_record):
+        gate.release(connection_record.info)
+    
+    @event.listens_for(engine, 'invalidate')
+    def release_invalidated(dbapi_connection, connection_record, exception):
+        gate.release(connection_record.info)
+    
+    logger.info(f"SQLite: WAL, synchronous={synchronous}, mmap_size={mmap_size}, пул {pool_size}")
+    return engine, gate
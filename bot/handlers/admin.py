@@ -9,12 +9,19 @@ from telegram.ext import ContextTypes
 import logging
 
 from bot.config import ADMIN_IDS
-from bot.database.queries import get_admin_stats, get_all_users
+from bot.database.async_queries import (
+    get_admin_stats, get_users_page, count_users, toggle_template,
+    get_user_by_telegram_id, get_user_stats, get_all_templates
+)
+from bot.database.async_db import async_unit_of_work
 from bot.database.db import session_scope
 from bot.database.models import User, Template
 
 logger = logging.getLogger(__name__)
 
+# Пользователей на странице списка
+USERS_PAGE_SIZE = 10
+
 def is_admin(telegram_id):
     """Проверка, является ли пользователь администратором"""
     return telegram_id in ADMIN_IDS
@@ -28,7 +35,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Получаем статистику
-    stats = get_admin_stats()
+    stats = await get_admin_stats()
     
     text = (
         "👑 **Админ-панель Sylvia Bot**\n\n"
@@ -75,9 +82,21 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
     elif query.data == "admin_users":
         await show_users_list(update, context)
     
+    elif query.data.startswith("admin_users_"):
+        # admin_users_{next|prev}_{курсор}_{номер страницы}
+        direction, cursor, page = query.data.replace("admin_users_", "").split("_")
+        if direction == "next":
+            await show_users_list(update, context, after_id=int(cursor), page=int(page))
+        else:
+            await show_users_list(update, context, before_id=int(cursor), page=int(page))
+    
     elif query.data == "admin_templates":
         await manage_templates(update, context)
     
+    elif query.data.startswith("admin_template_toggle_"):
+        await toggle_template(int(query.data.replace("admin_template_toggle_", "")))
+        await manage_templates(update, context)
+    
     elif query.data == "admin_stats":
         await show_detailed_stats(update, context)
     
@@ -88,15 +107,29 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         user_id = int(query.data.replace("admin_user_", ""))
         await show_user_detail(update, context, user_id)
 
-async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать список пользователей"""
-    users = get_all_users(active_only=True)
-    
-    text = "👥 **Список пользователей**\n\n"
+async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                          after_id=None, before_id=None, page=1):
+    """
+    Показать страницу списка пользователей
+    
+    Навигация по курсорам (id крайнего пользователя страницы) в
+    callback_data, общее число - из кеша count_users.
+    """
+    async with async_unit_of_work("admin users"):
+        result = await get_users_page(after_id=after_id, before_id=before_id, limit=USERS_PAGE_SIZE)
+        total = await count_users(active_only=True)
+    users = result['users']
+    pages = max((total + USERS_PAGE_SIZE - 1) // USERS_PAGE_SIZE, 1)
+    
+    # Перед страницей никого нет (например, часть пользователей деактивирована) - это первая страница
+    if not result['has_prev']:
+        page = 1
+    
+    text = f"👥 **Список пользователей** (стр. {page} из {pages})\n\n"
     
     keyboard = []
     
-    for user in users[:10]:  # Показываем только первых 10
+    for user in users:
         username = user.username or f"id{user.telegram_id}"
         text += f"• @{username} — {user.cards_created} визиток\n"
         
@@ -108,10 +141,23 @@ async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         ])
     
-    if len(users) > 10:
-        text += f"\n... и еще {len(users) - 10} пользователей"
+    if not users:
+        text += "Пользователей нет\n"
+    
+    text += f"\nВсего: {total} активных пользователей"
     
-    text += f"\n\nВсего: {len(users)} активных пользователей"
+    # Навигация по страницам
+    navigation = []
+    if result['has_prev'] and users:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Назад", callback_data=f"admin_users_prev_{users[0].id}_{page - 1}"
+        ))
+    if result['has_next'] and users:
+        navigation.append(InlineKeyboardButton(
+            "Вперед ➡️", callback_data=f"admin_users_next_{users[-1].id}_{page + 1}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
     
     # Кнопка "Назад"
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_refresh")])
@@ -125,10 +171,9 @@ async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_user_detail(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id):
     """Показать детальную информацию о пользователе"""
-    from bot.database.queries import get_user_by_telegram_id, get_user_stats
-    
-    user = get_user_by_telegram_id(telegram_id)
-    stats = get_user_stats(telegram_id)
+    async with async_unit_of_work(f"admin user {telegram_id}"):
+        user = await get_user_by_telegram_id(telegram_id)
+        stats = await get_user_stats(telegram_id)
     
     if not user:
         await update.callback_query.edit_message_text("❌ Пользователь не найден")
@@ -171,9 +216,7 @@ async def show_user_detail(update: Update, context: ContextTypes.DEFAULT_TYPE, t
 
 async def manage_templates(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Управление шаблонами"""
-    from bot.database.queries import get_all_templates
-    
-    templates = get_all_templates(active_only=False)
+    templates = await get_all_templates(active_only=False)
     
     text = "🎨 **Управление шаблонами**\n\n"
     
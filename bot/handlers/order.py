@@ -7,14 +7,16 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import logging
+import asyncio
 import uuid
 from datetime import datetime
 
-from bot.database.queries import (
+from bot.database.async_queries import (
     get_user_by_telegram_id, create_business_card, 
     get_all_templates, get_template, add_favorite_article,
-    get_favorite_articles, use_referral_balance
+    use_referral_balance
 )
+from bot.database.async_db import async_unit_of_work
 from bot.services.card_generator import BusinessCardGenerator
 from bot.parsers.wildberries import WBParser
 from bot.parsers.ozon import OzonParser
@@ -27,6 +29,10 @@ card_generator = BusinessCardGenerator()
 wb_parser = WBParser()
 ozon_parser = OzonParser()
 
+# Одновременных запросов к WB при проверке подборок (на все подборки процесса)
+WB_CONCURRENT_REQUESTS = 3
+wb_requests = asyncio.Semaphore(WB_CONCURRENT_REQUESTS)
+
 # Состояния пользователей (хранятся в context.user_data)
 STATES = {
     'SELECTING_TEMPLATE': 1,
@@ -41,7 +47,7 @@ async def new_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Получаем все доступные шаблоны
-    templates = get_all_templates(active_only=True)
+    templates = await get_all_templates(active_only=True)
     
     if not templates:
         await update.effective_message.reply_text(
@@ -96,7 +102,7 @@ async def handle_template_choice(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     
     template_id = int(query.data.split('_')[1])
-    template = get_template(template_id)
+    template = await get_template(template_id)
     
     if not template:
         await query.edit_message_text("❌ Шаблон не найден")
@@ -107,7 +113,7 @@ async def handle_template_choice(update: Update, context: ContextTypes.DEFAULT_T
     context.user_data['template_price'] = template.price
     
     # Проверяем, платный ли шаблон
-    user = get_user_by_telegram_id(update.effective_user.id)
+    user = await get_user_by_telegram_id(update.effective_user.id)
     
     if template.price > 0 and user.referral_balance < template.price:
         # Не хватает бонусов - предлагаем купить
@@ -268,16 +274,18 @@ async def handle_collection_input(update: Update, context: ContextTypes.DEFAULT_
         )
         return
     
-    # Проверяем каждый артикул (первые 2 для скорости)
-    valid_articles = []
-    invalid_articles = []
+    # Запрашиваем все товары (не больше WB_CONCURRENT_REQUESTS одновременно):
+    # снимки карточек сохраняются вместе с подборкой, и страница подборки не
+    # ходит на маркетплейс при сканировании
+    async def fetch_product(article):
+        async with wb_requests:
+            return await wb_parser.get_product_info_async(article)
     
-    for article in articles[:3]:  # Проверяем только первые 3 для скорости
-        product = wb_parser.get_product_info(article)
-        if product:
-            valid_articles.append(article)
-        else:
-            invalid_articles.append(article)
+    products = await asyncio.gather(*(fetch_product(article) for article in articles))
+    
+    invalid_articles = [
+        article for article, product in zip(articles, products) if not product
+    ]
     
     if invalid_articles:
         await update.message.reply_text(
@@ -288,6 +296,9 @@ async def handle_collection_input(update: Update, context: ContextTypes.DEFAULT_
     
     # Сохраняем подборку
     context.user_data['collection'] = articles
+    context.user_data['collection_products'] = [
+        collection_snapshot(product) for product in products
+    ]
     
     # Генерируем уникальный ID для подборки
     collection_id = str(uuid.uuid4())[:8]
@@ -295,6 +306,17 @@ async def handle_collection_input(update: Update, context: ContextTypes.DEFAULT_
     
     await generate_card(update, context)
 
+def collection_snapshot(product):
+    """Снимок товара для страницы подборки"""
+    return {
+        'article': product['article'],
+        'name': product['name'],
+        'brand': product.get('brand', ''),
+        'price': product['price'],
+        'image': product.get('image'),
+        'url': product['url'],
+    }
+
 async def handle_favorite_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора - сохранять ли в избранное"""
     query = update.callback_query
@@ -307,7 +329,7 @@ async def handle_favorite_choice(update: Update, context: ContextTypes.DEFAULT_T
         product_name = context.user_data.get('product_name')
         marketplace = context.user_data.get('marketplace', 'wb')
         
-        add_favorite_article(telegram_id, article, product_name, marketplace)
+        await add_favorite_article(telegram_id, article, product_name, marketplace)
         
         await query.edit_message_text(
             f"✅ Артикул сохранен в избранное!\n\n"
@@ -327,20 +349,6 @@ async def generate_card(update: Update, context: ContextTypes.DEFAULT_TYPE, quer
     qr_type = context.user_data.get('qr_type', 'shop')
     template_price = context.user_data.get('template_price', 0)
     
-    # Проверяем, нужно ли списать бонусы
-    if template_price > 0:
-        # Списываем бонусы
-        if not use_referral_balance(telegram_id, template_price):
-            if query:
-                await query.edit_message_text(
-                    "❌ Недостаточно бонусов для создания визитки."
-                )
-            else:
-                await update.message.reply_text(
-                    "❌ Недостаточно бонусов для создания визитки."
-                )
-            return
-    
     # Генерируем уникальный токен для визитки
     token = str(uuid.uuid4())[:8]
     
@@ -364,16 +372,29 @@ async def generate_card(update: Update, context: ContextTypes.DEFAULT_TYPE, quer
     elif qr_type == 'collection':
         collection_id = context.user_data.get('collection_id')
         card_params['collection_id'] = collection_id
+        card_params['collection_products'] = context.user_data.get('collection_products')
         card_text = "Спасибо за покупку!\nВам также может пригодиться:"
         
     else:  # shop
         card_text = f"Спасибо за покупку!\nВозвращайтесь снова!"
     
-    # Сохраняем в БД
-    card_id = create_business_card(**card_params)
-    
-    if not card_id:
+    # Списание бонусов и визитка - одна транзакция, и она закоммичена до
+    # отправки QR-кода: пользователь не получит код несохраненной визитки
+    error_text = None
+    try:
+        async with async_unit_of_work(f"generate_card {telegram_id}"):
+            if template_price > 0 and not await use_referral_balance(telegram_id, template_price):
+                error_text = "❌ Недостаточно бонусов для создания визитки."
+            else:
+                card_id = await create_business_card(**card_params)
+                if not card_id:
+                    # Откатывает и списание бонусов
+                    raise RuntimeError("визитка не создана")
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении визитки: {e}")
         error_text = "❌ Ошибка при сохранении визитки. Попробуйте позже."
+    
+    if error_text:
         if query:
             await query.edit_message_text(error_text)
         else:
@@ -10,9 +10,8 @@ import logging
 import uuid
 
 from bot.config import PAYMENT_TOKEN
-from bot.database.queries import (
-    get_user_by_telegram_id, create_payment, confirm_payment,
-    get_template, get_all_templates
+from bot.database.async_queries import (
+    create_payment, confirm_payment, get_template, get_all_templates
 )
 
 logger = logging.getLogger(__name__)
@@ -22,7 +21,7 @@ STAR_CURRENCY = "XTR"
 
 async def buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать доступные для покупки шаблоны"""
-    templates = get_all_templates(active_only=True)
+    templates = await get_all_templates(active_only=True)
     
     # Фильтруем только платные шаблоны
     paid_templates = [t for t in templates if t.price > 0]
@@ -65,7 +64,7 @@ async def handle_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     template_id = int(query.data.split('_')[2])
-    template = get_template(template_id)
+    template = await get_template(template_id)
     
     if not template:
         await query.edit_message_text("❌ Шаблон не найден")
@@ -116,7 +115,7 @@ async def confirm_payment_handler(update: Update, context: ContextTypes.DEFAULT_
     
     # Создаем запись в БД
     telegram_id = update.effective_user.id
-    create_payment(telegram_id, payment_id, price, template_id)
+    await create_payment(telegram_id, payment_id, price, template_id)
     
     # Создаем счет в Telegram Stars
     # Формируем массив цен (для звезд это просто число)
@@ -161,7 +160,7 @@ async def successful_payment_handler(update: Update, context: ContextTypes.DEFAU
     amount = payment.total_amount
     
     # Подтверждаем платеж в БД
-    confirm_payment(payment_id)
+    await confirm_payment(payment_id)
     
     # Получаем данные из контекста (если еще есть)
     template_id = context.user_data.get('buy_template_id', 1)
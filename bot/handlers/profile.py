@@ -9,10 +9,13 @@ from telegram.ext import ContextTypes
 import logging
 from datetime import datetime, timedelta
 
-from bot.database.queries import (
+from bot.database.async_queries import (
     get_user_by_telegram_id, get_user_stats, get_user_cards,
     get_card_stats
 )
+from bot.database.async_db import async_unit_of_work
+from bot.utils.signing import signing_enabled, export_url
+from bot.config import REDIRECT_BASE_URL
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +24,10 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    # Получаем данные пользователя
-    db_user = get_user_by_telegram_id(telegram_id)
-    stats = get_user_stats(telegram_id)
+    # Получаем данные пользователя (одно соединение на оба запроса)
+    async with async_unit_of_work(f"show_profile {telegram_id}"):
+        db_user = await get_user_by_telegram_id(telegram_id)
+        stats = await get_user_stats(telegram_id)
     
     if not db_user or not stats:
         await update.message.reply_text("❌ Ошибка получения данных")
@@ -40,6 +44,7 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📊 **Статистика:**\n"
         f"• Создано визиток: **{stats['cards_created']}**\n"
         f"• Получено сканирований: **{stats['scans_received']}**\n"
+        f"• Уникальных покупателей: **~{stats['unique_visitors']}**\n"
         f"• Рефералов: **{stats['referrals_count']}**\n"
         f"• Потрачено звезд: **{stats['spent_stars']} ⭐**\n"
         f"• Бонусный баланс: **{stats['balance']} ⭐**\n\n"
@@ -61,6 +66,11 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🛍 Мои визитки", callback_data="profile_cards")],
         [InlineKeyboardButton("🏪 Редактировать магазин", callback_data="profile_edit_shop")]
     ]
+    if signing_enabled():
+        # Подписанная ссылка: выгрузка отдает сырые логи только владельцу
+        keyboard.append([InlineKeyboardButton(
+            "📥 Выгрузить сканирования (CSV)", url=export_url(REDIRECT_BASE_URL, db_user.id)
+        )])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Если это callback (пришли из меню)
@@ -76,7 +86,7 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = update.effective_user.id
     
     # Получаем последние визитки
-    cards = get_user_cards(telegram_id, limit=5)
+    cards = await get_user_cards(telegram_id, limit=5)
     
     if not cards:
         await update.message.reply_text(
@@ -91,7 +101,7 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     for card in cards:
         # Получаем статистику по конкретной визитке
-        card_stats = get_card_stats(card.id)
+        card_stats = await get_card_stats(card.id)
         
         # Определяем тип QR
         qr_types = {
@@ -151,7 +161,7 @@ async def handle_stats_period(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def show_card_detail(update: Update, context: ContextTypes.DEFAULT_TYPE, card_id):
     """Показать детальную статистику по конкретной визитке"""
-    card_stats = get_card_stats(card_id)
+    card_stats = await get_card_stats(card_id)
     
     if not card_stats:
         await update.callback_query.edit_message_text("❌ Визитка не найдена")
@@ -160,6 +170,7 @@ async def show_card_detail(update: Update, context: ContextTypes.DEFAULT_TYPE, c
     # Формируем текст
     text = f"📊 **Детальная статистика визитки #{card_id}**\n\n"
     text += f"**Всего сканирований:** {card_stats['total']}\n"
+    text += f"**Уникальных покупателей:** ~{card_stats['unique']}\n"
     
     if card_stats['last_scan']:
         last = card_stats['last_scan'].strftime('%d.%m.%Y %H:%M')
@@ -175,6 +186,12 @@ async def show_card_detail(update: Update, context: ContextTypes.DEFAULT_TYPE, c
     else:
         text += "Нет данных о сканированиях за последние 30 дней."
     
+    # Откуда сканируют (если на веб-сервисе подключена GeoIP база)
+    if card_stats.get('regions'):
+        text = text.rstrip("\n") + "\n\n**Регионы:**\n"
+        for region in card_stats['regions']:
+            text += f"• {region['region']}: {region['count']}\n"
+    
     # Кнопка "Назад"
     keyboard = [[InlineKeyboardButton("🔙 К списку визиток", callback_data="stats_refresh")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -8,7 +8,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import logging
 
-from bot.database.queries import get_user_by_telegram_id, get_referral_stats
+from bot.database.async_queries import get_user_by_telegram_id, get_referral_stats
 from bot.config import REDIRECT_BASE_URL
 
 logger = logging.getLogger(__name__)
@@ -19,7 +19,7 @@ async def show_referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = user.id
     
     # Получаем статистику
-    stats = get_referral_stats(telegram_id)
+    stats = await get_referral_stats(telegram_id)
     
     if not stats:
         await update.message.reply_text(
@@ -66,7 +66,7 @@ async def show_referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать текущий баланс бонусов"""
     telegram_id = update.effective_user.id
-    user = get_user_by_telegram_id(telegram_id)
+    user = await get_user_by_telegram_id(telegram_id)
     
     if not user:
         await update.message.reply_text("❌ Пользователь не найден")
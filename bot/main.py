@@ -1,9 +1,10 @@
 import os
 import logging
 import asyncio
+import concurrent.futures
 import threading
 import time
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, PreCheckoutQueryHandler, filters
 from dotenv import load_dotenv
@@ -27,8 +28,12 @@ if not TOKEN:
 RENDER_URL = os.environ.get("RENDER_URL", "https://sylvia-shop-bot.onrender.com")
 WEBHOOK_URL = f"{RENDER_URL}/webhook"
 
+# Сколько секунд поток вебхука ждет обработки обновления (дальше она продолжается в цикле бота)
+UPDATE_TIMEOUT = float(os.environ.get("UPDATE_TIMEOUT", 30))
+
 # Глобальные переменные
 telegram_app = None
+bot_loop = None
 bot_ready = False
 bot_lock = threading.Lock()
 
@@ -41,19 +46,19 @@ def webhook():
             logger.info(f"📥 Получен webhook: {update_data.get('update_id', 'unknown')}")
 
             with bot_lock:
-                if telegram_app is None:
+                if telegram_app is None or bot_loop is None:
                     logger.error("❌ Бот не инициализирован!")
                     return 'Bot not initialized', 503
 
-                # ✅ ФИНАЛЬНАЯ ВЕРСИЯ - создаём новый loop и НЕ закрываем его сразу
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                # Запускаем обработку
-                loop.run_until_complete(process_update_async(update_data))
-                
-                # ❌ НЕ закрываем loop здесь! Он закроется сам
-                # loop.close() - УБРАНО!
+            # Обновления выполняются в постоянном цикле событий бота: пока одно
+            # ждет ответа БД или Telegram, обрабатываются другие
+            future = asyncio.run_coroutine_threadsafe(process_update_async(update_data), bot_loop)
+            try:
+                future.result(timeout=UPDATE_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                # Ответ 200: иначе Telegram доставит то же обновление повторно
+                logger.warning(f"⏳ Обновление {update_data.get('update_id', 'unknown')} "
+                               f"обрабатывается дольше {UPDATE_TIMEOUT:.0f} с")
 
             return 'OK', 200
         except Exception as e:
@@ -71,6 +76,7 @@ async def process_update_async(update_data):
         elif update.callback_query:
             logger.info(f"🔘 Получен callback: '{update.callback_query.data}'")
 
+        # Транзакции открывают сами обработчики (async_unit_of_work) - только на время запросов к БД
         await telegram_app.process_update(update)
         logger.info(f"✅ Обновление {update.update_id} успешно обработано")
 
@@ -85,6 +91,30 @@ def health():
 def index():
     return 'Sylvia Bot is running!', 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Замеры БД процесса бота: время запросов, медленные запросы по
+    отпечаткам SQL, пулы соединений (ожидание, размер, переполнение),
+    единицы работы, кеши и реплика
+    """
+    from bot.database.db import unit_of_work_stats, writer_gate, replica_engine, replica_guard
+    from bot.database.instrumentation import db_metrics
+    from bot.database.identity import identity_cache
+    from bot.database.queries import template_cache
+
+    return jsonify({
+        'pid': os.getpid(),
+        'db': db_metrics.snapshot(),
+        'units_of_work': unit_of_work_stats.snapshot(),
+        'caches': {
+            'identity': identity_cache.stats(),
+            'templates': template_cache.stats()
+        },
+        'writer_gate': writer_gate.stats() if writer_gate else None,
+        'replica': replica_guard.stats() if replica_engine is not None else None
+    })
+
 # ========== Регистрация обработчиков ==========
 def register_handlers():
     try:
@@ -143,6 +173,14 @@ async def init_bot_and_webhook():
             logger.info("🔄 Фоновая инициализация бота...")
             telegram_app = Application.builder().token(TOKEN).build()
             register_handlers()
+
+            from bot.database.db import init_db
+            init_db()
+
+            from bot.services.stats import start_stats_backfill, start_stats_repair_scheduler
+            start_stats_repair_scheduler()
+            from bot.services.archive import start_scan_archive_scheduler
+            start_scan_archive_scheduler()
            
             await telegram_app.initialize()
 
@@ -156,6 +194,9 @@ async def init_bot_and_webhook():
             )
             logger.info(f"✅ Фон: вебхук установлен: {WEBHOOK_URL}")
 
+            # Разовые пересчеты статистики - в своем потоке, после запуска бота
+            start_stats_backfill()
+
             webhook_info = await telegram_app.bot.get_webhook_info()
             logger.info(f"ℹ️ Фон: информация о вебхуке: {webhook_info}")
 
@@ -168,8 +209,10 @@ async def init_bot_and_webhook():
             logger.error(f"❌ Критическая ошибка фоновой инициализации: {e}", exc_info=True)
 
 def run_bot_background():
+    global bot_loop
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    bot_loop = loop
     try:
         loop.run_until_complete(init_bot_and_webhook())
         logger.info("🔄 Фоновый цикл обработки событий запущен")
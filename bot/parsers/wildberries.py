@@ -10,6 +10,7 @@ import asyncio
 import logging
 import json
 import random
+from bisect import bisect_left
 from typing import Optional, Dict, List
 from fake_useragent import UserAgent
 from datetime import datetime
@@ -87,34 +88,53 @@ class WBParser:
             return None
     
     async def get_product_info_async(self, article: str) -> Optional[Dict]:
-        """Асинхронное получение информации о товаре"""
+        """
+        Асинхронное получение информации о товаре
+        
+        Как и get_product_info: если прямой запрос не удался, повторяем его
+        через прокси.
+        """
+        article = ''.join(filter(str.isdigit, article))
+        
+        if not article:
+            return None
+        
         try:
-            article = ''.join(filter(str.isdigit, article))
+            return await self._request_product_async(article)
+        except Exception as e:
+            logger.warning(f"Ошибка WB API (артикул {article}): {e}")
+        
+        try:
+            proxy = await self.proxy_rotator.get_proxy()
             
-            if not article:
+            if not proxy:
+                logger.warning("Нет доступных прокси")
                 return None
             
-            params = {'nm': article}
-            headers = self._get_headers()
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    self.base_url,
-                    params=params,
-                    headers=headers,
-                    timeout=10
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return self._parse_product_response(data, article)
-                    else:
-                        logger.warning(f"Ошибка WB API: {response.status}")
-                        return None
-                        
+            return await self._request_product_async(article, proxy=proxy, timeout=15)
+        
         except Exception as e:
-            logger.error(f"Ошибка асинхронного парсинга WB: {e}")
+            logger.error(f"Ошибка запроса через прокси: {e}")
             return None
     
+    async def _request_product_async(self, article: str, proxy: Optional[str] = None,
+                                     timeout: int = 10) -> Optional[Dict]:
+        """Запрос к API карточек (ответ не 200 - исключение)"""
+        params = {'nm': article}
+        headers = self._get_headers()
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                self.base_url,
+                params=params,
+                headers=headers,
+                proxy=proxy,
+                timeout=timeout
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return self._parse_product_response(data, article)
+    
     def _get_product_with_proxy(self, article: str) -> Optional[Dict]:
         """Получение товара через прокси"""
         try:
@@ -152,6 +172,38 @@ class WBParser:
             logger.error(f"Ошибка запроса через прокси: {e}")
             return None
     
+    # Фото товаров лежат в корзинах CDN basket-NN.wbbasket.ru, корзина
+    # выбирается по vol = артикул // 100000. Верхние границы vol для
+    # basket-01, basket-02, ... повторяют функцию выбора корзины из скриптов
+    # карточки товара на wildberries.ru; при появлении новых корзин WB
+    # таблицу нужно дополнять.
+    BASKET_VOL_LIMITS = (143, 287, 431, 719, 1007, 1061, 1115, 1169, 1313,
+                         1601, 1655, 1919, 2045, 2189, 2405, 2621, 2837)
+    # Новые корзины WB открывает блоками одной ширины (последние - по 216 vol):
+    # для артикулов новее таблицы номер корзины продолжается с этим шагом
+    BASKET_VOL_STEP = 216
+    
+    def get_image_url(self, article: str, size: str = 'c246x328') -> str:
+        """
+        URL главного фото товара на CDN Wildberries (без запроса к API)
+        
+        Args:
+            article: Артикул товара
+            size: Размер превью (c246x328, c516x688, big)
+        """
+        nm = int(article)
+        vol = nm // 100000
+        part = nm // 1000
+        
+        last_limit = self.BASKET_VOL_LIMITS[-1]
+        if vol <= last_limit:
+            basket = bisect_left(self.BASKET_VOL_LIMITS, vol) + 1
+        else:
+            overflow = vol - last_limit
+            basket = len(self.BASKET_VOL_LIMITS) + (overflow + self.BASKET_VOL_STEP - 1) // self.BASKET_VOL_STEP
+        
+        return f"https://basket-{basket:02d}.wbbasket.ru/vol{vol}/part{part}/{nm}/images/{size}/1.webp"
+    
     def _parse_product_response(self, data: Dict, article: str) -> Optional[Dict]:
         """Парсинг ответа от API Wildberries"""
         try:
@@ -189,6 +241,7 @@ class WBParser:
                 'reviews': reviews,
                 'volume': volume,
                 'url': f"https://www.wildberries.ru/catalog/{article}/detail.aspx",
+                'image': self.get_image_url(article),
                 'marketplace': 'wb',
                 'parsed_at': datetime.now().isoformat()
             }
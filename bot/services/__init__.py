@@ -3,4 +3,5 @@ from bot.services.card_generator import BusinessCardGenerator
 from bot.services.qr_service import QRService
 from bot.services.proxy_rotator import ProxyRotator
 from bot.services.backup import BackupService, start_backup_scheduler
-from bot.services.stats import StatsService
+from bot.services.stats import StatsService, start_stats_repair_scheduler
+from bot.services.archive import ScanArchiveService, start_scan_archive_scheduler
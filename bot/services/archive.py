@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Архив старых сканирований и секции таблицы scans
+
+Ежедневная задача:
+
+- создает секции scans на SCANS_PARTITION_MONTHS_AHEAD месяцев вперед
+  (PostgreSQL, bot.database.partitions);
+- месяцы старше SCANS_RETENTION_MONTHS по порядку переносит в файлы
+  SCANS_ARCHIVE_DIR (bot.utils.scan_archive) и удаляет из scans: в
+  PostgreSQL - DROP секции, в SQLite - DELETE диапазона.
+
+Агрегаты (card_daily_stats, скетчи, global_counters, scan_count визиток)
+при этом не меняются, и статистика за архивные месяцы в боте остается.
+Пересчеты StatsService берут архивные месяцы из card_daily_stats (см.
+archived_before).
+"""
+
+import os
+import logging
+import threading
+import time
+from datetime import datetime, time as day_time
+
+import schedule
+from sqlalchemy import func, select, delete, insert
+
+from bot.config import SCANS_PARTITION_MONTHS_AHEAD, SCANS_RETENTION_MONTHS, SCANS_ARCHIVE_DIR
+from bot.database.db import engine, session_scope
+from bot.database.models import Scan, ScanArchive
+from bot.database.partitions import (
+    month_start, add_months, ensure_partitions, list_partitions, default_partition_oldest, drop_partition
+)
+from bot.utils.scan_archive import COLUMNS, archive_available, archive_file_name, write_archive
+
+logger = logging.getLogger(__name__)
+
+# Меньше нельзя: статистика бота читает сырые сканирования за последние 30 дней
+MIN_RETENTION_MONTHS = 2
+
+# Свой планировщик: общий schedule обходят потоки других сервисов, и задача могла бы запуститься дважды
+scheduler = schedule.Scheduler()
+
+def month_range(month):
+    """Границы месяца для фильтра по scanned_at: [начало, начало следующего)"""
+    return datetime.combine(month, day_time.min), datetime.combine(add_months(month, 1), day_time.min)
+
+def archived_before(session):
+    """
+    Начало сканирований, которые еще в scans (все более ранние - в архиве)
+    
+    Returns:
+        datetime или None, если архива нет
+    """
+    month = session.query(func.max(ScanArchive.month)).scalar()
+    return month_range(month)[1] if month is not None else None
+
+class ScanArchiveService:
+    """Секции и архив таблицы scans"""
+    
+    @staticmethod
+    def ensure_partitions():
+        """Секции на SCANS_PARTITION_MONTHS_AHEAD месяцев вперед (только PostgreSQL)"""
+        if engine.dialect.name != 'postgresql':
+            return []
+        
+        with session_scope() as session:
+            created = ensure_partitions(session, SCANS_PARTITION_MONTHS_AHEAD)
+        if created:
+            logger.info(f"Созданы секции scans: {', '.join(created)}")
+        return created
+    
+    @staticmethod
+    def months_to_archive(cutoff):
+        """
+        Месяцы со сканированиями раньше cutoff (первое число месяца), по возрастанию
+        
+        Уже архивированные месяцы пропускаются: их файлы не перезаписываются.
+        """
+        with session_scope() as session:
+            if engine.dialect.name == 'postgresql':
+                months = {month for month in list_partitions(session) if month < cutoff}
+                oldest = default_partition_oldest(session)
+            else:
+                months = set()
+                oldest = session.query(func.min(Scan.scanned_at)).scalar()
+            archived = archived_before(session)
+        
+        if oldest is not None:
+            month = month_start(oldest)
+            while month < cutoff:
+                months.add(month)
+                month = add_months(month, 1)
+        if archived is not None:
+            months = {month for month in months if month >= archived.date()}
+        return sorted(months)
+    
+    @staticmethod
+    def archive_month(month, batch_size=50000):
+        """
+        Перенос сканирований месяца month в архивный файл
+        
+        Сначала файл записывается и сбрасывается на диск, затем в одной
+        транзакции сверяется число строк, месяц удаляется из scans и
+        записывается в scan_archives. При ошибке сканирования остаются в БД,
+        а файл перезапишется при следующем запуске.
+        
+        Returns:
+            Количество перенесенных сканирований
+        """
+        start, end = month_range(month)
+        in_month = (Scan.scanned_at >= start, Scan.scanned_at < end)
+        os.makedirs(SCANS_ARCHIVE_DIR, exist_ok=True)
+        path = os.path.join(SCANS_ARCHIVE_DIR, archive_file_name(month))
+        
+        with session_scope() as session:
+            result = session.execute(
+                select(*(getattr(Scan, column) for column in COLUMNS))
+                .where(*in_month)
+                .order_by(Scan.card_id, Scan.scanned_at)
+                .execution_options(yield_per=batch_size)
+            )
+            rows = write_archive(path, result.partitions())
+        
+        with session_scope() as session:
+            current = session.query(func.count(Scan.id)).filter(*in_month).scalar()
+            if current != rows:
+                raise RuntimeError(f"Сканирования за {month:%Y-%m} изменились во время архивирования "
+                                   f"({rows} в архиве, {current} в БД)")
+            
+            if engine.dialect.name == 'postgresql' and month in list_partitions(session):
+                drop_partition(session, month)
+            # В PostgreSQL остаются только строки scans_default
+            session.execute(delete(Scan).where(*in_month))
+            session.execute(insert(ScanArchive).values(
+                month=month,
+                path=path if rows else None,
+                rows=rows,
+                size_bytes=os.path.getsize(path) if rows else 0,
+                archived_at=datetime.utcnow()
+            ))
+        
+        logger.info(f"Сканирования за {month:%Y-%m} перенесены в архив: {rows} строк, {path}")
+        return rows
+    
+    @staticmethod
+    def apply_retention():
+        """
+        Перенос в архив месяцев старше SCANS_RETENTION_MONTHS
+        
+        Returns:
+            Количество перенесенных сканирований
+        """
+        if SCANS_RETENTION_MONTHS <= 0:
+            return 0
+        if not archive_available():
+            logger.warning("Архив сканирований выключен: не установлен пакет pyarrow")
+            return 0
+        
+        retention = max(SCANS_RETENTION_MONTHS, MIN_RETENTION_MONTHS)
+        cutoff = add_months(month_start(datetime.utcnow()), -retention)
+        
+        archived = 0
+        for month in ScanArchiveService.months_to_archive(cutoff):
+            archived += ScanArchiveService.archive_month(month)
+        return archived
+
+def scan_archive_job():
+    """Задача для планировщика"""
+    try:
+        ScanArchiveService.ensure_partitions()
+        ScanArchiveService.apply_retention()
+    except Exception as e:
+        logger.error(f"Ошибка архивирования сканирований: {e}")
+
+def start_scan_archive_scheduler():
+    """Запуск ежедневного обслуживания таблицы scans"""
+    # После сверки статистики (04:00)
+    scheduler.every().day.at("04:30").do(scan_archive_job)
+    
+    def run_scheduler():
+        while True:
+            scheduler.run_pending()
+            time.sleep(60)
+    
+    thread = threading.Thread(target=run_scheduler, daemon=True)
+    thread.start()
+    
+    logger.info("Планировщик архива сканирований запущен")
@@ -4,23 +4,50 @@
 Сервис для сбора и агрегации статистики
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime, date, time as day_time, timedelta
 from typing import Dict, List, Optional
 import logging
+import threading
+import time
 
-from bot.database.queries import get_admin_stats
-from bot.database.db import session_scope
-from bot.database.models import Scan, BusinessCard, User
+import schedule
+from sqlalchemy import func, delete, select, union_all, true, literal, or_, and_
+
+from bot.database.queries import get_admin_stats, UPSERT_INSERTS
+from bot.database.db import session_scope, read_session_scope
+from bot.services.archive import archived_before
+from bot.database.models import (
+    Scan, BusinessCard, User, Referral, Payment, CardDailyStat, ScanSketch, GlobalCounter
+)
+from bot.utils.hyperloglog import HLL_REGISTERS, ALL_TIME_DAY, visitor_hash, register_update, merge
+from bot.utils.counters import USERS, ACTIVE_USERS, CARDS, SCANS, REVENUE
 
 logger = logging.getLogger(__name__)
 
+# Свой планировщик, как в bot.services.archive: общий schedule обходят потоки других сервисов
+scheduler = schedule.Scheduler()
+
+def scans_before(session, first_day):
+    """
+    Есть ли сканирования раньше дня first_day (None - нет ни одного дня)
+    
+    Проверяется только самое раннее сканирование по первичному ключу, без
+    обхода таблицы scans.
+    """
+    oldest = session.query(Scan.scanned_at).order_by(Scan.id).limit(1).scalar()
+    if oldest is None:
+        return False
+    if isinstance(first_day, str):  # SQLite возвращает дату строкой
+        first_day = date.fromisoformat(first_day)
+    return first_day is None or oldest.date() < first_day
+
 class StatsService:
     """Сервис статистики"""
     
     @staticmethod
     def get_daily_stats(days=30):
         """Получить статистику по дням"""
-        with session_scope() as session:
+        with read_session_scope() as session:
             start_date = datetime.utcnow() - timedelta(days=days)
             
             # Сканирования по дням
@@ -62,7 +89,7 @@ class StatsService:
     @staticmethod
     def get_top_users(limit=10):
         """Топ пользователей по визиткам"""
-        with session_scope() as session:
+        with read_session_scope() as session:
             users = session.query(
                 User.telegram_id,
                 User.username,
@@ -83,7 +110,7 @@ class StatsService:
     @staticmethod
     def get_top_cards(limit=10):
         """Топ визиток по сканированиям"""
-        with session_scope() as session:
+        with read_session_scope() as session:
             cards = session.query(
                 BusinessCard.id,
                 BusinessCard.token,
@@ -110,7 +137,7 @@ class StatsService:
     @staticmethod
     def get_hourly_stats(hours=24):
         """Почасовая статистика"""
-        with session_scope() as session:
+        with read_session_scope() as session:
             start_date = datetime.utcnow() - timedelta(hours=hours)
             
             scans = session.query(
@@ -151,6 +178,364 @@ class StatsService:
             }
         
         return stats
+    
+    @staticmethod
+    def rebuild_card_daily_stats():
+        """
+        Пересчет дневных счетчиков визиток по сырой таблице scans
+        
+        Нужен один раз после обновления (для истории до появления
+        card_daily_stats) или для исправления расхождений. Сканирования и
+        счетчики читаются одним запросом (одним снимком БД), а исправление
+        применяется как разница (scans = scans + расхождение) через
+        INSERT ... ON CONFLICT, поэтому увеличения, которые веб-сервис
+        записывает параллельно, не теряются и не конфликтуют с пересчетом.
+        Дни, перенесенные в архив сканирований, не пересчитываются.
+        
+        Returns:
+            Количество исправленных строк
+        """
+        with session_scope() as session:
+            archived = archived_before(session)
+            
+            day = func.date(Scan.scanned_at)
+            actual = select(Scan.card_id, day.label('day'), func.count().label('scans'))\
+                .where(Scan.scanned_at.isnot(None))\
+                .group_by(Scan.card_id, day)
+            counted = select(CardDailyStat.card_id, CardDailyStat.day, -CardDailyStat.scans)
+            if archived is not None:
+                actual = actual.where(Scan.scanned_at >= archived)
+                counted = counted.where(CardDailyStat.day >= archived.date())
+            
+            rows = union_all(actual, counted).subquery()
+            drift = select(rows.c.card_id, rows.c.day, func.sum(rows.c.scans))\
+                .where(true())\
+                .group_by(rows.c.card_id, rows.c.day)\
+                .having(func.sum(rows.c.scans) != 0)
+            
+            upsert = UPSERT_INSERTS[session.get_bind().dialect.name]
+            statement = upsert(CardDailyStat).from_select(['card_id', 'day', 'scans'], drift)
+            result = session.execute(statement.on_conflict_do_update(
+                index_elements=['card_id', 'day'],
+                set_={'scans': CardDailyStat.scans + statement.excluded.scans}
+            ))
+            logger.info(f"Дневные счетчики визиток пересчитаны: {result.rowcount} строк исправлено")
+            return result.rowcount
+    
+    @staticmethod
+    def init_card_daily_stats():
+        """
+        Заполнение дневных счетчиков визиток при первом запуске
+        
+        Пересчет нужен, если самое раннее сканирование в scans (по первичному
+        ключу - без обхода таблицы) старше первого дня в card_daily_stats:
+        история до появления таблицы. Пустота таблицы - не признак:
+        веб-сервис мог уже начать писать счетчики за сегодня. Архивные
+        месяцы в scans отсутствуют и пересчет не запускают.
+        """
+        with session_scope() as session:
+            first_day = session.query(func.min(CardDailyStat.day)).scalar()
+            if not scans_before(session, first_day):
+                return 0
+        return StatsService.rebuild_card_daily_stats()
+    
+    @staticmethod
+    def rebuild_scan_sketches(batch_size=1000):
+        """
+        Пересчет HyperLogLog-скетчей уникальных посетителей по таблице scans
+        
+        Визитки обходятся по одной: сканирования визитки читаются по индексу
+        (card_id, scanned_at), и в памяти держатся только ее скетчи. Они
+        объединяются (merge) с записанными в своей короткой транзакции, поэтому
+        посетители, которых веб-сервис добавляет параллельно, и архивные
+        месяцы, которых в scans уже нет, сохраняются. Скетчи продавца не
+        хранятся (объединяются из скетчей визиток при чтении), прежние строки
+        scope='user' удаляются.
+        
+        Returns:
+            Количество обновленных скетчей
+        """
+        with session_scope() as session:
+            session.execute(delete(ScanSketch).where(ScanSketch.scope == 'user'))
+        
+        def card_sketches(card_id):
+            sketches = {}
+            with session_scope() as session:
+                rows = session.query(
+                    func.date(Scan.scanned_at),
+                    Scan.ip_address,
+                    Scan.user_agent
+                ).filter(
+                    Scan.card_id == card_id,
+                    Scan.scanned_at.isnot(None)
+                ).yield_per(10000)
+                
+                for day, ip_address, user_agent in rows:
+                    if isinstance(day, str):  # SQLite возвращает дату строкой
+                        day = date.fromisoformat(day)
+                    index, rank = register_update(visitor_hash(ip_address, user_agent))
+                    for key in (day, ALL_TIME_DAY):
+                        registers = sketches.get(key)
+                        if registers is None:
+                            registers = sketches[key] = bytearray(HLL_REGISTERS)
+                        if registers[index] < rank:
+                            registers[index] = rank
+            return sketches
+        
+        def store(card_id, sketches):
+            # Дни по убыванию: строки блокируются в том же порядке, что и в
+            # SCAN_INGEST_SQL веб-сервиса (день, затем "за все время")
+            days = sorted(sketches, reverse=True)
+            with session_scope() as session:
+                upsert = UPSERT_INSERTS[session.get_bind().dialect.name]
+                session.execute(upsert(ScanSketch).values([
+                    {'scope': 'card', 'owner_id': card_id, 'day': day, 'registers': bytes(HLL_REGISTERS)}
+                    for day in days
+                ]).on_conflict_do_nothing())
+                
+                stored = session.query(ScanSketch)\
+                    .filter(ScanSketch.scope == 'card', ScanSketch.owner_id == card_id, ScanSketch.day.in_(days))\
+                    .order_by(ScanSketch.day.desc())\
+                    .with_for_update()
+                updated = 0
+                for sketch in stored:
+                    registers = merge((sketch.registers, bytes(sketches[sketch.day])))
+                    if registers != sketch.registers:
+                        sketch.registers = registers
+                        updated += 1
+                return updated
+        
+        written = 0
+        last_id = 0
+        while True:
+            with session_scope() as session:
+                card_ids = [card_id for (card_id,) in session.query(BusinessCard.id)
+                            .filter(BusinessCard.id > last_id)
+                            .order_by(BusinessCard.id)
+                            .limit(batch_size)]
+            if not card_ids:
+                break
+            
+            for card_id in card_ids:
+                sketches = card_sketches(card_id)
+                if sketches:
+                    written += store(card_id, sketches)
+            last_id = card_ids[-1]
+        
+        logger.info(f"Скетчи уникальных посетителей пересчитаны: {written} строк обновлено")
+        return written
+    
+    @staticmethod
+    def init_scan_sketches():
+        """
+        Заполнение скетчей уникальных посетителей при первом запуске
+        
+        Признак - как в init_card_daily_stats: самое раннее сканирование старше
+        первого дневного скетча визиток.
+        """
+        with session_scope() as session:
+            first_day = session.query(func.min(ScanSketch.day))\
+                .filter(ScanSketch.scope == 'card', ScanSketch.day != ALL_TIME_DAY)\
+                .scalar()
+            if not scans_before(session, first_day):
+                return 0
+        return StatsService.rebuild_scan_sketches()
+    
+    @staticmethod
+    def rebuild_global_counters():
+        """
+        Пересчет глобальных счетчиков админки по исходным таблицам
+        
+        Нужен один раз после обновления (для истории до появления
+        global_counters) или для исправления расхождений. Как и в
+        rebuild_card_daily_stats, исходные таблицы и счетчики читаются одним
+        запросом, а разница добавляется в шард 0 через INSERT ... ON CONFLICT:
+        увеличения, записанные параллельно (в любые шарды), не теряются.
+        Активные пользователи пересчитываются только за сегодня.
+        
+        Returns:
+            Количество исправленных строк
+        """
+        sources = {
+            USERS: (User.registered_at, func.count(User.id), None),
+            CARDS: (BusinessCard.created_at, func.count(BusinessCard.id), None),
+            SCANS: (Scan.scanned_at, func.count(Scan.id), None),
+            REVENUE: (Payment.completed_at, func.sum(Payment.amount), Payment.status == 'success'),
+        }
+        today = datetime.utcnow().date()
+        
+        with session_scope() as session:
+            archived = archived_before(session)
+            
+            parts = []
+            for name, (column, aggregate, condition) in sources.items():
+                value = func.coalesce(aggregate, 0)
+                day = func.date(column)
+                total = select(literal(ALL_TIME_DAY), literal(name), value)
+                daily = select(day, literal(name), value).where(column.isnot(None)).group_by(day)
+                if condition is not None:
+                    total = total.where(condition)
+                    daily = daily.where(condition)
+                parts += [total, daily]
+            
+            # Сканирования, перенесенные в архив, - по дневным счетчикам визиток
+            if archived is not None:
+                archived_days = CardDailyStat.day < archived.date()
+                parts += [
+                    select(literal(ALL_TIME_DAY), literal(SCANS), func.coalesce(func.sum(CardDailyStat.scans), 0))
+                        .where(archived_days),
+                    select(CardDailyStat.day, literal(SCANS), func.sum(CardDailyStat.scans))
+                        .where(archived_days)
+                        .group_by(CardDailyStat.day),
+                ]
+            
+            parts.append(
+                select(literal(today), literal(ACTIVE_USERS), func.count(User.id))
+                    .where(User.last_activity >= datetime.combine(today, day_time.min))
+            )
+            parts.append(
+                select(GlobalCounter.day, GlobalCounter.name, -GlobalCounter.value)
+                    .where(or_(
+                        GlobalCounter.name.in_(list(sources)),
+                        and_(GlobalCounter.name == ACTIVE_USERS, GlobalCounter.day == today)
+                    ))
+            )
+            
+            rows = union_all(*parts).subquery()
+            day, name, value = rows.c
+            drift = select(day, name, literal(0), func.sum(value))\
+                .where(true())\
+                .group_by(day, name)\
+                .having(func.sum(value) != 0)
+            
+            upsert = UPSERT_INSERTS[session.get_bind().dialect.name]
+            statement = upsert(GlobalCounter).from_select(['day', 'name', 'shard', 'value'], drift)
+            result = session.execute(statement.on_conflict_do_update(
+                index_elements=['day', 'name', 'shard'],
+                set_={'value': GlobalCounter.value + statement.excluded.value}
+            ))
+            logger.info(f"Глобальные счетчики пересчитаны: {result.rowcount} строк исправлено")
+            return result.rowcount
+    
+    @staticmethod
+    def init_global_counters():
+        """
+        Заполнение глобальных счетчиков при первом запуске
+        
+        Признак заполненности - итог USERS: его пишет только бот, а веб-сервис
+        мог начать увеличивать SCANS раньше.
+        """
+        with session_scope() as session:
+            if session.query(GlobalCounter.day).filter_by(name=USERS, day=ALL_TIME_DAY).first() is not None:
+                return 0
+        return StatsService.rebuild_global_counters()
+    
+    @staticmethod
+    def repair_user_stats(batch_size=1000):
+        """
+        Сверка снимка статистики пользователей с исходными таблицами
+        
+        Проверяются users.cards_created, referrals_count и spent_stars
+        (сканирования продавца считаются по визиткам, см. get_user_stats).
+        Снимок и фактические значения читаются одним запросом (одним снимком
+        БД), а исправление применяется как разница (счетчик = счетчик +
+        расхождение), поэтому визитки и платежи, записанные параллельно со
+        сверкой, не теряются.
+        
+        Returns:
+            Количество исправленных пользователей
+        """
+        actual = {
+            User.cards_created: select(func.count(BusinessCard.id))
+                .where(BusinessCard.user_id == User.id),
+            User.referrals_count: select(func.count(Referral.id))
+                .where(Referral.referrer_id == User.id),
+            User.spent_stars: select(func.coalesce(func.sum(Payment.amount), 0))
+                .where(Payment.user_id == User.id, Payment.status == 'success'),
+        }
+        
+        columns = []
+        for counter, query in actual.items():
+            columns += [func.coalesce(counter, 0), query.correlate(User).scalar_subquery()]
+        
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            with session_scope() as session:
+                rows = session.query(User.id, *columns)\
+                    .filter(User.id > last_id)\
+                    .order_by(User.id)\
+                    .limit(batch_size)\
+                    .all()
+                if not rows:
+                    break
+                
+                for user_id, *values in rows:
+                    drift = {
+                        counter: values[2 * i + 1] - values[2 * i]
+                        for i, counter in enumerate(actual)
+                        if values[2 * i + 1] != values[2 * i]
+                    }
+                    if drift:
+                        session.query(User).filter_by(id=user_id).update(
+                            {counter: func.coalesce(counter, 0) + delta for counter, delta in drift.items()},
+                            synchronize_session=False
+                        )
+                        repaired += 1
+                        logger.warning(f"Статистика пользователя {user_id} расходилась: "
+                                       + ', '.join(f"{c.key} {d:+}" for c, d in drift.items()))
+                
+                checked += len(rows)
+                last_id = rows[-1][0]
+        
+        logger.info(f"Статистика пользователей сверена: {checked} проверено, {repaired} исправлено")
+        return repaired
+
+def stats_repair_job():
+    """Задача для планировщика"""
+    try:
+        StatsService.repair_user_stats()
+    except Exception as e:
+        logger.error(f"Ошибка сверки статистики пользователей: {e}")
+
+def stats_backfill_job():
+    """
+    Разовые пересчеты статистики после обновления
+    
+    Запускается в фоне после установки вебхука: пересчет по большой таблице
+    scans не задерживает старт бота. Ошибка шага только логируется - шаг
+    повторится при следующем запуске (см. признаки заполненности в init_*).
+    """
+    steps = (
+        StatsService.init_global_counters,
+        StatsService.init_card_daily_stats,
+        StatsService.init_scan_sketches,
+    )
+    for step in steps:
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"Ошибка разового пересчета статистики ({step.__name__}): {e}")
+
+def start_stats_backfill():
+    """Запуск разовых пересчетов статистики в отдельном потоке"""
+    thread = threading.Thread(target=stats_backfill_job, daemon=True)
+    thread.start()
+
+def start_stats_repair_scheduler():
+    """Запуск ежедневной сверки статистики пользователей"""
+    # Ночью, когда сканирований меньше всего
+    scheduler.every().day.at("04:00").do(stats_repair_job)
+    
+    def run_scheduler():
+        while True:
+            scheduler.run_pending()
+            time.sleep(60)
+    
+    thread = threading.Thread(target=run_scheduler, daemon=True)
+    thread.start()
+    
+    logger.info("Планировщик сверки статистики запущен")
 
 # Для совместимости с SQLite
 try:
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+"""
+Глобальные счетчики админки (таблица global_counters)
+
+Счетчик хранится по дням (UTC) и в ячейке ALL_TIME_DAY - за все время.
+Каждая ячейка разложена на COUNTER_SHARDS строк: пишущая транзакция
+увеличивает строку случайного шарда, поэтому параллельные сканирования
+не ждут блокировки одной строки. Значение счетчика - сумма шардов, и
+админка читает не больше 2 * COUNTER_SHARDS строк на счетчик по
+первичному ключу, сколько бы ни было сканирований.
+
+Модуль без зависимостей от БД: его используют и бот, и веб-сервис.
+"""
+
+import random
+
+from bot.utils.hyperloglog import ALL_TIME_DAY
+
+# Шардов на ячейку (день, счетчик). Читатели суммируют все строки ячейки,
+# поэтому число шардов можно менять без миграции
+COUNTER_SHARDS = 16
+
+# Счетчики
+USERS = 'users'                # зарегистрировано пользователей
+ACTIVE_USERS = 'active_users'  # активных за день (без ячейки "за все время")
+CARDS = 'cards'                # создано визиток
+SCANS = 'scans'                # сканирований
+REVENUE = 'revenue'            # выручка, звезды (по дню подтверждения платежа)
+
+def counter_shard():
+    """Шард для очередного увеличения счетчика"""
+    return random.randrange(COUNTER_SHARDS)
+
+def counter_days(day, all_time=True):
+    """Ячейки, которые увеличивает событие дня day"""
+    return [day, ALL_TIME_DAY] if all_time else [day]
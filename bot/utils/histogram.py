@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Гистограмма длительностей для /metrics
+
+Общая для веб-сервиса (время маршрутов и фаз) и бота (время запросов к
+БД и ожидания соединений из пула). Модуль без зависимостей.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Верхние границы корзин гистограмм, мс
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами"""
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, duration_ms):
+        index = bisect_left(BUCKETS_MS, duration_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum_ms += duration_ms
+            if duration_ms > self.max_ms:
+                self.max_ms = duration_ms
+    
+    def quantile(self, q, counts, count):
+        """Оценка квантиля - верхняя граница корзины, в которую он попадает (не больше максимума)"""
+        if not count:
+            return None
+        
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                if index < len(BUCKETS_MS):
+                    return min(BUCKETS_MS[index], round(self.max_ms, 3))
+                return round(self.max_ms, 3)
+        return round(self.max_ms, 3)
+    
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            count, sum_ms, max_ms = self.count, self.sum_ms, self.max_ms
+        
+        # Накопленные счетчики [граница, число наблюдений <= границы]
+        cumulative = 0
+        buckets = []
+        for bound, bucket_count in zip(BUCKETS_MS, counts):
+            cumulative += bucket_count
+            buckets.append([bound, cumulative])
+        buckets.append(['+Inf', count])
+        
+        return {
+            'count': count,
+            'sum_ms': round(sum_ms, 3),
+            'avg_ms': round(sum_ms / count, 3) if count else None,
+            'max_ms': round(max_ms, 3),
+            'p50_ms': self.quantile(0.5, counts, count),
+            'p95_ms': self.quantile(0.95, counts, count),
+            'p99_ms': self.quantile(0.99, counts, count),
+            'buckets': buckets
+        }
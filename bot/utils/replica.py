@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Чтение с реплики с защитой от отставания
+
+Аналитические запросы (статистика, админка, API веб-сервиса) можно
+направлять на реплику PostgreSQL, чтобы они не конкурировали с записью
+сканирований на основной БД. Отставание реплики проверяется не чаще раза
+в check_interval секунд; если оно больше max_lag или реплика недоступна,
+запросы идут на основную БД до следующей удачной проверки.
+
+Локальная проверка на двух экземплярах PostgreSQL:
+
+    pg_basebackup -h <основная> -D /tmp/replica -R -X stream
+    (port=5433 в /tmp/replica/postgresql.auto.conf), pg_ctl -D /tmp/replica start
+    DATABASE_REPLICA_URL=postgresql://...:5433/sylvia
+
+SELECT pg_wal_replay_pause() на реплике и запись на основной БД - через
+REPLICA_MAX_LAG секунд чтения переходят на основную БД, после
+pg_wal_replay_resume() - возвращаются на реплику.
+
+Модуль без зависимостей от драйвера: его используют и бот, и веб-сервис.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Отставание реплики, секунд. Сервер не в режиме восстановления (обычная
+# БД, например вторая локальная копия) и реплика, применившая весь
+# полученный WAL, отстают на 0; иначе - возраст последней примененной транзакции
+REPLICATION_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+class LagGuard:
+    """
+    Решение, читать ли с реплики
+    
+    Проверку выполняет вызывающий код (синхронно - check(measure),
+    асинхронно - due() / record() / fail() и use()), а здесь хранится ее
+    результат и счетчики для /metrics.
+    """
+    
+    def __init__(self, max_lag, check_interval=1.0):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self.healthy = False
+        self.checked_at = None
+        self.routed = 0
+        self.fallbacks = 0
+        self.failures = 0
+    
+    def due(self):
+        """Пора ли измерить отставание заново"""
+        return self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval
+    
+    def record(self, lag):
+        """Результат измерения, секунд"""
+        healthy = lag <= self.max_lag
+        if healthy != self.healthy:
+            if healthy:
+                logger.info(f"Реплика доступна, отставание {lag:.1f} с")
+            else:
+                logger.warning(f"Реплика отстает на {lag:.1f} с (допустимо {self.max_lag} с), чтение с основной БД")
+        self.lag = lag
+        self.healthy = healthy
+        self.checked_at = time.monotonic()
+    
+    def fail(self, error):
+        """Реплика недоступна: читать с основной БД до следующей проверки"""
+        if self.healthy or self.checked_at is None:
+            logger.warning(f"Реплика недоступна, чтение с основной БД: {error}")
+        self.failures += 1
+        self.lag = None
+        self.healthy = False
+        self.checked_at = time.monotonic()
+    
+    def use(self):
+        """Читать ли с реплики (по последней проверке)"""
+        if self.healthy:
+            self.routed += 1
+        else:
+            self.fallbacks += 1
+        return self.healthy
+    
+    def check(self, measure):
+        """Проверить (если пора) функцией measure() -> отставание и решить"""
+        if self.due():
+            try:
+                self.record(measure())
+            except Exception as e:
+                self.fail(e)
+        return self.use()
+    
+    def stats(self):
+        return {
+            'healthy': self.healthy,
+            'lag_s': None if self.lag is None else round(self.lag, 3),
+            'max_lag_s': self.max_lag,
+            'routed': self.routed,
+            'fallbacks': self.fallbacks,
+            'failures': self.failures
+        }
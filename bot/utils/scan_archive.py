@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+Архивные файлы сканирований (Parquet)
+
+Месяцы старше SCANS_RETENTION_MONTHS переносятся из таблицы scans в
+файлы scans_ГГГГ_ММ.parquet (bot.services.archive). Формат колоночный,
+со сжатием zstd. Строки отсортированы по (card_id, scanned_at), поэтому
+фильтр по визитке читает только нужные группы строк. Архив читается без
+БД и без настроек бота:
+
+    python -m bot.utils.scan_archive archive/scans --card 42 --from 2024-01-01 --to 2024-03-01
+    python -m bot.utils.scan_archive archive/scans --count
+
+или любым инструментом, который понимает Parquet (pandas, DuckDB:
+SELECT ... FROM 'archive/scans/*.parquet').
+
+Нужен необязательный пакет pyarrow. Без него архивирование не
+выполняется, и сканирования остаются в scans.
+"""
+
+import os
+import re
+import sys
+import argparse
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Колонки архива (порядок значений в строках, которые принимает write_archive)
+COLUMNS = ('id', 'card_id', 'scanned_at', 'ip_address', 'user_agent', 'referer', 'region')
+COMPRESSION = 'zstd'
+FILE_NAME = re.compile(r'^scans_(\d{4})_(\d{2})\.parquet$')
+
+def archive_available():
+    return pa is not None
+
+def archive_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('card_id', pa.int64()),
+        ('scanned_at', pa.timestamp('us')),
+        ('ip_address', pa.string()),
+        ('user_agent', pa.string()),
+        ('referer', pa.string()),
+        ('region', pa.string())
+    ])
+
+def archive_file_name(month):
+    return f"scans_{month:%Y_%m}.parquet"
+
+def write_archive(path, batches):
+    """
+    Запись архива из пачек строк (кортежи значений в порядке COLUMNS)
+    
+    Файл пишется под временным именем, сбрасывается на диск и только
+    потом переименовывается, поэтому неполный архив не появляется под
+    итоговым именем. Пустой архив не создается.
+    
+    Returns:
+        Количество записанных строк
+    """
+    if pa is None:
+        raise RuntimeError("Для архива сканирований нужен пакет pyarrow")
+    
+    schema = archive_schema()
+    temporary = f"{path}.tmp"
+    rows = 0
+    with pq.ParquetWriter(temporary, schema, compression=COMPRESSION) as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            rows += len(batch)
+    
+    if not rows:
+        os.remove(temporary)
+        return 0
+    
+    written = pq.ParquetFile(temporary).metadata.num_rows
+    if written != rows:
+        raise OSError(f"В архиве {temporary} {written} строк вместо {rows}")
+    
+    with open(temporary, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return rows
+
+def archive_files(directory, start=None, end=None):
+    """Файлы архива, месяцы которых пересекаются с [start, end)"""
+    if not os.path.isdir(directory):
+        return []
+    
+    files = []
+    for name in sorted(os.listdir(directory)):
+        match = FILE_NAME.match(name)
+        if not match:
+            continue
+        year, month = int(match[1]), int(match[2])
+        first = datetime(year, month, 1)
+        following = datetime(year + month // 12, month % 12 + 1, 1)
+        if (start is not None and following <= start) or (end is not None and first >= end):
+            continue
+        files.append(os.path.join(directory, name))
+    return files
+
+def read_archive(directory, card_id=None, start=None, end=None, columns=None):
+    """
+    Сканирования из архива
+    
+    Args:
+        directory: каталог архива (SCANS_ARCHIVE_DIR)
+        card_id: только визитка card_id
+        start, end: диапазон scanned_at [start, end), datetime (UTC)
+        columns: колонки результата (по умолчанию все COLUMNS)
+    
+    Returns:
+        pyarrow.Table
+    """
+    if pa is None:
+        raise RuntimeError("Для чтения архива сканирований нужен пакет pyarrow")
+    
+    files = archive_files(directory, start, end)
+    if not files:
+        return archive_schema().empty_table().select(list(columns or COLUMNS))
+    
+    condition = None
+    conditions = []
+    if card_id is not None:
+        conditions.append(ds.field('card_id') == card_id)
+    if start is not None:
+        conditions.append(ds.field('scanned_at') >= pa.scalar(start, pa.timestamp('us')))
+    if end is not None:
+        conditions.append(ds.field('scanned_at') < pa.scalar(end, pa.timestamp('us')))
+    for part in conditions:
+        condition = part if condition is None else condition & part
+    
+    dataset = ds.dataset(files, schema=archive_schema(), format='parquet')
+    return dataset.to_table(columns=list(columns or COLUMNS), filter=condition)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Чтение архива сканирований (CSV в stdout)")
+    parser.add_argument('directory', help="каталог архива (SCANS_ARCHIVE_DIR)")
+    parser.add_argument('--card', type=int, help="ID визитки")
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat, help="с даты (UTC), включительно")
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, help="по дату (UTC), не включая")
+    parser.add_argument('--columns', help="колонки через запятую")
+    parser.add_argument('--count', action='store_true', help="только количество сканирований")
+    args = parser.parse_args(argv)
+    
+    if pa is None:
+        parser.error("нужен пакет pyarrow")
+    
+    columns = args.columns.split(',') if args.columns else None
+    table = read_archive(args.directory, args.card, args.start, args.end, columns)
+    if args.count:
+        print(table.num_rows)
+    else:
+        pa_csv.write_csv(table, sys.stdout.buffer)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+Подписанные ссылки веб-сервиса
+
+Бот выдает продавцу ссылку с подписью, веб-сервис ее проверяет. Подпись -
+HMAC-SHA256 с ключом SECRET_KEY (общая переменная окружения бота и
+веб-сервиса), поэтому чужую ссылку не получить перебором user_id. Без
+SECRET_KEY подписанные ссылки выключены: проверка всегда неуспешна.
+
+Модуль без зависимостей от БД: его используют и бот, и веб-сервис.
+"""
+
+import os
+import hmac
+import hashlib
+
+SECRET_KEY = os.getenv('SECRET_KEY')
+
+# Назначения подписей: подпись одной ссылки не подходит к другой
+EXPORT = 'export'
+
+def signing_enabled():
+    return bool(SECRET_KEY)
+
+def sign(purpose, value):
+    """Подпись значения value для назначения purpose"""
+    if not SECRET_KEY:
+        raise RuntimeError("SECRET_KEY не задан: подписанные ссылки выключены")
+    message = f"{purpose}:{value}".encode('utf-8')
+    return hmac.new(SECRET_KEY.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+def verify(purpose, value, signature):
+    """Проверка подписи (сравнение за постоянное время)"""
+    if not SECRET_KEY or not signature:
+        return False
+    return hmac.compare_digest(signature, sign(purpose, value))
+
+def export_url(base_url, user_id):
+    """Ссылка на CSV-выгрузку сканирований продавца (web.app.export_user_scans)"""
+    return f"{base_url}/api/export/{user_id}/scans.csv?sig={sign(EXPORT, user_id)}"
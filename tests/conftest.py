@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+"""
+Общие настройки тестов
+
+Тесты не требуют PostgreSQL: запросы проверяются на временной SQLite базе.
+Переменные окружения задаются до импорта bot.config, который читает их
+при импорте.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix='sylvia-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'sylvia.db')}"
+os.environ.pop('DATABASE_REPLICA_URL', None)
+os.environ.setdefault('BOT_TOKEN', 'test-token')
+
+@pytest.fixture(scope='session')
+def db():
+    """Временная SQLite база с таблицами"""
+    from bot.database.db import init_db
+    init_db()
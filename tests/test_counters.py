@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+
+from bot.utils.counters import COUNTER_SHARDS, counter_shard, counter_days
+from bot.utils.hyperloglog import ALL_TIME_DAY
+
+def test_counter_shard_range():
+    shards = {counter_shard() for _ in range(1000)}
+    assert shards <= set(range(COUNTER_SHARDS))
+    assert len(shards) > 1
+
+def test_counter_days():
+    day = date(2024, 5, 17)
+    assert counter_days(day) == [day, ALL_TIME_DAY]
+    assert counter_days(day, all_time=False) == [day]
+
+def test_admin_stats_count_new_and_active_users(db):
+    from bot.database.queries import get_or_create_user, get_admin_stats
+    
+    before = get_admin_stats()['users']
+    get_or_create_user(3001, 'counter_a')
+    get_or_create_user(3002, 'counter_b')
+    # Повторное обращение в тот же день - не новый и не еще один активный
+    get_or_create_user(3001, 'counter_a')
+    after = get_admin_stats()['users']
+    
+    assert after['total'] - before['total'] == 2
+    assert after['active_today'] - before['active_today'] == 2
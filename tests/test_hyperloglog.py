@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from bot.utils.hyperloglog import (
+    HLL_PRECISION, HLL_REGISTERS, HASH_BITS,
+    visitor_hash, register_update, empty_sketch, add, merge, estimate
+)
+
+def sketch_of(values):
+    registers = bytearray(HLL_REGISTERS)
+    for value in values:
+        index, rank = register_update(visitor_hash(f"10.0.{value // 256}.{value % 256}", 'ua'))
+        registers[index] = max(registers[index], rank)
+    return bytes(registers)
+
+def test_visitor_hash_is_stable_64_bit():
+    assert visitor_hash('1.2.3.4', 'ua') == visitor_hash('1.2.3.4', 'ua')
+    assert visitor_hash('1.2.3.4', 'ua') != visitor_hash('1.2.3.4', 'other')
+    assert visitor_hash(None, None) == visitor_hash('', '')
+    assert 0 <= visitor_hash('1.2.3.4', 'ua') < 1 << HASH_BITS
+
+def test_register_update():
+    rest_bits = HASH_BITS - HLL_PRECISION
+    # Индекс - старшие биты, ранг - позиция первой единицы в остатке
+    assert register_update((5 << rest_bits) | (1 << (rest_bits - 1))) == (5, 1)
+    assert register_update((5 << rest_bits) | 1) == (5, rest_bits)
+    assert register_update((HLL_REGISTERS - 1) << rest_bits) == (HLL_REGISTERS - 1, rest_bits + 1)
+
+def test_add_keeps_maximum():
+    rest_bits = HASH_BITS - HLL_PRECISION
+    sketch = add(empty_sketch(), (3 << rest_bits) | 1)
+    assert sketch[3] == rest_bits
+    
+    # Меньший ранг регистр не уменьшает, а скетч не копируется
+    assert add(sketch, (3 << rest_bits) | (1 << (rest_bits - 1))) is sketch
+    assert add(sketch, (3 << rest_bits) | 1) is sketch
+
+def test_merge_is_registerwise_maximum():
+    a = sketch_of(range(0, 3000))
+    b = sketch_of(range(2000, 6000))
+    merged = merge([a, None, b])
+    
+    assert merged == bytes(max(x, y) for x, y in zip(a, b))
+    assert merged == sketch_of(range(0, 6000))
+    assert merge([]) == empty_sketch()
+    assert merge([a]) == a
+
+def test_estimate_empty():
+    assert estimate(None) == 0
+    assert estimate(empty_sketch()) == 0
+
+def test_estimate_small_counts_are_exact_enough():
+    sketch = empty_sketch()
+    for value in range(10):
+        sketch = add(sketch, visitor_hash(f"10.0.0.{value}", 'ua'))
+    assert estimate(sketch) == 10
+
+def test_estimate_error():
+    # Погрешность при p=10 - около 3%, с запасом 10%
+    for count in (500, 5000, 50000):
+        assert abs(estimate(sketch_of(range(count))) - count) <= count * 0.1
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from web.live import LIVE_BUFFER_SIZE, LiveHub, format_sse, format_events
+
+def event(card_id, scans):
+    return {'card_id': card_id, 'scans': scans}
+
+def test_publish_and_drain():
+    hub = LiveHub(max_subscribers=10)
+    wakeups = []
+    subscriber = hub.subscribe(1, lambda: wakeups.append(1))
+    other = hub.subscribe(2, lambda: None)
+    
+    hub.publish(1, event(7, 1))
+    hub.publish(1, event(7, 2))
+    
+    assert len(wakeups) == 2
+    assert hub.drain(subscriber) == ([event(7, 1), event(7, 2)], 0)
+    assert hub.drain(subscriber) == ([], 0)
+    assert hub.drain(other) == ([], 0)
+
+def test_publish_without_subscribers():
+    hub = LiveHub(max_subscribers=10)
+    hub.publish(1, event(7, 1))
+    assert hub.stats()['published'] == 0
+
+def test_overflow_drops_oldest():
+    hub = LiveHub(max_subscribers=10)
+    subscriber = hub.subscribe(1, lambda: None)
+    
+    for scans in range(1, LIVE_BUFFER_SIZE + 6):
+        hub.publish(1, event(7, scans))
+    
+    events, dropped = hub.drain(subscriber)
+    assert dropped == 5
+    assert len(events) == LIVE_BUFFER_SIZE
+    assert events[0] == event(7, 6)
+    assert hub.stats()['dropped'] == 5
+    
+    # Счетчик выброшенных сбрасывается при чтении
+    assert hub.drain(subscriber) == ([], 0)
+
+def test_subscriber_limit():
+    hub = LiveHub(max_subscribers=2)
+    first = hub.subscribe(1, lambda: None)
+    assert hub.subscribe(1, lambda: None) is not None
+    assert hub.subscribe(2, lambda: None) is None
+    
+    hub.unsubscribe(first)
+    hub.unsubscribe(first)
+    assert hub.stats()['subscribers'] == 1
+    assert hub.subscribe(2, lambda: None) is not None
+    assert hub.stats()['sellers'] == 2
+
+def test_format_events():
+    assert format_sse('scan', {'a': 'б'}, '1:2') == 'id: 1:2\nevent: scan\ndata: {"a":"б"}\n\n'
+    assert format_events([event(7, 3)], 2) == (
+        'event: dropped\ndata: {"count":2}\n\n'
+        'id: 7:3\nevent: scan\ndata: {"card_id":7,"scans":3}\n\n'
+    )
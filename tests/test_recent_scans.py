@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from web.app import RecentScansBuffer
+
+def scan(n):
+    return {'scanned_at': f"t{n}", 'ip_address': f"ip{n}"}
+
+def test_record_and_get():
+    buffer = RecentScansBuffer(maxcards=10, size=3)
+    for seq in range(1, 3):
+        buffer.record(1, seq, f"t{seq}", f"ip{seq}")
+    
+    # Все сканирования визитки в буфере
+    assert buffer.get(1, 2) == [scan(2), scan(1)]
+    assert buffer.get(1, 2, limit=1) == [scan(2)]
+    
+    # Полный буфер хранит последние size событий
+    for seq in range(3, 6):
+        buffer.record(1, seq, f"t{seq}", f"ip{seq}")
+    assert buffer.get(1, 5) == [scan(5), scan(4), scan(3)]
+
+def test_stale_or_incomplete_buffer_misses():
+    buffer = RecentScansBuffer(maxcards=10, size=3)
+    buffer.record(1, 1, 't1', 'ip1')
+    
+    # Сканирование через другой процесс сдвинуло scan_count
+    assert buffer.get(1, 2) is None
+    # Пропуск в нумерации: буфер начат заново и не содержит всех сканирований
+    buffer.record(1, 5, 't5', 'ip5')
+    assert buffer.get(1, 5) is None
+    assert buffer.get(2, 1) is None
+    assert buffer.stats()['misses'] == 3
+
+def test_fill():
+    buffer = RecentScansBuffer(maxcards=10, size=3)
+    buffer.fill(1, 4, [scan(4), scan(3), scan(2)])
+    assert buffer.get(1, 4) == [scan(4), scan(3), scan(2)]
+    
+    buffer.record(1, 5, 't5', 'ip5')
+    # Снимок из БД старше буфера - не заменяет его
+    buffer.fill(1, 4, [scan(4), scan(3), scan(2)])
+    assert buffer.get(1, 5) == [scan(5), scan(4), scan(3)]
+
+def test_lru_eviction():
+    buffer = RecentScansBuffer(maxcards=2, size=3)
+    buffer.record(1, 1, 't1', 'ip1')
+    buffer.record(2, 1, 't1', 'ip1')
+    assert buffer.get(1, 1) == [scan(1)]
+    
+    buffer.record(3, 1, 't1', 'ip1')
+    assert buffer.get(2, 1) is None
+    assert buffer.get(1, 1) == [scan(1)]
+    assert buffer.stats()['cards'] == 2
+
+def test_disabled():
+    buffer = RecentScansBuffer(maxcards=0)
+    buffer.record(1, 1, 't1', 'ip1')
+    buffer.fill(1, 1, [scan(1)])
+    assert buffer.get(1, 1) is None
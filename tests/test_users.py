@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""get_or_create_user и реферальная программа на SQLite"""
+
+import pytest
+
+from bot.database.db import session_scope
+from bot.database.models import User
+
+@pytest.fixture
+def queries(db):
+    from bot.database import queries
+    return queries
+
+def balance(telegram_id):
+    with session_scope() as session:
+        return session.query(User.referral_balance).filter_by(telegram_id=telegram_id).scalar()
+
+def test_get_or_create_user(queries):
+    user, created = queries.get_or_create_user(1001, 'seller', 'Имя')
+    assert created
+    assert (user.telegram_id, user.username, user.first_name) == (1001, 'seller', 'Имя')
+    
+    again, created = queries.get_or_create_user(1001, 'renamed', '')
+    assert not created
+    assert again.id == user.id
+    assert again.referral_code == user.referral_code
+    # Пустое имя не затирает сохраненное
+    assert (again.username, again.first_name) == ('renamed', 'Имя')
+    assert again.last_activity >= user.last_activity
+
+def test_process_referral(queries):
+    referrer, _ = queries.get_or_create_user(1101)
+    queries.get_or_create_user(1102)
+    
+    assert queries.process_referral(referrer.referral_code, 1102)
+    # Повторный переход бонус не начисляет
+    assert not queries.process_referral(referrer.referral_code, 1102)
+    assert balance(1101) == 1
+    
+    with session_scope() as session:
+        referee = session.query(User).filter_by(telegram_id=1102).one()
+        assert referee.referred_by_id == referrer.id
+        assert session.query(User.referrals_count).filter_by(telegram_id=1101).scalar() == 1
+
+def test_process_referral_rejects_unknown(queries):
+    referrer, _ = queries.get_or_create_user(1201)
+    queries.get_or_create_user(1202)
+    
+    assert not queries.process_referral('nosuch', 1202)
+    assert not queries.process_referral(referrer.referral_code, 1299)
+    assert balance(1201) == 0
+
+def test_use_referral_balance(queries):
+    referrer, _ = queries.get_or_create_user(1301)
+    for telegram_id in (1302, 1303):
+        queries.get_or_create_user(telegram_id)
+        queries.process_referral(referrer.referral_code, telegram_id)
+    assert balance(1301) == 2
+    
+    assert not queries.use_referral_balance(1301, 3)
+    assert queries.use_referral_balance(1301, 2)
+    # Баланс не уходит в минус
+    assert not queries.use_referral_balance(1301)
+    assert balance(1301) == 0
+    assert not queries.use_referral_balance(1399)
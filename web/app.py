@@ -5,15 +5,38 @@
 Flask приложение для обработки переходов по QR-кодам
 """
 
-from flask import Flask, request, redirect, jsonify, render_template_string, abort
+from flask import Flask, request, redirect, jsonify, render_template_string, abort, stream_with_context, g, has_request_context
 import os
+import io
+import csv
+import gzip
+import json
+import zlib
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import threading
+from contextlib import nullcontext
+from collections import OrderedDict, deque
 import psycopg2
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from urllib.parse import urlparse
 import hashlib
 import hmac
+import sys
+
+# Корень проекта в sys.path (при запуске как python web/app.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web.geoip import region_for, lookup_prefix
+from web.metrics import RequestTimer, registry
+from web.live import LiveHub, format_events, HEARTBEAT
+from bot.utils.hyperloglog import (
+    HLL_REGISTERS, ALL_TIME_DAY, visitor_hash, register_update, merge, estimate
+)
+from bot.utils.counters import SCANS, counter_shard
+from bot.utils.signing import EXPORT, verify
+from bot.utils.replica import REPLICATION_LAG_SQL, LagGuard
 
 # Настройка логирования
 logging.basicConfig(
@@ -34,15 +57,336 @@ if not DATABASE_URL:
 SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SECRET_KEY'] = SECRET_KEY
 
+# Страница для неизвестного токена
+CARD_NOT_FOUND_PAGE = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Ссылка не найдена</title>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <style>
+            body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
+            h1 { color: #ff4444; }
+            p { color: #666; }
+        </style>
+    </head>
+    <body>
+        <h1>🔍 Ссылка не найдена</h1>
+        <p>Возможно, визитка была удалена или ссылка устарела.</p>
+    </body>
+    </html>
+"""
+
+# Промежуточная страница перед редиректом в магазин
+REDIRECT_PAGE = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Переход...</title>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <meta http-equiv="refresh" content="2;url={{ target_url }}">
+        <style>
+            body { 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; 
+                text-align: center; 
+                padding: 50px 20px;
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+                min-height: 100vh;
+                margin: 0;
+                display: flex;
+                flex-direction: column;
+                justify-content: center;
+                align-items: center;
+            }
+            .card {
+                background: rgba(255,255,255,0.1);
+                backdrop-filter: blur(10px);
+                border-radius: 20px;
+                padding: 40px;
+                max-width: 500px;
+                box-shadow: 0 20px 60px rgba(0,0,0,0.3);
+            }
+            h1 { margin-bottom: 20px; font-size: 2em; }
+            p { opacity: 0.9; line-height: 1.6; }
+            .shop-name { 
+                font-size: 1.5em; 
+                font-weight: bold; 
+                margin: 20px 0;
+                color: #ffd700;
+            }
+            .loader {
+                border: 3px solid rgba(255,255,255,0.3);
+                border-top: 3px solid white;
+                border-radius: 50%;
+                width: 40px;
+                height: 40px;
+                animation: spin 1s linear infinite;
+                margin: 30px auto;
+            }
+            @keyframes spin {
+                0% { transform: rotate(0deg); }
+                100% { transform: rotate(360deg); }
+            }
+            .footer {
+                margin-top: 30px;
+                font-size: 0.9em;
+                opacity: 0.7;
+            }
+        </style>
+    </head>
+    <body>
+        <div class="card">
+            <h1>✨ Спасибо за покупку!</h1>
+            <div class="shop-name">{{ shop_name }}</div>
+            <p>Сейчас вы будете перенаправлены в магазин</p>
+            <div class="loader"></div>
+            <p>Если переход не происходит автоматически, 
+            <a href="{{ target_url }}" style="color: white; font-weight: bold;">нажмите здесь</a></p>
+            <div class="footer">
+                Спасибо, что выбрали нас! ❤️
+            </div>
+        </div>
+    </body>
+    </html>
+"""
+
+# Страница подборки товаров (из снимков, сохраненных ботом при создании визитки)
+COLLECTION_PAGE = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Подборка товаров</title>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <style>
+            body { 
+                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; 
+                padding: 30px 15px;
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+                min-height: 100vh;
+                margin: 0;
+            }
+            h1 { text-align: center; margin-bottom: 10px; }
+            .shop-name { text-align: center; font-weight: bold; color: #ffd700; margin-bottom: 30px; }
+            .grid {
+                display: grid;
+                grid-template-columns: repeat(auto-fill, minmax(160px, 1fr));
+                gap: 15px;
+                max-width: 900px;
+                margin: 0 auto;
+            }
+            .product {
+                background: white;
+                color: #333;
+                border-radius: 15px;
+                overflow: hidden;
+                text-decoration: none;
+                box-shadow: 0 10px 30px rgba(0,0,0,0.2);
+            }
+            .product img { width: 100%; aspect-ratio: 3 / 4; object-fit: cover; background: #eee; }
+            .info { padding: 10px; }
+            .price { font-weight: bold; font-size: 1.1em; }
+            .name { font-size: 0.9em; opacity: 0.8; margin-top: 5px; }
+        </style>
+    </head>
+    <body>
+        <h1>🛍 Вам также может пригодиться</h1>
+        <div class="shop-name">{{ shop_name }}</div>
+        <div class="grid">
+            {% for product in products %}
+            <a class="product" href="{{ product.url }}">
+                {% if product.image %}<img src="{{ product.image }}" alt="" loading="lazy">{% endif %}
+                <div class="info">
+                    <div class="price">{{ '%.0f' | format(product.price) }} ₽</div>
+                    <div class="name">{{ product.name }}</div>
+                </div>
+            </a>
+            {% endfor %}
+        </div>
+    </body>
+    </html>
+"""
+
+# Страница 404 для неизвестных адресов
+NOT_FOUND_PAGE = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Страница не найдена</title>
+        <meta charset="utf-8">
+        <style>
+            body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
+            h1 { color: #666; }
+        </style>
+    </head>
+    <body>
+        <h1>404 - Страница не найдена</h1>
+        <p>Запрашиваемая страница не существует.</p>
+    </body>
+    </html>
+"""
+
+# Пул соединений: 0 - новое соединение на каждый запрос
+DB_POOL_SIZE = int(os.getenv('WEB_DB_POOL_SIZE', 0))
+DB_POOL_TIMEOUT = float(os.getenv('WEB_DB_POOL_TIMEOUT', 5))
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """Пул psycopg2, который ждет свободное соединение вместо PoolError"""
+    
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.waiting = 0
+        self.timeouts = 0
+    
+    def getconn(self, key=None, timeout=None):
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        
+        if not acquired:
+            with self._lock:
+                self.timeouts += 1
+            raise PoolError(f"Нет свободных соединений за {timeout} с")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def stats(self):
+        """Состояние пула для /metrics"""
+        with self._lock:
+            return {
+                'max': self.maxconn,
+                'in_use': len(self._used),
+                'idle': len(self._pool),
+                'waiting': self.waiting,
+                'timeouts': self.timeouts
+            }
+    
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+db_pool = None
+if DB_POOL_SIZE > 0:
+    db_pool = BlockingConnectionPool(1, DB_POOL_SIZE, DATABASE_URL)
+
+# Реплика для API чтения (пусто - основная БД) и допустимое отставание, секунд
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL', '')
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 1))
+
+class ReplicaConnection(psycopg2.extensions.connection):
+    """Соединение с репликой: release_db_connection вернет его в read_pool"""
+
+read_pool = None
+if DATABASE_REPLICA_URL and DB_POOL_SIZE > 0:
+    read_pool = BlockingConnectionPool(1, DB_POOL_SIZE, DATABASE_REPLICA_URL, connection_factory=ReplicaConnection)
+
+replica_guard = LagGuard(REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL)
+
+def timed(phase):
+    """Замер фазы текущего запроса (Server-Timing и гистограммы /metrics)"""
+    if has_request_context() and 'request_timer' in g:
+        return g.request_timer.phase(phase)
+    return nullcontext()
+
 def get_db_connection():
     """Получение соединения с базой данных"""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        with timed('connect'):
+            if db_pool:
+                return db_pool.getconn(timeout=DB_POOL_TIMEOUT)
+            conn = psycopg2.connect(DATABASE_URL)
+            return conn
     except Exception as e:
         logger.error(f"Ошибка подключения к БД: {e}")
         return None
 
+def replica_lag(conn):
+    """Отставание реплики, секунд"""
+    with conn.cursor() as cur:
+        cur.execute(REPLICATION_LAG_SQL)
+        return float(cur.fetchone()[0])
+
+def get_read_connection():
+    """
+    Соединение для API чтения (статистика, визитки, выгрузка)
+    
+    С репликой, если она настроена, доступна и отстает не больше
+    REPLICA_MAX_LAG; иначе - get_db_connection(). Пока последняя проверка
+    неудачна, к реплике не подключаемся до следующей (REPLICA_CHECK_INTERVAL).
+    """
+    if not DATABASE_REPLICA_URL:
+        return get_db_connection()
+    
+    if replica_guard.healthy or replica_guard.due():
+        conn = None
+        try:
+            with timed('connect'):
+                if read_pool:
+                    conn = read_pool.getconn(timeout=DB_POOL_TIMEOUT)
+                else:
+                    conn = psycopg2.connect(DATABASE_REPLICA_URL, connection_factory=ReplicaConnection)
+        except Exception as e:
+            replica_guard.fail(e)
+        
+        if conn is not None:
+            if replica_guard.check(lambda: replica_lag(conn)):
+                return conn
+            release_db_connection(conn)
+            return get_db_connection()
+    
+    replica_guard.use()
+    return get_db_connection()
+
+def release_db_connection(conn):
+    """Возврат соединения в пул (или закрытие, если пул выключен)"""
+    pool = read_pool if isinstance(conn, ReplicaConnection) else db_pool
+    if not pool:
+        conn.close()
+        return
+    
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            # Не оставляем открытых транзакций от читающих запросов
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    pool.putconn(conn, close=broken)
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = RequestTimer()
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Заголовок Server-Timing с фазами запроса и запись их в гистограммы
+    
+    Регистрируется раньше compress_response и поэтому выполняется после него:
+    сжатие входит в total. Для потоковых ответов total - время до начала
+    передачи тела.
+    """
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.headers['Server-Timing'] = timer.finish(route)
+    return response
+
 @app.route('/health')
 def health():
     """Эндпоинт для проверки здоровья сервиса"""
@@ -51,6 +395,112 @@ def health():
         'timestamp': datetime.now().isoformat()
     })
 
+# Поиск визитки по токену для редиректа
+CARD_LOOKUP_SQL = """
+    SELECT 
+        bc.id as card_id,
+        bc.user_id,
+        bc.qr_type,
+        bc.target_article,
+        bc.collection_id,
+        u.shop_url_wb,
+        u.shop_url_ozon,
+        u.shop_name
+    FROM business_cards bc
+    JOIN users u ON bc.user_id = u.id
+    WHERE bc.token = %(token)s
+"""
+
+# Запись сканирования: SCAN_COUNTER_SQL, затем SCAN_INGEST_SQL по порядку,
+# в одной транзакции. Время - в UTC, как и в ORM-моделях (datetime.utcnow)
+
+# Счетчик в визитке. Новое значение scan_count - порядковый номер
+# сканирования (для буфера последних сканирований), last_scan - его время
+SCAN_COUNTER_SQL = """
+    UPDATE business_cards 
+    SET scan_count = scan_count + 1, last_scan = NOW() AT TIME ZONE 'utc'
+    WHERE id = %(card_id)s
+    RETURNING scan_count, last_scan
+"""
+
+SCAN_INGEST_SQL = (
+    # Сырое событие
+    """
+    INSERT INTO scans (card_id, scanned_at, ip_address, user_agent, referer, region)
+    VALUES (%(card_id)s, NOW() AT TIME ZONE 'utc', %(ip_address)s, %(user_agent)s, %(referer)s, %(region)s)
+    """,
+    # Дневной счетчик (для /api/stats без обхода таблицы scans)
+    """
+    INSERT INTO card_daily_stats (card_id, day, scans)
+    VALUES (%(card_id)s, (NOW() AT TIME ZONE 'utc')::date, 1)
+    ON CONFLICT (card_id, day)
+    DO UPDATE SET scans = card_daily_stats.scans + 1
+    """,
+    # Счетчик по региону (только если регион определен)
+    """
+    INSERT INTO card_region_stats (card_id, day, region, scans)
+    SELECT %(card_id)s::int, (NOW() AT TIME ZONE 'utc')::date, %(region)s::varchar, 1
+    WHERE %(region)s::varchar IS NOT NULL
+    ON CONFLICT (card_id, day, region)
+    DO UPDATE SET scans = card_region_stats.scans + 1
+    """,
+    # HyperLogLog-скетчи уникальных посетителей визитки: за день и за все время.
+    # Меняется один регистр, строка переписывается только если он вырос.
+    # Скетч продавца не пишется - это объединение скетчей его визиток (USER_VISITORS_SQL)
+    f"""
+    INSERT INTO scan_sketches (scope, owner_id, day, registers)
+    SELECT sk.scope, sk.owner_id, sk.day,
+        set_byte(decode(repeat('00', {HLL_REGISTERS}), 'hex'), %(hll_index)s::int, %(hll_rank)s::int)
+    FROM (VALUES
+        ('card', %(card_id)s::int, (NOW() AT TIME ZONE 'utc')::date),
+        ('card', %(card_id)s::int, DATE '{ALL_TIME_DAY}')
+    ) AS sk (scope, owner_id, day)
+    ON CONFLICT (scope, owner_id, day)
+    DO UPDATE SET registers = set_byte(scan_sketches.registers, %(hll_index)s::int, %(hll_rank)s::int)
+    WHERE get_byte(scan_sketches.registers, %(hll_index)s::int) < %(hll_rank)s::int
+    """,
+    # Глобальный счетчик админки: за день и за все время, в случайном шарде
+    f"""
+    INSERT INTO global_counters (day, name, shard, value)
+    SELECT d.day, '{SCANS}', %(counter_shard)s::int, 1
+    FROM (VALUES ((NOW() AT TIME ZONE 'utc')::date), (DATE '{ALL_TIME_DAY}')) AS d (day)
+    ON CONFLICT (day, name, shard)
+    DO UPDATE SET value = global_counters.value + 1
+    """,
+)
+
+def live_event(card, token, scan_seq, scanned_at, params):
+    """Событие сканирования для живой ленты (/api/live)"""
+    return {
+        'card_id': card['card_id'],
+        'token': token,
+        'scans': scan_seq,
+        'time': scanned_at.isoformat(),
+        'region': params['region']
+    }
+
+def client_ip(forwarded_for, remote_addr):
+    """IP клиента с учетом прокси (первый адрес из X-Forwarded-For)"""
+    ip_address = forwarded_for or remote_addr
+    if ip_address and ',' in ip_address:
+        ip_address = ip_address.split(',')[0].strip()
+    return ip_address
+
+def scan_params(card, ip_address, user_agent, referer):
+    """Параметры запросов SCAN_INGEST_SQL"""
+    user_agent = (user_agent or '')[:500]
+    hll_index, hll_rank = register_update(visitor_hash(ip_address, user_agent))
+    return {
+        'card_id': card['card_id'],
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'referer': (referer or '')[:500],
+        'region': region_for(ip_address),
+        'hll_index': hll_index,
+        'hll_rank': hll_rank,
+        'counter_shard': counter_shard(),
+    }
+
 @app.route('/go/<token>')
 def track_and_redirect(token):
     """
@@ -61,70 +511,40 @@ def track_and_redirect(token):
     if not conn:
         return "Service unavailable", 503
     
+    cur = None
     try:
         cur = conn.cursor(cursor_factory=DictCursor)
         
         # Получаем информацию о визитке
-        cur.execute("""
-            SELECT 
-                bc.id as card_id,
-                bc.user_id,
-                bc.qr_type,
-                bc.target_article,
-                bc.collection_id,
-                u.shop_url_wb,
-                u.shop_url_ozon,
-                u.shop_name
-            FROM business_cards bc
-            JOIN users u ON bc.user_id = u.id
-            WHERE bc.token = %s
-        """, (token,))
-        
-        card = cur.fetchone()
+        with timed('lookup'):
+            cur.execute(CARD_LOOKUP_SQL, {'token': token})
+            card = cur.fetchone()
         
         if not card:
             logger.warning(f"Токен не найден: {token}")
-            return render_template_string("""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Ссылка не найдена</title>
-                    <meta charset="utf-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1">
-                    <style>
-                        body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
-                        h1 { color: #ff4444; }
-                        p { color: #666; }
-                    </style>
-                </head>
-                <body>
-                    <h1>🔍 Ссылка не найдена</h1>
-                    <p>Возможно, визитка была удалена или ссылка устарела.</p>
-                </body>
-                </html>
-            """), 404
+            return render_template_string(CARD_NOT_FOUND_PAGE), 404
         
         # Сохраняем информацию о сканировании
-        ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if ip_address and ',' in ip_address:
-            ip_address = ip_address.split(',')[0].strip()
-        
-        user_agent = request.headers.get('User-Agent', '')
-        referer = request.headers.get('Referer', '')
+        ip_address = client_ip(request.headers.get('X-Forwarded-For'), request.remote_addr)
+        params = scan_params(
+            card,
+            ip_address,
+            request.headers.get('User-Agent', ''),
+            request.headers.get('Referer', '')
+        )
         
-        cur.execute("""
-            INSERT INTO scans (card_id, ip_address, user_agent, referer)
-            VALUES (%s, %s, %s, %s)
-        """, (card['card_id'], ip_address, user_agent[:500], referer[:500]))
+        with timed('insert'):
+            cur.execute(SCAN_COUNTER_SQL, params)
+            scan_seq, scanned_at = cur.fetchone()
+            
+            for sql in SCAN_INGEST_SQL:
+                cur.execute(sql, params)
         
-        # Обновляем счетчик в визитке
-        cur.execute("""
-            UPDATE business_cards 
-            SET scan_count = scan_count + 1, last_scan = NOW()
-            WHERE id = %s
-        """, (card['card_id'],))
+        with timed('commit'):
+            conn.commit()
         
-        conn.commit()
+        recent_scans.record(card['card_id'], scan_seq, scanned_at, ip_address)
+        live_hub.publish(card['user_id'], live_event(card, token, scan_seq, scanned_at, params))
         
         logger.info(f"Переход по токену {token}: card_id={card['card_id']}, ip={ip_address}")
         
@@ -135,86 +555,20 @@ def track_and_redirect(token):
         target_url = add_utm_params(target_url, card)
         
         # Возвращаем страницу с редиректом (для красоты)
-        return render_template_string("""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Переход...</title>
-                <meta charset="utf-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <meta http-equiv="refresh" content="2;url={{ target_url }}">
-                <style>
-                    body { 
-                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; 
-                        text-align: center; 
-                        padding: 50px 20px;
-                        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                        color: white;
-                        min-height: 100vh;
-                        margin: 0;
-                        display: flex;
-                        flex-direction: column;
-                        justify-content: center;
-                        align-items: center;
-                    }
-                    .card {
-                        background: rgba(255,255,255,0.1);
-                        backdrop-filter: blur(10px);
-                        border-radius: 20px;
-                        padding: 40px;
-                        max-width: 500px;
-                        box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-                    }
-                    h1 { margin-bottom: 20px; font-size: 2em; }
-                    p { opacity: 0.9; line-height: 1.6; }
-                    .shop-name { 
-                        font-size: 1.5em; 
-                        font-weight: bold; 
-                        margin: 20px 0;
-                        color: #ffd700;
-                    }
-                    .loader {
-                        border: 3px solid rgba(255,255,255,0.3);
-                        border-top: 3px solid white;
-                        border-radius: 50%;
-                        width: 40px;
-                        height: 40px;
-                        animation: spin 1s linear infinite;
-                        margin: 30px auto;
-                    }
-                    @keyframes spin {
-                        0% { transform: rotate(0deg); }
-                        100% { transform: rotate(360deg); }
-                    }
-                    .footer {
-                        margin-top: 30px;
-                        font-size: 0.9em;
-                        opacity: 0.7;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="card">
-                    <h1>✨ Спасибо за покупку!</h1>
-                    <div class="shop-name">{{ shop_name }}</div>
-                    <p>Сейчас вы будете перенаправлены в магазин</p>
-                    <div class="loader"></div>
-                    <p>Если переход не происходит автоматически, 
-                    <a href="{{ target_url }}" style="color: white; font-weight: bold;">нажмите здесь</a></p>
-                    <div class="footer">
-                        Спасибо, что выбрали нас! ❤️
-                    </div>
-                </div>
-            </body>
-            </html>
-        """, target_url=target_url, shop_name=card['shop_name'] or 'Магазин')
-        
+        with timed('render'):
+            return render_template_string(
+                REDIRECT_PAGE,
+                target_url=target_url,
+                shop_name=card['shop_name'] or 'Магазин'
+            )
+    
     except Exception as e:
         logger.error(f"Ошибка при обработке токена {token}: {e}")
         return "Internal server error", 500
     finally:
-        cur.close()
-        conn.close()
+        if cur:
+            cur.close()
+        release_db_connection(conn)
 
 def determine_target_url(card):
     """Определение целевого URL в зависимости от типа QR"""
@@ -255,184 +609,958 @@ def add_utm_params(url, card):
     
     return f"{url}{separator}{utm_params}"
 
+COLLECTION_SQL = """
+    SELECT c.id, c.products, u.shop_name
+    FROM collections c
+    JOIN users u ON c.user_id = u.id
+    WHERE c.id = %(collection_id)s
+"""
+
+# Сколько отрисованных страниц подборок держать в памяти
+COLLECTION_CACHE_SIZE = int(os.getenv('WEB_COLLECTION_CACHE_SIZE', 1000))
+# Снимки товаров не меняются, поэтому браузер может кешировать страницу
+COLLECTION_MAX_AGE = 300
+# Подборки без снимка (визитки, созданные до появления таблицы collections)
+# ведут, как раньше, на главную маркетплейса
+COLLECTION_FALLBACK_URL = "https://www.wildberries.ru"
+
+class CollectionPageCache:
+    """
+    LRU-кеш отрисованных страниц подборок
+    
+    Подборка неизменна после создания, поэтому страница рендерится один раз
+    и дальше отдается из памяти без запросов к БД и маркетплейсу.
+    """
+    
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, collection_id):
+        with self._lock:
+            page = self._pages.get(collection_id)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._pages.move_to_end(collection_id)
+            return page
+    
+    def put(self, collection_id, page):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._pages[collection_id] = page
+            self._pages.move_to_end(collection_id)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+    
+    def stats(self):
+        return {'size': len(self._pages), 'max': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+collection_cache = CollectionPageCache(COLLECTION_CACHE_SIZE)
+
+def collection_context(row):
+    """Параметры шаблона COLLECTION_PAGE из строки COLLECTION_SQL"""
+    products = row['products']
+    if isinstance(products, str):
+        # asyncpg не декодирует json
+        products = json.loads(products)
+    
+    return {
+        'products': products,
+        'shop_name': row['shop_name'] or 'Магазин'
+    }
+
 @app.route('/collection/<collection_id>')
 def collection_page(collection_id):
     """Страница подборки товаров"""
-    # Здесь можно сделать красивую страницу с товарами из подборки
-    # Для простоты пока делаем редирект на поиск
-    return redirect("https://www.wildberries.ru")
+    page = collection_cache.get(collection_id)
+    
+    if page is None:
+        conn = get_db_connection()
+        if not conn:
+            return "Service unavailable", 503
+        
+        try:
+            with conn.cursor(cursor_factory=DictCursor) as cur, timed('lookup'):
+                cur.execute(COLLECTION_SQL, {'collection_id': collection_id})
+                row = cur.fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки подборки {collection_id}: {e}")
+            return "Internal server error", 500
+        finally:
+            release_db_connection(conn)
+        
+        if not row:
+            return redirect(COLLECTION_FALLBACK_URL)
+        
+        with timed('render'):
+            page = render_template_string(COLLECTION_PAGE, **collection_context(row))
+        collection_cache.put(collection_id, page)
+    
+    response = app.make_response(page)
+    response.headers['Cache-Control'] = f'public, max-age={COLLECTION_MAX_AGE}'
+    return response
+
+# Поля визитки, которые можно запросить через ?fields=
+CARD_FIELDS = {
+    'id': 'bc.id',
+    'token': 'bc.token',
+    'type': 'bc.qr_type',
+    'created': 'bc.created_at',
+    'scans': 'bc.scan_count',
+    'last_scan': 'bc.last_scan',
+}
+
+STATS_PAGE_SIZE = 10
+STATS_MAX_PAGE_SIZE = 100
+
+# Ответы меньше этого размера не сжимаем
+COMPRESS_MIN_SIZE = 500
+
+# Итоги по счетчикам визиток - они же служат версией данных для ETag
+USER_TOTALS_SQL = """
+    SELECT 
+        COUNT(*) as total_cards,
+        COALESCE(SUM(scan_count), 0) as total_scans,
+        MAX(last_scan) as last_scan,
+        MAX(created_at) as last_created
+    FROM business_cards
+    WHERE user_id = %(user_id)s
+"""
+
+# Статистика по дням из предрасчитанных счетчиков
+USER_DAILY_SQL = """
+    SELECT 
+        ds.day as date,
+        SUM(ds.scans) as count
+    FROM card_daily_stats ds
+    JOIN business_cards bc ON ds.card_id = bc.id
+    WHERE bc.user_id = %(user_id)s 
+        AND ds.day > (NOW() AT TIME ZONE 'utc')::date - %(days)s::int
+    GROUP BY ds.day
+    ORDER BY ds.day DESC
+"""
+
+# Скетчи посетителей визиток продавца: за все время и за тот же период,
+# что и USER_DAILY_SQL. Объединяются по дням в visitor_sketches
+USER_VISITORS_SQL = f"""
+    SELECT 
+        ss.day,
+        ss.registers
+    FROM scan_sketches ss
+    JOIN business_cards bc ON ss.owner_id = bc.id
+    WHERE ss.scope = 'card'
+        AND bc.user_id = %(user_id)s
+        AND (ss.day = DATE '{ALL_TIME_DAY}'
+             OR ss.day > (NOW() AT TIME ZONE 'utc')::date - %(days)s::int)
+"""
+
+# Регионы покупателей за тот же период, что и USER_DAILY_SQL
+USER_REGIONS_SQL = """
+    SELECT 
+        rs.region,
+        SUM(rs.scans) as count
+    FROM card_region_stats rs
+    JOIN business_cards bc ON rs.card_id = bc.id
+    WHERE bc.user_id = %(user_id)s 
+        AND rs.day > (NOW() AT TIME ZONE 'utc')::date - %(days)s::int
+    GROUP BY rs.region
+    ORDER BY count DESC, rs.region
+    LIMIT %(limit)s
+"""
+
+TOP_REGIONS_LIMIT = 10
+
+# Визитка с магазином для /api/card
+CARD_INFO_SQL = """
+    SELECT 
+        bc.id,
+        bc.token,
+        bc.qr_type,
+        bc.created_at,
+        bc.scan_count,
+        bc.last_scan,
+        u.shop_name
+    FROM business_cards bc
+    JOIN users u ON bc.user_id = u.id
+    WHERE bc.token = %(token)s
+"""
+
+# Последние сканирования визитки. card_scans - scan_count из того же
+# снимка БД, что и сами сканирования (для заполнения recent_scans)
+CARD_RECENT_SCANS_SQL = """
+    SELECT 
+        s.scanned_at,
+        s.ip_address,
+        s.user_agent,
+        bc.scan_count as card_scans
+    FROM scans s
+    JOIN business_cards bc ON s.card_id = bc.id
+    WHERE s.card_id = %(card_id)s
+    ORDER BY s.scanned_at DESC
+    LIMIT %(limit)s
+"""
+
+RECENT_SCANS_LIMIT = 20
+BATCH_MAX_CARDS = 500
+
+# Сколько визиток держать в буфере последних сканирований
+RECENT_SCANS_CARDS = int(os.getenv('WEB_RECENT_SCANS_CARDS', 10000))
+
+class RecentScansBuffer:
+    """
+    Кольцевые буферы последних сканирований активных визиток
+    
+    На визитку хранится не больше RECENT_SCANS_LIMIT событий, а число
+    визиток ограничено maxcards (холодные вытесняются по LRU), так что
+    память ограничена примерно maxcards * RECENT_SCANS_LIMIT событиями.
+    
+    Событие записывается с порядковым номером - значением scan_count после
+    сканирования. Буфер отдается, только если его последний номер совпадает
+    с текущим scan_count визитки и в нем нет пропусков: сканирования через
+    другие процессы сервиса сдвигают scan_count, и тогда чтение идет в БД.
+    """
+    
+    def __init__(self, maxcards, size=RECENT_SCANS_LIMIT):
+        self.maxcards = maxcards
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # card_id -> [последний номер, deque событий (старые слева)]
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _store(self, card_id, entry):
+        self._cards[card_id] = entry
+        self._cards.move_to_end(card_id)
+        while len(self._cards) > self.maxcards:
+            self._cards.popitem(last=False)
+    
+    def record(self, card_id, seq, scanned_at, ip_address):
+        """Новое сканирование визитки с номером seq"""
+        if self.maxcards <= 0:
+            return
+        
+        event = {'scanned_at': scanned_at, 'ip_address': ip_address}
+        with self._lock:
+            entry = self._cards.get(card_id)
+            if entry and entry[0] == seq - 1:
+                entry[0] = seq
+                entry[1].append(event)
+                self._cards.move_to_end(card_id)
+            else:
+                # Пропуск в нумерации - начинаем буфер заново
+                self._store(card_id, [seq, deque([event], maxlen=self.size)])
+    
+    def fill(self, card_id, scan_count, scans):
+        """Заполнение буфера из БД (scans - новые первыми, снимок с scan_count)"""
+        if self.maxcards <= 0:
+            return
+        
+        events = deque(
+            ({'scanned_at': s['scanned_at'], 'ip_address': s['ip_address']} for s in reversed(scans)),
+            maxlen=self.size
+        )
+        with self._lock:
+            entry = self._cards.get(card_id)
+            # Буфер уже новее снимка из БД
+            if entry and entry[0] >= scan_count:
+                return
+            self._store(card_id, [scan_count, events])
+    
+    def get(self, card_id, scan_count, limit=None):
+        """
+        Последние сканирования (новые первыми) или None, если буфер
+        отсутствует или отстает от scan_count
+        """
+        with self._lock:
+            entry = self._cards.get(card_id)
+            # Полон или содержит все сканирования визитки
+            if (not entry or entry[0] != scan_count
+                    or len(entry[1]) < self.size and len(entry[1]) != scan_count):
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self._cards.move_to_end(card_id)
+            scans = list(reversed(entry[1]))
+        
+        return scans[:limit] if limit is not None else scans
+    
+    def stats(self):
+        return {'cards': len(self._cards), 'max': self.maxcards, 'hits': self.hits, 'misses': self.misses}
+
+recent_scans = RecentScansBuffer(RECENT_SCANS_CARDS)
+
+def parse_card_fields(raw):
+    """Разбор параметра fields (список полей визитки через запятую)"""
+    if not raw:
+        return list(CARD_FIELDS)
+    
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in CARD_FIELDS]
+    if unknown or not fields:
+        return None
+    return fields
+
+def parse_stats_args(args):
+    """
+    Разбор параметров /api/stats
+    
+    Returns:
+        (days, limit, after, fields) или None, если fields некорректен
+    """
+    fields = parse_card_fields(args.get('fields'))
+    if fields is None:
+        return None
+    
+    days = args.get('days', 30, type=int)
+    limit = args.get('limit', STATS_PAGE_SIZE, type=int)
+    after = args.get('after', type=int)
+    
+    days = max(0, min(days, 365))
+    limit = max(1, min(limit, STATS_MAX_PAGE_SIZE))
+    return days, limit, after, fields
+
+def user_cards_page_sql(fields):
+    """Страница визиток (keyset по id, от новых к старым) только с нужными колонками"""
+    columns = ''.join(
+        f", {CARD_FIELDS[f]} as {f}" for f in fields if f != 'id'
+    )
+    return f"""
+        SELECT bc.id{columns}
+        FROM business_cards bc
+        WHERE bc.user_id = %(user_id)s
+            AND (%(after)s::int IS NULL OR bc.id < %(after)s::int)
+        ORDER BY bc.id DESC
+        LIMIT %(limit)s
+    """
+
+def serialize_card_field(name, value):
+    """Приведение значения поля визитки к JSON-совместимому виду"""
+    if name in ('created', 'last_scan'):
+        return value.isoformat() if value else None
+    return value
+
+def stats_validators(user_id, totals, days, limit, after, fields):
+    """
+    ETag и Last-Modified ответа /api/stats по итогам визиток и параметрам запроса
+    
+    Окно daily/regions отсчитывается от текущей даты (UTC), поэтому в полночь
+    ответ меняется и без новых сканирований: дата входит в ETag, а
+    Last-Modified не раньше начала текущих суток.
+    """
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    modified = [d.replace(tzinfo=timezone.utc) for d in (totals['last_scan'], totals['last_created']) if d]
+    last_modified = max(modified + [today])
+    
+    version = (
+        f"{user_id}:{totals['total_cards']}:{totals['total_scans']}:"
+        f"{totals['last_scan']}:{totals['last_created']}:"
+        f"{days}:{limit}:{after}:{','.join(fields)}:{today.date()}"
+    )
+    return hashlib.sha1(version.encode()).hexdigest(), last_modified
+
+def visitor_sketches(rows):
+    """Скетчи посетителей продавца по дням из строк USER_VISITORS_SQL"""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row['day'], []).append(row['registers'])
+    return {day: merge(sketches) for day, sketches in by_day.items()}
+
+def build_stats_payload(user_id, totals, daily_stats, cards, limit, fields, regions=(), visitors=None):
+    """
+    Тело ответа /api/stats (cards - выборка из limit + 1 строк,
+    visitors - результат visitor_sketches)
+    """
+    visitors = visitors or {}
+    next_cursor = None
+    if len(cards) > limit:
+        cards = cards[:limit]
+        next_cursor = cards[-1]['id']
+    
+    return {
+        'user_id': user_id,
+        'total': {
+            'cards': totals['total_cards'] or 0,
+            'scans': int(totals['total_scans'] or 0),
+            'unique': estimate(visitors.get(ALL_TIME_DAY))
+        },
+        'daily': [
+            {
+                'date': str(row['date']),
+                'count': int(row['count']),
+                'unique': estimate(visitors.get(row['date']))
+            }
+            for row in daily_stats
+        ],
+        'regions': [
+            {'region': row['region'], 'count': int(row['count'])}
+            for row in regions
+        ],
+        'recent_cards': [
+            {f: serialize_card_field(f, row[f]) for f in fields}
+            for row in cards
+        ],
+        'next_cursor': next_cursor
+    }
+
+def card_to_dict(card, scans):
+    """Представление визитки и ее последних сканирований для API"""
+    return {
+        'id': card['id'],
+        'token': card['token'],
+        'type': card['qr_type'],
+        'created': card['created_at'].isoformat(),
+        'scans': card['scan_count'],
+        'last_scan': card['last_scan'].isoformat() if card['last_scan'] else None,
+        'shop_name': card['shop_name'],
+        'recent_scans': [
+            {
+                'time': scan['scanned_at'].isoformat() if scan['scanned_at'] else None,
+                'ip': scan['ip_address']
+            }
+            for scan in scans
+        ]
+    }
+
+def should_compress(accept_encoding, data):
+    """Нужно ли сжимать тело ответа gzip"""
+    return 'gzip' in (accept_encoding or '').lower() and len(data) >= COMPRESS_MIN_SIZE
+
+def not_modified(etag, last_modified):
+    """Проверка условного запроса (If-None-Match / If-Modified-Since)"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    
+    return False
+
+def set_cache_headers(response, etag, last_modified):
+    """Заголовки для условных запросов: клиент всегда перепроверяет ответ"""
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Gzip-сжатие JSON-ответов, если клиент его поддерживает"""
+    if (response.is_streamed
+            or response.status_code != 200
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    data = response.get_data()
+    if not should_compress(request.headers.get('Accept-Encoding'), data):
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/api/stats/<int:user_id>')
 def api_user_stats(user_id):
-    """API для получения статистики пользователя"""
-    days = request.args.get('days', 30, type=int)
+    """
+    API для получения статистики пользователя
     
-    conn = get_db_connection()
+    Параметры запроса:
+        days: глубина дневной статистики и регионов (0 - не возвращать)
+        limit: размер страницы визиток
+        after: курсор (id визитки), с которого продолжить выдачу
+        fields: поля визиток через запятую (id, token, type, created, scans, last_scan)
+    
+    Итоги берутся из счетчиков business_cards, дни - из card_daily_stats,
+    уникальные посетители (unique) - из HyperLogLog-скетчей scan_sketches,
+    поэтому таблица scans не читается. Ответ снабжается ETag/Last-Modified,
+    и повторный запрос без изменений получает 304 после одного запроса к БД.
+    """
+    parsed = parse_stats_args(request.args)
+    if parsed is None:
+        return jsonify({
+            'error': f"Unknown field, allowed: {', '.join(CARD_FIELDS)}"
+        }), 400
+    
+    days, limit, after, fields = parsed
+    
+    conn = get_read_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 503
     
+    cur = None
     try:
         cur = conn.cursor(cursor_factory=DictCursor)
         
-        # Общая статистика
-        cur.execute("""
-            SELECT 
-                COUNT(DISTINCT bc.id) as total_cards,
-                COUNT(s.id) as total_scans,
-                COALESCE(SUM(bc.scan_count), 0) as total_scans_card,
-                MAX(bc.last_scan) as last_scan
-            FROM business_cards bc
-            LEFT JOIN scans s ON bc.id = s.card_id
-            WHERE bc.user_id = %s
-        """, (user_id,))
-        
-        total_stats = cur.fetchone()
+        with timed('lookup'):
+            cur.execute(USER_TOTALS_SQL, {'user_id': user_id})
+            totals = cur.fetchone()
         
-        # Статистика по дням
-        cur.execute("""
-            SELECT 
-                DATE(s.scanned_at) as date,
-                COUNT(*) as count
-            FROM scans s
-            JOIN business_cards bc ON s.card_id = bc.id
-            WHERE bc.user_id = %s 
-                AND s.scanned_at > NOW() - INTERVAL '%s days'
-            GROUP BY DATE(s.scanned_at)
-            ORDER BY date DESC
-        """, (user_id, days))
+        etag, last_modified = stats_validators(user_id, totals, days, limit, after, fields)
         
-        daily_stats = cur.fetchall()
+        if not_modified(etag, last_modified):
+            return set_cache_headers(app.response_class(status=304), etag, last_modified)
         
-        # Статистика по визиткам
-        cur.execute("""
-            SELECT 
-                bc.id,
-                bc.token,
-                bc.qr_type,
-                bc.created_at,
-                bc.scan_count,
-                bc.last_scan
-            FROM business_cards bc
-            WHERE bc.user_id = %s
-            ORDER BY bc.created_at DESC
-            LIMIT 10
-        """, (user_id,))
+        with timed('visitors'):
+            cur.execute(USER_VISITORS_SQL, {'user_id': user_id, 'days': days})
+            visitors = visitor_sketches(cur.fetchall())
         
-        cards = cur.fetchall()
+        daily_stats = []
+        regions = []
+        if days:
+            with timed('daily'):
+                cur.execute(USER_DAILY_SQL, {'user_id': user_id, 'days': days})
+                daily_stats = cur.fetchall()
+                
+                cur.execute(USER_REGIONS_SQL, {
+                    'user_id': user_id,
+                    'days': days,
+                    'limit': TOP_REGIONS_LIMIT
+                })
+                regions = cur.fetchall()
         
-        return jsonify({
-            'user_id': user_id,
-            'total': {
-                'cards': total_stats['total_cards'] or 0,
-                'scans': total_stats['total_scans'] or 0
-            },
-            'daily': [
-                {'date': str(row['date']), 'count': row['count']}
-                for row in daily_stats
-            ],
-            'recent_cards': [
-                {
-                    'id': row['id'],
-                    'token': row['token'],
-                    'type': row['qr_type'],
-                    'created': row['created_at'].isoformat(),
-                    'scans': row['scan_count'],
-                    'last_scan': row['last_scan'].isoformat() if row['last_scan'] else None
-                }
-                for row in cards
-            ]
-        })
+        with timed('cards'):
+            cur.execute(user_cards_page_sql(fields), {
+                'user_id': user_id,
+                'after': after,
+                'limit': limit + 1
+            })
+            cards = cur.fetchall()
         
+        with timed('render'):
+            response = jsonify(build_stats_payload(
+                user_id, totals, daily_stats, cards, limit, fields, regions, visitors
+            ))
+        return set_cache_headers(response, etag, last_modified)
+    
     except Exception as e:
         logger.error(f"Ошибка API статистики: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        cur.close()
-        conn.close()
+        if cur:
+            cur.close()
+        release_db_connection(conn)
 
 @app.route('/api/card/<token>')
 def api_card_info(token):
     """API для получения информации о визитке"""
-    conn = get_db_connection()
+    conn = get_read_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 503
     
+    cur = None
     try:
         cur = conn.cursor(cursor_factory=DictCursor)
         
-        cur.execute("""
-            SELECT 
-                bc.*,
-                u.username,
-                u.shop_name
-            FROM business_cards bc
-            JOIN users u ON bc.user_id = u.id
-            WHERE bc.token = %s
-        """, (token,))
-        
-        card = cur.fetchone()
+        with timed('lookup'):
+            cur.execute(CARD_INFO_SQL, {'token': token})
+            card = cur.fetchone()
         
         if not card:
             return jsonify({'error': 'Card not found'}), 404
         
-        # Получаем последние сканирования
-        cur.execute("""
-            SELECT 
-                scanned_at,
-                ip_address,
-                user_agent
-            FROM scans
-            WHERE card_id = %s
-            ORDER BY scanned_at DESC
-            LIMIT 20
-        """, (card['id'],))
-        
-        scans = cur.fetchall()
-        
-        return jsonify({
-            'id': card['id'],
-            'token': card['token'],
-            'type': card['qr_type'],
-            'created': card['created_at'].isoformat(),
-            'scans': card['scan_count'],
-            'last_scan': card['last_scan'].isoformat() if card['last_scan'] else None,
-            'shop_name': card['shop_name'],
-            'recent_scans': [
-                {
-                    'time': scan['scanned_at'].isoformat(),
-                    'ip': scan['ip_address']
-                }
-                for scan in scans
-            ]
-        })
+        # Последние сканирования: из буфера, для холодных визиток - из БД
+        with timed('scans'):
+            scans = recent_scans.get(card['id'], card['scan_count'])
+            if scans is None:
+                cur.execute(CARD_RECENT_SCANS_SQL, {'card_id': card['id'], 'limit': RECENT_SCANS_LIMIT})
+                scans = cur.fetchall()
+                if scans:
+                    recent_scans.fill(card['id'], scans[0]['card_scans'], scans)
         
+        with timed('render'):
+            return jsonify(card_to_dict(card, scans))
+    
     except Exception as e:
         logger.error(f"Ошибка API карточки: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
+        if cur:
+            cur.close()
+        release_db_connection(conn)
+
+def parse_batch_request():
+    """Извлечение списков токенов и id визиток из тела или параметров запроса"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        tokens = data.get('tokens') or []
+        ids = data.get('ids') or []
+    else:
+        tokens = request.args.get('tokens', '').split(',')
+        ids = request.args.get('ids', '').split(',')
+    
+    if not isinstance(tokens, list) or not isinstance(ids, list):
+        return None, None
+    
+    tokens = list(dict.fromkeys(str(t).strip() for t in tokens if str(t).strip()))
+    try:
+        ids = list(dict.fromkeys(int(i) for i in ids if str(i).strip()))
+    except (TypeError, ValueError):
+        return None, None
+    
+    return tokens, ids
+
+@app.route('/api/cards/batch', methods=['GET', 'POST'])
+def api_cards_batch():
+    """
+    Пакетное получение информации о визитках
+    
+    Принимает токены и/или id визиток (JSON {"tokens": [...], "ids": [...]}
+    или параметры ?tokens=a,b&ids=1,2) и отдает JSON-массив в формате
+    /api/card/<token>. Независимо от размера пакета выполняется два запроса:
+    визитки одним SELECT и последние сканирования одним LATERAL-запросом,
+    который читается серверным курсором и отдается потоком по мере готовности.
+    Визитки, чьи сканирования есть в recent_scans, в LATERAL-запрос не попадают.
+    Не найденные визитки возвращаются в конце массива с полем error.
+    """
+    tokens, ids = parse_batch_request()
+    
+    if tokens is None:
+        return jsonify({'error': 'Invalid tokens or ids'}), 400
+    
+    if not tokens and not ids:
+        return jsonify({'error': 'No tokens or ids given'}), 400
+    
+    if len(tokens) + len(ids) > BATCH_MAX_CARDS:
+        return jsonify({'error': f'Too many cards, max {BATCH_MAX_CARDS}'}), 400
+    
+    scans_limit = request.args.get('scans', RECENT_SCANS_LIMIT, type=int)
+    scans_limit = max(0, min(scans_limit, RECENT_SCANS_LIMIT))
+    
+    conn = get_read_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 503
+    
+    try:
+        with timed('lookup'):
+            cur = conn.cursor(cursor_factory=DictCursor)
+            cur.execute("""
+                SELECT 
+                    bc.id,
+                    bc.token,
+                    bc.qr_type,
+                    bc.created_at,
+                    bc.scan_count,
+                    bc.last_scan,
+                    u.shop_name
+                FROM business_cards bc
+                JOIN users u ON bc.user_id = u.id
+                WHERE bc.token = ANY(%s) OR bc.id = ANY(%s)
+                ORDER BY bc.id
+            """, (tokens, ids))
+            cards = cur.fetchall()
         cur.close()
-        conn.close()
+    except Exception as e:
+        logger.error(f"Ошибка пакетного API карточек: {e}")
+        release_db_connection(conn)
+        return jsonify({'error': str(e)}), 500
+    
+    buffered = {
+        card['id']: recent_scans.get(card['id'], card['scan_count'], scans_limit)
+        for card in cards
+    }
+    cold_ids = [card_id for card_id, scans in buffered.items() if scans is None]
+    
+    found_tokens = {card['token'] for card in cards}
+    found_ids = {card['id'] for card in cards}
+    missing = (
+        [{'token': t, 'error': 'Card not found'} for t in tokens if t not in found_tokens]
+        + [{'id': i, 'error': 'Card not found'} for i in ids if i not in found_ids]
+    )
+    
+    def generate():
+        scans_cur = None
+        try:
+            # Серверный курсор: строки приходят порциями, а не целиком
+            scans_cur = conn.cursor(name='batch_recent_scans', cursor_factory=DictCursor)
+            scans_cur.itersize = 1000
+            scans_cur.execute("""
+                SELECT c.id AS card_id, s.scanned_at, s.ip_address
+                FROM unnest(%s::int[]) AS c(id)
+                CROSS JOIN LATERAL (
+                    SELECT scanned_at, ip_address
+                    FROM scans
+                    WHERE card_id = c.id
+                    ORDER BY scanned_at DESC
+                    LIMIT %s
+                ) s
+                ORDER BY c.id, s.scanned_at DESC
+            """, (cold_ids, scans_limit))
+            
+            rows = iter(scans_cur)
+            pending = next(rows, None)
+            first = True
+            
+            yield '['
+            
+            # Визитки и сканирования отсортированы по id - сливаем два потока
+            for card in cards:
+                scans = buffered[card['id']]
+                if scans is None:
+                    scans = []
+                    while pending is not None and pending['card_id'] == card['id']:
+                        scans.append(pending)
+                        pending = next(rows, None)
+                
+                yield ('' if first else ',') + json.dumps(card_to_dict(card, scans), ensure_ascii=False)
+                first = False
+            
+            for item in missing:
+                yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+                first = False
+            
+            yield ']'
+        
+        except Exception as e:
+            logger.error(f"Ошибка потоковой выдачи пакета карточек: {e}")
+            raise
+        finally:
+            if scans_cur:
+                scans_cur.close()
+    
+    response = app.response_class(stream_with_context(generate()), mimetype='application/json')
+    # Соединение возвращается при закрытии ответа (после закрытия генератора):
+    # если клиент ушел до начала передачи, finally генератора не выполнится
+    response.call_on_close(lambda: release_db_connection(conn))
+    return response
+
+EXPORT_CHUNK_ROWS = 500
+# Начало сканирований, которые еще в scans (более ранние - в архивных файлах бота)
+EXPORT_ARCHIVED_BEFORE_SQL = """
+    SELECT (MAX(month) + INTERVAL '1 month')::timestamp FROM scan_archives
+"""
+EXPORT_COLUMNS = ['time', 'card_id', 'token', 'ip', 'user_agent', 'referer', 'region']
+
+def parse_export_date(value, end_of_day=False):
+    """
+    Разбор даты фильтра выгрузки (YYYY-MM-DD или ISO 8601)
+    
+    Время со смещением (+03:00, Z) переводится в UTC: scanned_at хранится
+    в UTC без часового пояса, и ::timestamp просто отбросил бы смещение.
+    """
+    if not value:
+        return None
+    
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(value) == 10:
+        # Дата без времени включает весь день
+        parsed += timedelta(days=1)
+    return parsed
+
+@app.route('/api/export/<int:user_id>/scans.csv')
+def export_user_scans(user_id):
+    """
+    Потоковая выгрузка сырых сканирований продавца в CSV
+    
+    Ссылку выдает бот (bot.utils.signing.export_url): без верной подписи sig
+    ответ 403, иначе сырые логи любого продавца отдавались бы по перебору id.
+    
+    Параметры запроса:
+        sig: подпись ссылки
+        from, to: границы периода (YYYY-MM-DD или ISO 8601; без смещения - UTC;
+                  to включительно)
+        card: токен визитки, если нужна выгрузка по одной визитке
+        gzip: 1 - отдать файл, сжатый gzip
+    
+    Строки читаются серверным курсором порциями и сразу уходят клиенту,
+    поэтому память не зависит от количества сканирований. Месяцы, перенесенные
+    в архив, в scans отсутствуют: период, который их захватывает (или без
+    from), отклоняется, а не выгружается молча без них.
+    """
+    if not verify(EXPORT, user_id, request.args.get('sig')):
+        return jsonify({'error': 'Invalid signature'}), 403
+    
+    try:
+        date_from = parse_export_date(request.args.get('from'))
+        date_to = parse_export_date(request.args.get('to'), end_of_day=True)
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    
+    card_token = request.args.get('card')
+    compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+    
+    conn = get_read_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 503
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute(EXPORT_ARCHIVED_BEFORE_SQL)
+            archived_before = cur.fetchone()[0]
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки сканирований пользователя {user_id}: {e}")
+        release_db_connection(conn)
+        return jsonify({'error': str(e)}), 500
+    
+    if archived_before is not None and (date_from is None or date_from < archived_before):
+        release_db_connection(conn)
+        return jsonify({
+            'error': f"Scans before {archived_before:%Y-%m-%d} are archived, "
+                     f"set from={archived_before:%Y-%m-%d} or later",
+            'archived_before': archived_before.date().isoformat()
+        }), 400
+    
+    def generate_rows():
+        cur = None
+        try:
+            cur = conn.cursor(name='scans_export')
+            cur.itersize = 2000
+            cur.execute("""
+                SELECT 
+                    s.scanned_at,
+                    s.card_id,
+                    bc.token,
+                    s.ip_address,
+                    s.user_agent,
+                    s.referer,
+                    s.region
+                FROM scans s
+                JOIN business_cards bc ON s.card_id = bc.id
+                WHERE bc.user_id = %s
+                    AND (%s IS NULL OR bc.token = %s)
+                    AND (%s::timestamp IS NULL OR s.scanned_at >= %s)
+                    AND (%s::timestamp IS NULL OR s.scanned_at < %s)
+                ORDER BY s.scanned_at, s.id
+            """, (user_id, card_token, card_token,
+                  date_from, date_from, date_to, date_to))
+            
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            
+            for i, row in enumerate(cur, 1):
+                scanned_at = row[0].isoformat() if row[0] else ''
+                writer.writerow([scanned_at, *row[1:]])
+                
+                if i % EXPORT_CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            
+            yield buffer.getvalue()
+        
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки сканирований пользователя {user_id}: {e}")
+            raise
+        finally:
+            if cur:
+                cur.close()
+    
+    def generate_gzip():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        rows = generate_rows()
+        try:
+            for chunk in rows:
+                data = compressor.compress(chunk.encode('utf-8'))
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            # Курсор закрывается до возврата соединения (call_on_close ниже)
+            rows.close()
+    
+    filename = f"scans_{user_id}.csv"
+    if compress:
+        body, mimetype, filename = generate_gzip(), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = generate_rows(), 'text/csv'
+    
+    response = app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Как в api_cards_batch: соединение возвращается и без запуска генератора
+    response.call_on_close(lambda: release_db_connection(conn))
+    return response
+
+# Живая лента сканирований
+LIVE_MAX_SUBSCRIBERS = int(os.getenv('WEB_LIVE_MAX_SUBSCRIBERS', 100))
+LIVE_HEARTBEAT_SECONDS = 15
+
+live_hub = LiveHub(LIVE_MAX_SUBSCRIBERS)
+
+@app.route('/api/live/<int:user_id>')
+def live_scans(user_id):
+    """
+    Живая лента сканирований визиток продавца (Server-Sent Events)
+    
+    События приходят из /go/<token> этого же процесса через live_hub,
+    поэтому открытая лента не нагружает БД. Каждое событие:
+        event: scan
+        data: {"card_id", "token", "scans", "time", "region"}
+    Если клиент не успевает читать, старые события выбрасываются, и перед
+    следующими приходит event: dropped с их количеством.
+    
+    Соединение занимает поток на все время подписки: под gunicorn нужны
+    потоковые воркеры (--threads) или асинхронный вариант web.async_app.
+    """
+    wakeup = threading.Event()
+    subscriber = live_hub.subscribe(user_id, wakeup.set)
+    if subscriber is None:
+        return jsonify({'error': 'Too many live subscribers'}), 503
+    
+    def generate():
+        try:
+            yield HEARTBEAT
+            while True:
+                if not wakeup.wait(LIVE_HEARTBEAT_SECONDS):
+                    yield HEARTBEAT
+                    continue
+                
+                wakeup.clear()
+                events, dropped = live_hub.drain(subscriber)
+                if events or dropped:
+                    yield format_events(events, dropped)
+        finally:
+            live_hub.unsubscribe(subscriber)
+    
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Если клиент ушел до начала передачи, finally генератора не выполнится
+    response.call_on_close(lambda: live_hub.unsubscribe(subscriber))
+    return response
+
+def cache_stats():
+    """Состояние кешей процесса для /metrics"""
+    geoip = lookup_prefix.cache_info()
+    return {
+        'collections': collection_cache.stats(),
+        'recent_scans': recent_scans.stats(),
+        'geoip': {'size': geoip.currsize, 'max': geoip.maxsize, 'hits': geoip.hits, 'misses': geoip.misses}
+    }
+
+@app.route('/metrics')
+def metrics():
+    """
+    Гистограммы времени по маршрутам и фазам, состояние кешей и пула БД
+    
+    Данные относятся к текущему процессу (каждый воркер gunicorn отдает свои).
+    """
+    return jsonify({
+        'pid': os.getpid(),
+        'latency_ms': registry.snapshot(),
+        'caches': cache_stats(),
+        'live': live_hub.stats(),
+        'db_pool': db_pool.stats() if db_pool else None,
+        'read_pool': read_pool.stats() if read_pool else None,
+        'replica': replica_guard.stats() if DATABASE_REPLICA_URL else None
+    })
 
 @app.errorhandler(404)
 def not_found(e):
     """Обработчик 404 ошибки"""
-    return render_template_string("""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Страница не найдена</title>
-            <meta charset="utf-8">
-            <style>
-                body { font-family: Arial, sans-serif; text-align: center; padding: 50px; }
-                h1 { color: #666; }
-            </style>
-        </head>
-        <body>
-            <h1>404 - Страница не найдена</h1>
-            <p>Запрашиваемая страница не существует.</p>
-        </body>
-        </html>
-    """), 404
+    return render_template_string(NOT_FOUND_PAGE), 404
 
 @app.errorhandler(500)
 def internal_error(e):
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный вариант редирект-сервиса (aiohttp + asyncpg)
+
+Повторяет /go/<token>, /collection/<id>, /api/stats/<user_id>, /api/card/<token>,
+/api/live/<user_id> и /metrics из
+web/app.py с теми же ответами, но обслуживает все запросы в одном
+событийном цикле: ожидание Postgres не занимает поток, а соединения
+берутся из общего пула asyncpg. SQL, шаблоны и сериализация общие
+с web/app.py.
+
+Запуск:
+    python -m web.async_app
+    gunicorn web.async_app:create_app --worker-class aiohttp.GunicornWebWorker
+"""
+
+import os
+import re
+import gzip
+import asyncio
+import logging
+from datetime import datetime
+from functools import lru_cache
+from contextlib import asynccontextmanager
+
+import asyncpg
+from aiohttp.web import Application, Response, StreamResponse, middleware, run_app, HTTPNotFound, HTTPFound
+from jinja2 import Environment
+
+from web.app import (
+    app as flask_app, DATABASE_URL, DATABASE_REPLICA_URL, DB_POOL_TIMEOUT, replica_guard,
+    CARD_NOT_FOUND_PAGE, REDIRECT_PAGE, NOT_FOUND_PAGE, COLLECTION_PAGE, CARD_FIELDS,
+    CARD_LOOKUP_SQL, COLLECTION_SQL, SCAN_COUNTER_SQL, SCAN_INGEST_SQL, USER_TOTALS_SQL, USER_DAILY_SQL,
+    USER_VISITORS_SQL, USER_REGIONS_SQL, TOP_REGIONS_LIMIT, CARD_INFO_SQL, CARD_RECENT_SCANS_SQL, RECENT_SCANS_LIMIT,
+    COLLECTION_MAX_AGE, COLLECTION_FALLBACK_URL, collection_cache, collection_context, recent_scans, cache_stats,
+    live_hub, live_event, LIVE_HEARTBEAT_SECONDS,
+    client_ip, scan_params, determine_target_url, add_utm_params,
+    parse_stats_args, user_cards_page_sql, stats_validators,
+    visitor_sketches, build_stats_payload, card_to_dict, should_compress
+)
+from web.metrics import RequestTimer, registry
+from web.live import format_events, HEARTBEAT
+from bot.utils.replica import REPLICATION_LAG_SQL
+
+logger = logging.getLogger(__name__)
+
+# Размер пула соединений с БД
+POOL_MIN_SIZE = int(os.getenv('ASYNC_DB_POOL_MIN', 2))
+POOL_MAX_SIZE = int(os.getenv('ASYNC_DB_POOL_MAX', 20))
+
+# БД недоступна (ответ 503): нет соединения или пул занят дольше DB_POOL_TIMEOUT
+DB_UNAVAILABLE = (OSError, asyncpg.exceptions.CannotConnectNowError, asyncio.TimeoutError)
+
+# Шаблоны с автоэкранированием, как у Flask render_template_string
+jinja_env = Environment(autoescape=True)
+card_not_found_template = jinja_env.from_string(CARD_NOT_FOUND_PAGE)
+redirect_template = jinja_env.from_string(REDIRECT_PAGE)
+not_found_template = jinja_env.from_string(NOT_FOUND_PAGE)
+collection_template = jinja_env.from_string(COLLECTION_PAGE)
+
+_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+@lru_cache(maxsize=256)
+def to_asyncpg(sql):
+    """
+    Перевод запроса из стиля psycopg2 (%(name)s) в стиль asyncpg ($1)
+    
+    Returns:
+        (текст запроса, порядок имен параметров)
+    """
+    names = []
+    
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+    
+    return _PARAM_RE.sub(replace, sql), tuple(names)
+
+def bind(sql, params):
+    """Аргументы для conn.fetch/execute: запрос asyncpg и позиционные параметры"""
+    text, names = to_asyncpg(sql)
+    return (text, *(params[name] for name in names))
+
+def html_response(body, status=200):
+    return Response(text=body, status=status, content_type='text/html')
+
+def json_response(payload, request, status=200):
+    """JSON-ответ в том же виде, что и jsonify во Flask-версии"""
+    data = (flask_app.json.dumps(payload, separators=(',', ':')) + '\n').encode('utf-8')
+    response = Response(body=data, status=status, content_type='application/json')
+    
+    if status == 200 and should_compress(request.headers.get('Accept-Encoding'), data):
+        response.body = gzip.compress(data, compresslevel=5)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    
+    return response
+
+class StatsArgs:
+    """Обертка над query-параметрами aiohttp с интерфейсом werkzeug args.get(type=...)"""
+    
+    def __init__(self, query):
+        self.query = query
+    
+    def get(self, key, default=None, type=None):
+        value = self.query.get(key)
+        if value is None:
+            return default
+        if type is None:
+            return value
+        try:
+            return type(value)
+        except (TypeError, ValueError):
+            return default
+
+def not_modified(request, etag, last_modified):
+    """Проверка условного запроса (If-None-Match / If-Modified-Since)"""
+    if request.if_none_match:
+        return any(tag.value in (etag, '*') for tag in request.if_none_match)
+    
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    
+    return False
+
+def set_cache_headers(response, etag, last_modified):
+    """Заголовки для условных запросов: клиент всегда перепроверяет ответ"""
+    response.headers['ETag'] = f'W/"{etag}"'
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def timed(request, phase):
+    """Замер фазы запроса (Server-Timing и гистограммы /metrics)"""
+    return request['timer'].phase(phase)
+
+@asynccontextmanager
+async def acquire(request):
+    """Соединение из пула с замером ожидания (фаза connect), не дольше DB_POOL_TIMEOUT"""
+    pool = request.app['db_pool']
+    with timed(request, 'connect'):
+        conn = await pool.acquire(timeout=DB_POOL_TIMEOUT)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+@asynccontextmanager
+async def acquire_read(request):
+    """
+    Соединение для API чтения: с реплики, если она доступна и не отстает
+    (см. web.app.get_read_connection), иначе из основного пула
+    """
+    read_pool = request.app.get('read_pool')
+    conn = None
+    if read_pool is not None and (replica_guard.healthy or replica_guard.due()):
+        try:
+            with timed(request, 'connect'):
+                conn = await read_pool.acquire(timeout=DB_POOL_TIMEOUT)
+            if replica_guard.due():
+                replica_guard.record(float(await conn.fetchval(REPLICATION_LAG_SQL)))
+        except Exception as e:
+            replica_guard.fail(e)
+    
+    if read_pool is not None and not replica_guard.use() and conn is not None:
+        await read_pool.release(conn)
+        conn = None
+    
+    if conn is None:
+        async with acquire(request) as conn:
+            yield conn
+        return
+    
+    try:
+        yield conn
+    finally:
+        await read_pool.release(conn)
+
+async def health(request):
+    """Эндпоинт для проверки здоровья сервиса"""
+    return json_response({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat()
+    }, request)
+
+async def track_and_redirect(request):
+    """Отслеживание перехода по QR-коду и редирект"""
+    token = request.match_info['token']
+    
+    try:
+        async with acquire(request) as conn:
+            with timed(request, 'lookup'):
+                card = await conn.fetchrow(*bind(CARD_LOOKUP_SQL, {'token': token}))
+            
+            if not card:
+                logger.warning(f"Токен не найден: {token}")
+                return html_response(card_not_found_template.render(), status=404)
+            
+            ip_address = client_ip(request.headers.get('X-Forwarded-For'), request.remote)
+            params = scan_params(
+                card,
+                ip_address,
+                request.headers.get('User-Agent', ''),
+                request.headers.get('Referer', '')
+            )
+            
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                with timed(request, 'insert'):
+                    scan_seq, scanned_at = await conn.fetchrow(*bind(SCAN_COUNTER_SQL, params))
+                    for sql in SCAN_INGEST_SQL:
+                        await conn.execute(*bind(sql, params))
+            except Exception:
+                await transaction.rollback()
+                raise
+            
+            with timed(request, 'commit'):
+                await transaction.commit()
+            
+            recent_scans.record(card['card_id'], scan_seq, scanned_at, ip_address)
+            live_hub.publish(card['user_id'], live_event(card, token, scan_seq, scanned_at, params))
+        
+        logger.info(f"Переход по токену {token}: card_id={card['card_id']}, ip={ip_address}")
+        
+        target_url = add_utm_params(determine_target_url(card), card)
+        
+        with timed(request, 'render'):
+            return html_response(redirect_template.render(
+                target_url=target_url,
+                shop_name=card['shop_name'] or 'Магазин'
+            ))
+    
+    except DB_UNAVAILABLE as e:
+        logger.error(f"Ошибка подключения к БД: {e}")
+        return Response(text="Service unavailable", status=503)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке токена {token}: {e}")
+        return Response(text="Internal server error", status=500)
+
+async def collection_page(request):
+    """Страница подборки товаров (см. web.app.collection_page)"""
+    collection_id = request.match_info['collection_id']
+    page = collection_cache.get(collection_id)
+    
+    if page is None:
+        try:
+            async with acquire(request) as conn:
+                with timed(request, 'lookup'):
+                    row = await conn.fetchrow(*bind(COLLECTION_SQL, {'collection_id': collection_id}))
+        except DB_UNAVAILABLE:
+            return Response(text="Service unavailable", status=503)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки подборки {collection_id}: {e}")
+            return Response(text="Internal server error", status=500)
+        
+        if not row:
+            raise HTTPFound(COLLECTION_FALLBACK_URL)
+        
+        with timed(request, 'render'):
+            page = collection_template.render(**collection_context(row))
+        collection_cache.put(collection_id, page)
+    
+    response = html_response(page)
+    response.headers['Cache-Control'] = f'public, max-age={COLLECTION_MAX_AGE}'
+    return response
+
+async def api_user_stats(request):
+    """API для получения статистики пользователя (см. web.app.api_user_stats)"""
+    user_id = int(request.match_info['user_id'])
+    
+    parsed = parse_stats_args(StatsArgs(request.query))
+    if parsed is None:
+        return json_response({
+            'error': f"Unknown field, allowed: {', '.join(CARD_FIELDS)}"
+        }, request, status=400)
+    
+    days, limit, after, fields = parsed
+    
+    try:
+        async with acquire_read(request) as conn:
+            with timed(request, 'lookup'):
+                totals = await conn.fetchrow(*bind(USER_TOTALS_SQL, {'user_id': user_id}))
+            
+            etag, last_modified = stats_validators(user_id, totals, days, limit, after, fields)
+            
+            if not_modified(request, etag, last_modified):
+                return set_cache_headers(Response(status=304), etag, last_modified)
+            
+            with timed(request, 'visitors'):
+                visitors = visitor_sketches(await conn.fetch(
+                    *bind(USER_VISITORS_SQL, {'user_id': user_id, 'days': days})
+                ))
+            
+            daily_stats = []
+            regions = []
+            if days:
+                with timed(request, 'daily'):
+                    daily_stats = await conn.fetch(
+                        *bind(USER_DAILY_SQL, {'user_id': user_id, 'days': days})
+                    )
+                    regions = await conn.fetch(*bind(USER_REGIONS_SQL, {
+                        'user_id': user_id,
+                        'days': days,
+                        'limit': TOP_REGIONS_LIMIT
+                    }))
+            
+            with timed(request, 'cards'):
+                cards = await conn.fetch(*bind(user_cards_page_sql(fields), {
+                    'user_id': user_id,
+                    'after': after,
+                    'limit': limit + 1
+                }))
+        
+        with timed(request, 'render'):
+            response = json_response(
+                build_stats_payload(user_id, totals, daily_stats, cards, limit, fields, regions, visitors),
+                request
+            )
+        return set_cache_headers(response, etag, last_modified)
+    
+    except DB_UNAVAILABLE:
+        return json_response({'error': 'Database connection failed'}, request, status=503)
+    except Exception as e:
+        logger.error(f"Ошибка API статистики: {e}")
+        return json_response({'error': str(e)}, request, status=500)
+
+async def api_card_info(request):
+    """API для получения информации о визитке"""
+    token = request.match_info['token']
+    
+    try:
+        async with acquire_read(request) as conn:
+            with timed(request, 'lookup'):
+                card = await conn.fetchrow(*bind(CARD_INFO_SQL, {'token': token}))
+            
+            if not card:
+                return json_response({'error': 'Card not found'}, request, status=404)
+            
+            with timed(request, 'scans'):
+                scans = recent_scans.get(card['id'], card['scan_count'])
+                if scans is None:
+                    scans = await conn.fetch(*bind(CARD_RECENT_SCANS_SQL, {
+                        'card_id': card['id'],
+                        'limit': RECENT_SCANS_LIMIT
+                    }))
+                    if scans:
+                        recent_scans.fill(card['id'], scans[0]['card_scans'], scans)
+        
+        with timed(request, 'render'):
+            return json_response(card_to_dict(card, scans), request)
+    
+    except DB_UNAVAILABLE:
+        return json_response({'error': 'Database connection failed'}, request, status=503)
+    except Exception as e:
+        logger.error(f"Ошибка API карточки: {e}")
+        return json_response({'error': str(e)}, request, status=500)
+
+async def live_scans(request):
+    """Живая лента сканирований продавца (см. web.app.live_scans)"""
+    user_id = int(request.match_info['user_id'])
+    
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    subscriber = live_hub.subscribe(user_id, lambda: loop.call_soon_threadsafe(wakeup.set))
+    if subscriber is None:
+        return json_response({'error': 'Too many live subscribers'}, request, status=503)
+    
+    response = StreamResponse(headers={
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    
+    try:
+        await response.prepare(request)
+        await response.write(HEARTBEAT.encode('utf-8'))
+        
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(HEARTBEAT.encode('utf-8'))
+                continue
+            
+            wakeup.clear()
+            events, dropped = live_hub.drain(subscriber)
+            if events or dropped:
+                await response.write(format_events(events, dropped).encode('utf-8'))
+    except (ConnectionResetError, asyncio.CancelledError):
+        # Клиент закрыл соединение
+        pass
+    finally:
+        live_hub.unsubscribe(subscriber)
+    
+    return response
+
+async def metrics(request):
+    """Гистограммы времени, кеши и пул соединений процесса (см. web.app.metrics)"""
+    pool = request.app['db_pool']
+    return json_response({
+        'pid': os.getpid(),
+        'latency_ms': registry.snapshot(),
+        'caches': cache_stats(),
+        'live': live_hub.stats(),
+        'db_pool': {
+            'min': pool.get_min_size(),
+            'max': pool.get_max_size(),
+            'size': pool.get_size(),
+            'idle': pool.get_idle_size()
+        },
+        'replica': replica_guard.stats() if DATABASE_REPLICA_URL else None
+    }, request)
+
+@middleware
+async def server_timing(request, handler):
+    """Заголовок Server-Timing и запись фаз запроса в гистограммы"""
+    request['timer'] = timer = RequestTimer()
+    response = await handler(request)
+    
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource else 'unmatched'
+    server_timing = timer.finish(route)
+    # У потоковых ответов заголовки уже отправлены
+    if not response.prepared:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+@middleware
+async def error_pages(request, handler):
+    """HTML-страница 404, как во Flask-версии"""
+    try:
+        return await handler(request)
+    except HTTPNotFound:
+        return html_response(not_found_template.render(), status=404)
+
+async def open_db_pool(app):
+    app['db_pool'] = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE
+    )
+    logger.info(f"Пул соединений с БД открыт ({POOL_MIN_SIZE}-{POOL_MAX_SIZE})")
+    
+    if DATABASE_REPLICA_URL:
+        # min_size=0: недоступная реплика не мешает запуску, чтение уйдет на основную БД
+        app['read_pool'] = await asyncpg.create_pool(
+            DATABASE_REPLICA_URL,
+            min_size=0,
+            max_size=POOL_MAX_SIZE
+        )
+        logger.info("Пул соединений с репликой открыт")
+
+async def close_db_pool(app):
+    await app['db_pool'].close()
+    if 'read_pool' in app:
+        await app['read_pool'].close()
+
+def create_app():
+    """Создание aiohttp-приложения"""
+    app = Application(middlewares=[server_timing, error_pages])
+    app.on_startup.append(open_db_pool)
+    app.on_cleanup.append(close_db_pool)
+    
+    app.router.add_get('/health', health)
+    app.router.add_get('/go/{token}', track_and_redirect)
+    app.router.add_get('/collection/{collection_id}', collection_page)
+    app.router.add_get(r'/api/stats/{user_id:\d+}', api_user_stats)
+    app.router.add_get('/api/card/{token}', api_card_info)
+    app.router.add_get(r'/api/live/{user_id:\d+}', live_scans)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    
+    logger.info(f"Запуск асинхронного веб-сервиса на порту {port}")
+    run_app(create_app(), host='0.0.0.0', port=port)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+Локальное определение региона по IP (GeoIP)
+
+Используется база MaxMind (GeoLite2-City / GeoIP2-City) в формате .mmdb,
+открытая через mmap: поиск идет по отображенному в память файлу без
+сетевых запросов и без загрузки всей базы в кучу. Результаты кешируются
+по префиксу сети (/24 для IPv4, /48 для IPv6), поэтому повторные
+переходы из одной сети обходятся словарным поиском.
+
+Регион хранится в виде компактного кода ISO 3166-2 (например, RU-MOW),
+а если субъект неизвестен - кода страны (RU).
+
+Модуль необязателен: без пакета maxminddb или без файла базы
+region_for() всегда возвращает None.
+"""
+
+import os
+import logging
+import ipaddress
+from functools import lru_cache
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+logger = logging.getLogger(__name__)
+
+GEOIP_DB_PATH = os.getenv('GEOIP_DB_PATH')
+GEOIP_CACHE_SIZE = int(os.getenv('GEOIP_CACHE_SIZE', 65536))
+
+# Длина префикса сети, по которой кешируется результат
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+def open_reader(path):
+    """Открытие базы через mmap (None, если база недоступна)"""
+    if not path:
+        return None
+    
+    if maxminddb is None:
+        logger.warning("GEOIP_DB_PATH задан, но пакет maxminddb не установлен")
+        return None
+    
+    try:
+        reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        logger.info(f"GeoIP база открыта: {path} ({reader.metadata().database_type})")
+        return reader
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось открыть GeoIP базу {path}: {e}")
+        return None
+
+reader = open_reader(GEOIP_DB_PATH)
+
+def region_code(record):
+    """Код региона из записи базы City/Country"""
+    if not record:
+        return None
+    
+    country = (record.get('country') or record.get('registered_country') or {}).get('iso_code')
+    if not country:
+        return None
+    
+    subdivisions = record.get('subdivisions')
+    if subdivisions and subdivisions[0].get('iso_code'):
+        return f"{country}-{subdivisions[0]['iso_code']}"[:10]
+    
+    return country
+
+# Маски сетей для ключа кеша
+IPV4_MASK = ~((1 << (32 - IPV4_PREFIX)) - 1)
+IPV6_MASK = ~((1 << (128 - IPV6_PREFIX)) - 1)
+
+def network_prefix(ip_address):
+    """Адрес сети, к которой относится IP (ключ кеша), или None для мусора"""
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    
+    if not address.is_global:
+        return None
+    
+    if address.version == 4:
+        return ipaddress.IPv4Address(int(address) & IPV4_MASK)
+    return ipaddress.IPv6Address(int(address) & IPV6_MASK)
+
+@lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def lookup_prefix(prefix):
+    """Регион для сети (кешируется)"""
+    try:
+        return region_code(reader.get(prefix))
+    except (ValueError, maxminddb.InvalidDatabaseError) as e:
+        logger.warning(f"Ошибка GeoIP для {prefix}: {e}")
+        return None
+
+def region_for(ip_address):
+    """
+    Код региона для IP клиента
+    
+    Returns:
+        Код вида 'RU-MOW' / 'RU' или None (нет базы, приватный или неизвестный адрес)
+    """
+    if reader is None or not ip_address:
+        return None
+    
+    prefix = network_prefix(ip_address)
+    if prefix is None:
+        return None
+    
+    return lookup_prefix(prefix)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Живая лента сканирований (Server-Sent Events)
+
+LiveHub раздает события сканирований подписчикам продавца прямо из пути
+записи (/go/<token>), без обращений к БД. У каждого подписчика свой
+ограниченный буфер: при переполнении выбрасываются самые старые события,
+а их количество сообщается клиенту, поэтому медленный клиент не
+задерживает запись сканирований и не раздувает память.
+
+Хаб живет в памяти процесса: подписчик видит сканирования, записанные
+тем же процессом сервиса.
+"""
+
+import json
+import threading
+from collections import deque
+
+# Размер буфера одного подписчика
+LIVE_BUFFER_SIZE = 100
+
+class Subscriber:
+    """Подписка на события одного продавца"""
+    
+    def __init__(self, user_id, wakeup, size=LIVE_BUFFER_SIZE):
+        self.user_id = user_id
+        self.events = deque(maxlen=size)
+        self.dropped = 0
+        # Вызывается после добавления события (из любого потока)
+        self.wakeup = wakeup
+    
+    def drain(self):
+        """Накопленные события и число выброшенных с прошлого вызова"""
+        events = list(self.events)
+        self.events.clear()
+        dropped, self.dropped = self.dropped, 0
+        return events, dropped
+
+class LiveHub:
+    """Раздача событий подписчикам по user_id"""
+    
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.dropped = 0
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+    
+    def subscribe(self, user_id, wakeup):
+        """Новая подписка или None, если достигнут лимит подписчиков"""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(user_id, wakeup)
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+            self._count += 1
+            return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id)
+            if subscribers and subscriber in subscribers:
+                subscribers.discard(subscriber)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscriber.user_id]
+    
+    def publish(self, user_id, event):
+        """Событие всем подписчикам продавца (O(1), если подписчиков нет)"""
+        if user_id not in self._subscribers:
+            return
+        
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            for subscriber in subscribers:
+                if len(subscriber.events) == subscriber.events.maxlen:
+                    subscriber.dropped += 1
+                    self.dropped += 1
+                subscriber.events.append(event)
+            self.published += 1
+        
+        for subscriber in subscribers:
+            subscriber.wakeup()
+    
+    def drain(self, subscriber):
+        with self._lock:
+            return subscriber.drain()
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'sellers': len(self._subscribers),
+                'max': self.max_subscribers,
+                'published': self.published,
+                'dropped': self.dropped
+            }
+
+def format_sse(event, data, event_id=None):
+    """Сообщение в формате text/event-stream"""
+    message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message + "\n"
+
+def format_events(events, dropped):
+    """Сообщения SSE для пачки событий подписчика"""
+    chunks = []
+    if dropped:
+        chunks.append(format_sse('dropped', {'count': dropped}))
+    for event in events:
+        chunks.append(format_sse('scan', event, f"{event['card_id']}:{event['scans']}"))
+    return ''.join(chunks)
+
+# Комментарий SSE, чтобы прокси не закрывали простаивающее соединение
+HEARTBEAT = ": ping\n\n"
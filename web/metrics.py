@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Замеры времени обработки запросов редирект-сервиса
+
+RequestTimer собирает длительности фаз одного запроса (подключение к БД,
+поиск, запись, коммит, рендеринг) и отдает их клиенту в заголовке
+Server-Timing. Те же длительности копятся в гистограммах процесса
+(по маршруту и фазе), которые выводит /metrics.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+from bot.utils.histogram import Histogram
+
+class Registry:
+    """Гистограммы процесса по (маршрут, фаза)"""
+    
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+    
+    def histogram(self, route, phase):
+        key = (route, phase)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+    
+    def snapshot(self):
+        with self._lock:
+            items = sorted(self._histograms.items())
+        
+        result = {}
+        for (route, phase), histogram in items:
+            result.setdefault(route, {})[phase] = histogram.snapshot()
+        return result
+
+registry = Registry()
+
+class RequestTimer:
+    """Длительности фаз одного запроса"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+    
+    @contextmanager
+    def phase(self, name):
+        """Замер фазы: with timer.phase('lookup'): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, (time.perf_counter() - started) * 1000))
+    
+    def finish(self, route):
+        """
+        Запись фаз и общего времени в гистограммы маршрута
+        
+        Returns:
+            Значение заголовка Server-Timing
+        """
+        total_ms = (time.perf_counter() - self.started) * 1000
+        
+        entries = []
+        for name, duration_ms in self.phases:
+            registry.histogram(route, name).observe(duration_ms)
+            entries.append(f"{name};dur={duration_ms:.2f}")
+        
+        registry.histogram(route, 'total').observe(total_ms)
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ', '.join(entries)